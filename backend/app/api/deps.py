@@ -1,29 +1,200 @@
-from fastapi import HTTPException, Depends
-from sqlalchemy.orm import Session
+import time
+from typing import Optional
+from fastapi import HTTPException, Depends, Query
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, make_transient_to_detached
 from fastapi.security import OAuth2PasswordBearer
 from jose import jwt, JWTError
+from app.core.cache import LRUTTLCache
 from app.core.config import settings
-from app.core.security import ALGORITHM
-from app.db.session import get_db
+from app.core.security import ALGORITHM, STREAM_TOKEN_SCOPE
+from app.db.sharding import shard_router
 from app.models.user import User
+from app.utils.revision import replica_is_current, replica_is_current_async
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/v1/auth/login")
+optional_oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/v1/auth/login", auto_error=False)
 
-def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)) -> User:
-    credentials_exception = HTTPException(
+# Columns that never change after signup, the only ones safe to share across requests
+USER_CACHE_COLUMNS = ("id", "email", "created_at")
+
+class PrincipalCache:
+    """
+    Caches verified JWTs (token -> user id) and the immutable part of user rows
+    (user id -> USER_CACHE_COLUMNS) so authenticated requests skip both the JWT
+    decode and the users lookup.
+
+    Mutable columns - the auth hash, salt, wrapped key and revision counters - are
+    never cached: they are left unloaded on the merged row and read from the
+    database on first access. A key rotation or password change on one worker is
+    therefore seen by every other worker at once, with no cross-worker invalidation.
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.tokens = LRUTTLCache(maxsize, ttl)
+        self.users = LRUTTLCache(maxsize, ttl)
+
+    def get_token_subject(self, token: str):
+        return self.tokens.get(token)
+
+    def set_token_subject(self, token: str, user_id: str, expires_at: float):
+        # Never serve a token from cache past its own expiry
+        remaining = expires_at - time.time()
+        if remaining > 0:
+            self.tokens.set(token, user_id, ttl=remaining)
+
+    def get_user_values(self, user_id: str):
+        return self.users.get(user_id)
+
+    def get_user(self, db: Session, user_id: str):
+        values = self.users.get(user_id)
+        if values is None:
+            return None
+        # Rebuild a detached row and attach it to this request's session without a query;
+        # the columns left out are expired and load fresh if the endpoint touches them
+        user = User(**values)
+        make_transient_to_detached(user)
+        return db.merge(user, load=False)
+
+    def set_user(self, user: User):
+        values = {key: getattr(user, key) for key in USER_CACHE_COLUMNS}
+        self.users.set(user.id, values)
+
+    def invalidate_user(self, user_id: str):
+        self.users.delete(user_id)
+
+    def stats(self) -> dict:
+        return {"tokens": self.tokens.stats(), "users": self.users.stats()}
+
+principal_cache = PrincipalCache(settings.PRINCIPAL_CACHE_SIZE, settings.PRINCIPAL_CACHE_TTL)
+
+def _credentials_exception() -> HTTPException:
+    return HTTPException(
         status_code=401,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
+
+def _resolve_token_subject(token: str, scope: Optional[str] = None) -> str:
+    """
+    User id of a valid token. 'scope' must match the token's own: access tokens
+    have none, so a stream token can't stand in for one or vice versa.
+    """
+    cache_key = token if scope is None else (scope, token)
+    user_id = principal_cache.get_token_subject(cache_key)
+    if user_id is not None:
+        return user_id
     try:
         payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[ALGORITHM])
         user_id: str = payload.get("sub")
-        if user_id is None:
-            raise credentials_exception
+        if user_id is None or payload.get("scope") != scope:
+            raise _credentials_exception()
     except JWTError:
-        raise credentials_exception
-        
+        raise _credentials_exception()
+    principal_cache.set_token_subject(cache_key, user_id, payload.get("exp", 0))
+    return user_id
+
+def get_user_db(token: str = Depends(oauth2_scheme)):
+    """
+    Session on the database holding the caller's rows: their shard when sharding
+    is configured, otherwise the one database.
+    """
+    db = shard_router.session_factory(_resolve_token_subject(token))()
+    try:
+        yield db
+    finally:
+        db.close()
+
+async def get_async_user_db(token: str = Depends(oauth2_scheme)):
+    async with shard_router.session_factory(_resolve_token_subject(token), use_async=True)() as db:
+        yield db
+
+def get_read_db(token: str = Depends(oauth2_scheme)):
+    """
+    Session for read-only endpoints: the read replica, unless it hasn't caught up
+    with this user's latest write yet.
+    """
+    user_id = _resolve_token_subject(token)
+    db = shard_router.read_session_factory(user_id)()
+    try:
+        if shard_router.uses_replica and not replica_is_current(db, User.id == user_id):
+            db.close()
+            db = shard_router.session_factory(user_id)()
+        yield db
+    finally:
+        db.close()
+
+async def get_async_read_db(token: str = Depends(oauth2_scheme)):
+    user_id = _resolve_token_subject(token)
+    async with shard_router.read_session_factory(user_id, use_async=True)() as db:
+        if not shard_router.uses_replica or await replica_is_current_async(db, User.id == user_id):
+            yield db
+            return
+    async with shard_router.session_factory(user_id, use_async=True)() as db:
+        yield db
+
+def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_user_db)) -> User:
+    user_id = _resolve_token_subject(token)
+
+    user = principal_cache.get_user(db, user_id)
+    if user is not None:
+        return user
+
     user = db.query(User).filter(User.id == user_id).first()
     if user is None:
-        raise credentials_exception
+        raise _credentials_exception()
+    principal_cache.set_user(user)
     return user
+
+async def get_current_user_async(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_async_user_db)) -> User:
+    user_id = _resolve_token_subject(token)
+
+    values = principal_cache.get_user_values(user_id)
+    if values is not None:
+        user = User(**values)
+        make_transient_to_detached(user)
+        return await db.merge(user, load=False)
+
+    user = (await db.execute(select(User).where(User.id == user_id))).scalars().first()
+    if user is None:
+        raise _credentials_exception()
+    principal_cache.set_user(user)
+    return user
+
+def _existing_user_id(user_id: str) -> str:
+    # Also fails fast (503) while the user is being moved between shards
+    session_factory = shard_router.session_factory(user_id)
+    if principal_cache.get_user_values(user_id) is None:
+        db = session_factory()
+        try:
+            user = db.query(User).filter(User.id == user_id).first()
+            if user is None:
+                raise _credentials_exception()
+            principal_cache.set_user(user)
+        finally:
+            db.close()
+    return user_id
+
+def get_current_user_id(token: str = Depends(oauth2_scheme)) -> str:
+    """
+    Authenticates a long-running (streamed) request without holding a database
+    session for its lifetime. Header bearer tokens only.
+    """
+    return _existing_user_id(_resolve_token_subject(token))
+
+def get_stream_user_id(
+    token: Optional[str] = Depends(optional_oauth2_scheme),
+    stream_token: Optional[str] = Query(
+        None, alias="token", description="From POST /vault/events/token, for EventSource clients, which cannot send headers"
+    )
+) -> str:
+    """
+    Like get_current_user_id, but also accepts a stream token in the query string.
+    Access tokens are never taken from the URL.
+    """
+    if token:
+        return _existing_user_id(_resolve_token_subject(token))
+    if stream_token:
+        return _existing_user_id(_resolve_token_subject(stream_token, scope=STREAM_TOKEN_SCOPE))
+    raise _credentials_exception()
@@ -0,0 +1,302 @@
+import asyncio
+import datetime
+import hashlib
+import json
+import time
+from contextvars import ContextVar
+from typing import Callable, Dict, NamedTuple, Optional, Tuple
+from fastapi import HTTPException, Request, Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse
+from fastapi.security.utils import get_authorization_scheme_param
+from sqlalchemy import delete, event, select, tuple_, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from app.core.cache import LRUTTLCache
+from app.core.config import settings
+from app.db.sharding import shard_router
+from app.models.idempotency import IdempotencyKey
+from app.api.deps import _resolve_token_subject
+from app.utils.revision import PENDING_VAULT_REVISIONS, make_etag
+from app.utils.wire import NegotiatedRoute
+
+IDEMPOTENCY_HEADER = "idempotency-key"
+MAX_KEY_LENGTH = 255
+# Headers that describe the stored body and go out again on replay
+REPLAYED_HEADERS = ("content-type", "content-encoding", "vary", "etag")
+
+class StoredResponse(NamedTuple):
+    fingerprint: bytes
+    status_code: int
+    headers: Dict[str, str]
+    body: bytes
+
+# Outcomes of IdempotencyStore.claim()
+CLAIMED, PENDING, COMPLETED = "claimed", "pending", "completed"
+
+# (user_id, key) of the claim the current request runs under; the endpoint's threadpool
+# call inherits it
+_current_claim: ContextVar[Optional[Tuple[str, str]]] = ContextVar("idempotency_claim", default=None)
+
+def _utcnow() -> datetime.datetime:
+    return datetime.datetime.utcnow()
+
+class IdempotencyStore:
+    """
+    Two tiers: completed responses are kept in a per-worker LRU (no query for a
+    retry that lands on the same worker) and in the idempotency_keys table on the
+    user's shard, which is also where concurrent requests claim a key first.
+    """
+
+    def __init__(self, cache_size: int, ttl: int):
+        self.ttl = ttl
+        self.memory = LRUTTLCache(cache_size, ttl)
+
+    def cached(self, user_id: str, key: str) -> Optional[StoredResponse]:
+        return self.memory.get((user_id, key))
+
+    def claim(self, user_id: str, key: str, fingerprint: bytes) -> Tuple[str, Optional[StoredResponse]]:
+        """
+        Inserts a pending row for the key. Returns (CLAIMED, None) when this request
+        should run, (COMPLETED, response) to replay, or (PENDING, None) while another
+        request with the key is still running.
+        """
+        now = _utcnow()
+        db = shard_router.session_factory(user_id)()
+        try:
+            abandoned_before = now - datetime.timedelta(seconds=settings.IDEMPOTENCY_PENDING_TIMEOUT)
+            # An expired key, or a claim abandoned by a crashed worker before its write
+            # committed, may run again (the retention worker sweeps the rest)
+            db.execute(delete(IdempotencyKey).where(
+                IdempotencyKey.user_id == user_id, IdempotencyKey.key == key,
+                (IdempotencyKey.expires_at <= now) | (
+                    IdempotencyKey.status_code.is_(None) & IdempotencyKey.applied_revision.is_(None)
+                    & (IdempotencyKey.created_at <= abandoned_before)
+                )
+            ))
+            db.add(IdempotencyKey(
+                user_id=user_id, key=key, fingerprint=fingerprint,
+                created_at=now, expires_at=now + datetime.timedelta(seconds=self.ttl)
+            ))
+            try:
+                db.commit()
+                return CLAIMED, None
+            except IntegrityError:
+                db.rollback()
+
+            row = db.get(IdempotencyKey, (user_id, key))
+            if row is None:
+                return PENDING, None
+            if row.status_code is None:
+                if row.applied_revision is None or row.created_at > abandoned_before:
+                    return PENDING, None
+                # The write committed but its worker died before storing the response
+                return COMPLETED, _lost_response(row)
+            stored = StoredResponse(row.fingerprint, row.status_code, json.loads(row.headers or "{}"), row.body)
+            self._remember(user_id, key, stored, row.expires_at)
+            return COMPLETED, stored
+        finally:
+            db.close()
+
+    def complete(self, user_id: str, key: str, stored: StoredResponse):
+        db = shard_router.session_factory(user_id)()
+        try:
+            db.execute(
+                update(IdempotencyKey)
+                .where(IdempotencyKey.user_id == user_id, IdempotencyKey.key == key)
+                .values(status_code=stored.status_code, headers=json.dumps(stored.headers), body=stored.body)
+            )
+            db.commit()
+        finally:
+            db.close()
+        self._remember(user_id, key, stored, _utcnow() + datetime.timedelta(seconds=self.ttl))
+
+    def release(self, user_id: str, key: str):
+        """
+        Drops a pending claim (the request failed), so a retry runs again. A claim
+        whose write already committed stays: running it again would repeat the write.
+        """
+        db = shard_router.session_factory(user_id)()
+        try:
+            db.execute(delete(IdempotencyKey).where(
+                IdempotencyKey.user_id == user_id, IdempotencyKey.key == key,
+                IdempotencyKey.status_code.is_(None), IdempotencyKey.applied_revision.is_(None)
+            ))
+            db.commit()
+        finally:
+            db.close()
+
+    def _remember(self, user_id: str, key: str, stored: StoredResponse, expires_at: datetime.datetime):
+        remaining = (expires_at - _utcnow()).total_seconds()
+        if remaining > 0:
+            self.memory.set((user_id, key), stored, ttl=remaining)
+
+def _lost_response(row: IdempotencyKey) -> StoredResponse:
+    body = {
+        "detail": "The request with this Idempotency-Key was applied, but its response was lost; re-sync the vault",
+        "vault_revision": row.applied_revision,
+    }
+    headers = {"content-type": "application/json", "etag": make_etag("vault", row.applied_revision)}
+    return StoredResponse(row.fingerprint, 409, headers, json.dumps(body).encode("utf-8"))
+
+@event.listens_for(Session, "before_commit")
+def _mark_claim_applied(db: Session):
+    """
+    Records on the running request's claim that its vault write is committing, in
+    the same transaction (idempotency_keys lives on the user's shard too).
+    """
+    slot = _current_claim.get()
+    if slot is None:
+        return
+    user_id, key = slot
+    revision = db.info.get(PENDING_VAULT_REVISIONS, {}).get(user_id)
+    if revision is None:
+        return
+    db.execute(
+        update(IdempotencyKey)
+        .where(IdempotencyKey.user_id == user_id, IdempotencyKey.key == key, IdempotencyKey.status_code.is_(None))
+        .values(applied_revision=revision)
+    )
+
+def purge_expired_keys(session_factory: Callable[[], Session], batch_size: int = 5000) -> int:
+    """
+    Deletes expired keys of all users, a batch per transaction. Returns the number deleted.
+    """
+    purged = 0
+    while True:
+        db = session_factory()
+        try:
+            expired = db.execute(
+                select(IdempotencyKey.user_id, IdempotencyKey.key)
+                .where(IdempotencyKey.expires_at <= _utcnow())
+                .limit(batch_size)
+            ).all()
+            if expired:
+                db.execute(delete(IdempotencyKey).where(
+                    tuple_(IdempotencyKey.user_id, IdempotencyKey.key).in_([tuple(row) for row in expired])
+                ))
+                db.commit()
+        finally:
+            db.close()
+        purged += len(expired)
+        if len(expired) < batch_size:
+            return purged
+
+idempotency_store = IdempotencyStore(settings.IDEMPOTENCY_CACHE_SIZE, settings.IDEMPOTENCY_TTL_SECONDS)
+
+# Requests running right now on this worker, so duplicates wait on an event
+# instead of polling the database. Events only work within their own loop.
+_in_flight: Dict[Tuple[str, str], Tuple[asyncio.AbstractEventLoop, asyncio.Event]] = {}
+
+def idempotent(endpoint: Callable) -> Callable:
+    """
+    Marks a route on an IdempotentRoute router as honouring Idempotency-Key.
+    """
+    endpoint.idempotent = True
+    return endpoint
+
+def _fingerprint(request: Request, body: bytes) -> bytes:
+    digest = hashlib.sha256()
+    digest.update(f"{request.method} {request.url.path}\n".encode("utf-8"))
+    digest.update(body)
+    return digest.digest()
+
+def _request_user_id(request: Request) -> Optional[str]:
+    scheme, token = get_authorization_scheme_param(request.headers.get("authorization"))
+    if scheme.lower() != "bearer" or not token:
+        return None
+    try:
+        return _resolve_token_subject(token)
+    except HTTPException:
+        return None
+
+def _replay(stored: StoredResponse, fingerprint: bytes) -> Response:
+    if stored.fingerprint != fingerprint:
+        return JSONResponse(
+            status_code=422,
+            content={"detail": "Idempotency-Key was already used for a different request"}
+        )
+    return Response(
+        content=stored.body, status_code=stored.status_code,
+        headers={**stored.headers, "Idempotent-Replayed": "true"}
+    )
+
+class IdempotentRoute(NegotiatedRoute):
+    """
+    Route class for write endpoints marked with @idempotent. A request carrying an
+    Idempotency-Key runs once per user and key: retries get the stored response
+    back without the endpoint running, and concurrent duplicates wait for the
+    original. Failed requests (exceptions, 5xx) are not stored and may be retried.
+    """
+
+    def wrap_handler(self, handler: Callable) -> Callable:
+        if not getattr(self.endpoint, "idempotent", False):
+            return handler
+
+        async def idempotent_handler(request: Request) -> Response:
+            key = request.headers.get(IDEMPOTENCY_HEADER)
+            if not key:
+                return await handler(request)
+            if len(key) > MAX_KEY_LENGTH:
+                return JSONResponse(status_code=400, content={"detail": "Idempotency-Key is too long"})
+            user_id = _request_user_id(request)
+            if user_id is None:
+                # Let the endpoint reject the credentials as usual
+                return await handler(request)
+
+            fingerprint = _fingerprint(request, await request.body())
+            slot = (user_id, key)
+            deadline = time.monotonic() + settings.IDEMPOTENCY_WAIT_SECONDS
+            while True:
+                stored = idempotency_store.cached(user_id, key)
+                if stored is not None:
+                    return _replay(stored, fingerprint)
+                loop, running = _in_flight.get(slot, (None, None))
+                if loop is asyncio.get_running_loop():
+                    # Same worker: wait for the original to finish, then look again
+                    try:
+                        await asyncio.wait_for(running.wait(), max(deadline - time.monotonic(), 0))
+                        continue
+                    except asyncio.TimeoutError:
+                        break
+                outcome, stored = await run_in_threadpool(idempotency_store.claim, user_id, key, fingerprint)
+                if outcome == COMPLETED:
+                    return _replay(stored, fingerprint)
+                if outcome == CLAIMED:
+                    return await self._run_once(handler, request, slot, fingerprint)
+                # Another worker holds the key: poll until it stores its response
+                if time.monotonic() >= deadline:
+                    break
+                await asyncio.sleep(0.1)
+
+            return JSONResponse(
+                status_code=409, headers={"Retry-After": "1"},
+                content={"detail": "A request with this Idempotency-Key is still being processed"}
+            )
+
+        return idempotent_handler
+
+    async def _run_once(self, handler: Callable, request: Request, slot: Tuple[str, str], fingerprint: bytes) -> Response:
+        user_id, key = slot
+        done = asyncio.Event()
+        _in_flight[slot] = (asyncio.get_running_loop(), done)
+        claim_token = _current_claim.set(slot)
+        try:
+            try:
+                response = await handler(request)
+            except BaseException:
+                await run_in_threadpool(idempotency_store.release, user_id, key)
+                raise
+            body = getattr(response, "body", None)
+            if response.status_code >= 500 or body is None:
+                # Server errors and streamed bodies are not replayable
+                await run_in_threadpool(idempotency_store.release, user_id, key)
+                return response
+            headers = {name: response.headers[name] for name in REPLAYED_HEADERS if name in response.headers}
+            stored = StoredResponse(fingerprint, response.status_code, headers, bytes(body))
+            await run_in_threadpool(idempotency_store.complete, user_id, key, stored)
+            return response
+        finally:
+            _current_claim.reset(claim_token)
+            del _in_flight[slot]
+            done.set()
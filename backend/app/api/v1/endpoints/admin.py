@@ -0,0 +1,29 @@
+import hmac
+from typing import Any, Optional
+from fastapi import APIRouter, HTTPException, Header, Request
+from fastapi.responses import StreamingResponse
+from app.core.config import settings
+from app.utils.export import iter_export, gzip_stream, accepts_gzip
+
+router = APIRouter()
+
+def require_admin_token(token: Optional[str]):
+    # Constant-time compare; the endpoint simply doesn't exist until a token is configured
+    if not settings.ADMIN_BACKUP_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not token or not hmac.compare_digest(token.encode("utf-8"), settings.ADMIN_BACKUP_TOKEN.encode("utf-8")):
+        raise HTTPException(status_code=403, detail="Forbidden")
+
+@router.get("/backup")
+def backup(request: Request, x_admin_token: Optional[str] = Header(None)) -> Any:
+    """
+    Stream every user row and encrypted vault item as NDJSON for nightly backups.
+    """
+    require_admin_token(x_admin_token)
+
+    stream = iter_export()
+    headers = {"Content-Disposition": 'attachment; filename="valutx-backup.ndjson"', "Vary": "Accept-Encoding"}
+    if accepts_gzip(request.headers.get("accept-encoding")):
+        stream = gzip_stream(stream)
+        headers["Content-Encoding"] = "gzip"
+    return StreamingResponse(stream, media_type="application/x-ndjson", headers=headers)
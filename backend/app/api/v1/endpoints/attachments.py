@@ -0,0 +1,69 @@
+import os
+from fastapi import APIRouter, HTTPException, Depends, Request, Path
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import FileResponse, JSONResponse
+from typing import Any
+from app.schemas import AttachmentResponse
+from app.db.sharding import shard_router
+from app.core.config import settings
+from app.api.deps import get_current_user_id
+from app.utils.revision import etag_matches, not_modified
+from app.utils.attachments import (
+    attachment_path, receive_upload, store_upload, stored_size, sweep_orphans, touch_existing
+)
+
+# Bodies are raw ciphertext streamed to disk, never parsed or held in memory
+router = APIRouter()
+
+DigestPath = Path(..., pattern="^[0-9a-f]{64}$", description="Lowercase hex SHA-256 of the encrypted file")
+
+def _headers(digest: str) -> dict:
+    # Content-addressed, so a cached copy can never go stale
+    return {"ETag": f'"{digest}"', "Cache-Control": "private, max-age=31536000, immutable"}
+
+@router.put("/{digest}", response_model=AttachmentResponse, status_code=201)
+async def upload_attachment(
+    request: Request,
+    digest: str = DigestPath,
+    user_id: str = Depends(get_current_user_id)
+) -> Any:
+    """
+    Upload an encrypted file as the raw request body, under the SHA-256 of those bytes.
+    A file the user already stored is not transferred again (200 instead of 201), so
+    clients may send "Expect: 100-continue" or check first with HEAD.
+    Then reference the digest from a vault item's 'attachments'.
+    """
+    size = await run_in_threadpool(touch_existing, user_id, digest)
+    if size is not None:
+        return JSONResponse(status_code=200, content={"digest": digest, "size": size, "created": False})
+
+    declared = request.headers.get("content-length")
+    if declared and declared.isdigit() and int(declared) > settings.ATTACHMENT_MAX_BYTES:
+        raise HTTPException(status_code=413, detail="Attachment too large")
+    tmp_path, actual, size = await receive_upload(request.stream(), settings.ATTACHMENT_MAX_BYTES)
+    if actual != digest:
+        await run_in_threadpool(os.remove, tmp_path)
+        raise HTTPException(status_code=400, detail="Body does not match the digest")
+    await run_in_threadpool(store_upload, user_id, digest, size, tmp_path)
+    # Orphans only pile up per user, so each uploader cleans up after themselves
+    await run_in_threadpool(sweep_orphans, shard_router.session_factory(user_id), user_id)
+    return {"digest": digest, "size": size, "created": True}
+
+@router.api_route("/{digest}", methods=["GET", "HEAD"])
+async def download_attachment(
+    request: Request,
+    digest: str = DigestPath,
+    user_id: str = Depends(get_current_user_id)
+) -> Any:
+    """
+    Download an encrypted file. Honours Range (resumable or partial downloads) and
+    If-None-Match; HEAD tells whether the file is stored without transferring it.
+    """
+    size = await run_in_threadpool(stored_size, user_id, digest)
+    path = attachment_path(user_id, digest)
+    if size is None or not await run_in_threadpool(os.path.exists, path):
+        raise HTTPException(status_code=404, detail="Attachment not found")
+    headers = _headers(digest)
+    if etag_matches(request, headers["ETag"]):
+        return not_modified(headers["ETag"])
+    return FileResponse(path, media_type="application/octet-stream", headers=headers)
@@ -1,24 +1,177 @@
-from fastapi import APIRouter, Depends, Request
+import datetime
+import json
+from fastapi import APIRouter, Depends, Request, Query, Response
+from fastapi.responses import StreamingResponse
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from typing import List, Any
-from app.schemas import AuditLogResponse
+from typing import List, Any, Optional
+from app.schemas import AuditLogResponse, AuditSummaryResponse
 from app.models.audit import AuditLog
 from app.models.user import User
-from app.db.session import get_db
-from app.api.deps import get_current_user
+from app.core.config import settings
+from app.api.deps import get_current_user, get_current_user_async, get_read_db, get_async_read_db
+from app.utils.pagination import encode_cursor, decode_cursor, after_position
+from app.utils.fast_json import json_response, audit_log_dict, AUDIT_LOG_FIELDS
+from app.utils.audit_archive import iter_archived_logs
+from app.utils.audit_rollup import summary_statement, summarize
+from app.utils.export import gzip_stream, accepts_gzip
+from app.utils.revision import audit_revision_statement, make_etag, etag_matches, not_modified
 
 router = APIRouter()
 
-@router.get("/", response_model=List[AuditLogResponse])
+def _naive_utc(value: Optional[datetime.datetime]) -> Optional[datetime.datetime]:
+    # Stored timestamps are naive UTC
+    if value is not None and value.tzinfo is not None:
+        value = value.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return value
+
+def _log_filters(
+    event_type: Optional[List[str]],
+    severity: Optional[List[str]],
+    since: Optional[datetime.datetime],
+    until: Optional[datetime.datetime]
+) -> list:
+    # Each combination is served by one of the (user_id, ..., timestamp, id) indexes
+    clauses = []
+    if event_type:
+        clauses.append(AuditLog.event_type.in_(event_type))
+    if severity:
+        clauses.append(AuditLog.severity.in_(severity))
+    if since is not None:
+        clauses.append(AuditLog.timestamp >= _naive_utc(since))
+    if until is not None:
+        clauses.append(AuditLog.timestamp < _naive_utc(until))
+    return clauses
+
+def _logs_page_statement(user_id: str, position, skip: int, limit: int, filters: list):
+    stmt = (
+        select(AuditLog).where(AuditLog.user_id == user_id, *filters)
+        .order_by(AuditLog.timestamp.desc(), AuditLog.id.desc())
+    )
+    if position:
+        stmt = stmt.where(after_position(AuditLog.timestamp, AuditLog.id, position, descending=True))
+    elif skip:
+        stmt = stmt.offset(skip)
+    return stmt.limit(limit + 1)
+
+def _logs_page(logs: list, limit: int, response: Response) -> list:
+    if len(logs) > limit:
+        logs = logs[:limit]
+        response.headers["X-Next-Cursor"] = encode_cursor(logs[-1].timestamp, logs[-1].id)
+    return logs
+
 def read_audit_logs(
-    db: Session = Depends(get_db),
+    request: Request,
+    response: Response,
+    db: Session = Depends(get_read_db),
     skip: int = 0,
-    limit: int = 50,
+    limit: int = Query(50, ge=1, le=500),
+    cursor: Optional[str] = None,
+    event_type: Optional[List[str]] = Query(None, description="Only these event types (repeatable)"),
+    severity: Optional[List[str]] = Query(None, description="Only these severities (repeatable)"),
+    since: Optional[datetime.datetime] = None,
+    until: Optional[datetime.datetime] = None,
     current_user: User = Depends(get_current_user)
 ) -> Any:
     """
-    Retrieve security audit logs for the current user.
+    Retrieve security audit logs for the current user, newest first, optionally
+    filtered by event type, severity and time range ('since' inclusive, 'until' exclusive).
+    Pass the X-Next-Cursor response header back as 'cursor' to fetch older entries.
+    Send the last ETag as If-None-Match to get a bodiless 304 when nothing changed.
     """
-    logs = db.query(AuditLog).filter(AuditLog.user_id == current_user.id).order_by(AuditLog.timestamp.desc()).offset(skip).limit(limit).all()
-    return logs
+    etag = make_etag("audit", db.execute(audit_revision_statement(current_user.id)).scalar())
+    if etag_matches(request, etag):
+        return not_modified(etag)
+    response.headers["ETag"] = etag
+
+    filters = _log_filters(event_type, severity, since, until)
+    stmt = _logs_page_statement(current_user.id, decode_cursor(cursor), skip, limit, filters)
+    logs = db.execute(stmt).scalars().all()
+    return json_response(request, [audit_log_dict(log) for log in _logs_page(logs, limit, response)], response)
+
+async def read_audit_logs_async(
+    request: Request,
+    response: Response,
+    db: AsyncSession = Depends(get_async_read_db),
+    skip: int = 0,
+    limit: int = Query(50, ge=1, le=500),
+    cursor: Optional[str] = None,
+    event_type: Optional[List[str]] = Query(None, description="Only these event types (repeatable)"),
+    severity: Optional[List[str]] = Query(None, description="Only these severities (repeatable)"),
+    since: Optional[datetime.datetime] = None,
+    until: Optional[datetime.datetime] = None,
+    current_user: User = Depends(get_current_user_async)
+) -> Any:
+    """
+    Retrieve security audit logs for the current user, newest first, optionally
+    filtered by event type, severity and time range ('since' inclusive, 'until' exclusive).
+    Pass the X-Next-Cursor response header back as 'cursor' to fetch older entries.
+    Send the last ETag as If-None-Match to get a bodiless 304 when nothing changed.
+    """
+    etag = make_etag("audit", (await db.execute(audit_revision_statement(current_user.id))).scalar())
+    if etag_matches(request, etag):
+        return not_modified(etag)
+    response.headers["ETag"] = etag
+
+    filters = _log_filters(event_type, severity, since, until)
+    stmt = _logs_page_statement(current_user.id, decode_cursor(cursor), skip, limit, filters)
+    logs = (await db.execute(stmt)).scalars().all()
+    return json_response(request, [audit_log_dict(log) for log in _logs_page(logs, limit, response)], response)
+
+router.add_api_route(
+    "/", read_audit_logs_async if settings.DB_ASYNC else read_audit_logs,
+    methods=["GET"], response_model=List[AuditLogResponse]
+)
+
+@router.get("/summary", response_model=AuditSummaryResponse)
+def read_audit_summary(
+    request: Request,
+    response: Response,
+    db: Session = Depends(get_read_db),
+    days: int = Query(7, ge=1, le=366, description="Window length in days, ending with 'until'"),
+    until: Optional[datetime.date] = Query(None, description="Last day of the window (UTC); default today"),
+    event_type: Optional[List[str]] = Query(None, description="Only these event types (repeatable)"),
+    severity: Optional[List[str]] = Query(None, description="Only these severities (repeatable)"),
+    current_user: User = Depends(get_current_user)
+) -> Any:
+    """
+    Audit event counts per day, event type and severity, e.g. logins per day
+    (event_type=LOGIN) or critical events this week (severity=CRITICAL).
+    Served from the daily rollups, so the cost depends on the window, not on how
+    much history the account has; archived events are still counted.
+    """
+    until = until or datetime.datetime.utcnow().date()
+    since = until - datetime.timedelta(days=days - 1)
+
+    # The window is part of the tag: "today" moves without the revision changing
+    revision = db.execute(audit_revision_statement(current_user.id)).scalar()
+    etag = make_etag(f"audit-summary-{since.isoformat()}-{until.isoformat()}", revision)
+    if etag_matches(request, etag):
+        return not_modified(etag)
+    response.headers["ETag"] = etag
+
+    rows = db.execute(summary_statement(current_user.id, since, until, event_type, severity)).all()
+    return json_response(request, summarize(rows, since, until), response)
+
+@router.get("/archive")
+def read_archived_logs(
+    request: Request,
+    since: Optional[datetime.datetime] = None,
+    until: Optional[datetime.datetime] = None,
+    current_user: User = Depends(get_current_user)
+) -> Any:
+    """
+    Stream archived (older than the retention window) audit logs as NDJSON, oldest first.
+    """
+    def lines():
+        for row in iter_archived_logs(current_user.id, since, until):
+            values = {field: row.get(field) for field in AUDIT_LOG_FIELDS}
+            yield (json.dumps(values, separators=(",", ":")) + "\n").encode("utf-8")
 
+    stream = lines()
+    headers = {"Vary": "Accept-Encoding"}
+    if accepts_gzip(request.headers.get("accept-encoding")):
+        stream = gzip_stream(stream)
+        headers["Content-Encoding"] = "gzip"
+    return StreamingResponse(stream, media_type="application/x-ndjson", headers=headers)
@@ -1,109 +1,193 @@
 from fastapi import APIRouter, HTTPException, Depends, status
+from fastapi.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
-from typing import Any
+from typing import Any, Optional
 from app.schemas import UserCreate, UserLogin, Token, UserResponse, UserRotateKey
 from app.models.user import User
 from app.db.session import get_db
-from app.core.security import create_access_token, get_password_hash, verify_password, ALGORITHM
+from app.db.sharding import shard_router
+from app.db.types import generate_uuid
+from app.core.security import create_access_token, get_password_hash, check_password, ALGORITHM, HASH_SCHEME_LEGACY
 from pydantic import BaseModel
 from fastapi.security import OAuth2PasswordBearer
 from jose import jwt, JWTError
 from app.core.config import settings
-from app.api.deps import get_current_user
+from app.core.rate_limit import enforce_auth_rate_limit
+from app.api.deps import get_current_user, get_user_db, principal_cache
 from app.utils.security_logging import log_event
+from app.utils.revision import bump_vault_revision, replica_is_current
 from fastapi import Request
 
 
 router = APIRouter()
 
+# The endpoints below are async so a bcrypt call is awaited on the event loop
+# instead of holding a request thread; their (short) database work still runs
+# on the threadpool.
+
+def _create_user(shard: int, user_id: str, user_in: UserCreate, server_side_hash: str) -> UserResponse:
+    with shard_router.shard_sessionmaker(shard)() as user_db:
+        new_user = User(
+            id=user_id,
+            email=user_in.email,
+            auth_hash=server_side_hash,
+            kdf_salt=user_in.kdf_salt,
+            encrypted_dek=user_in.encrypted_dek
+        )
+        user_db.add(new_user)
+        user_db.commit()
+        user_db.refresh(new_user)
+
+        log_event(user_db, new_user.id, "SIGNUP", severity="INFO", details=f"New account created for {new_user.email}")
+
+        # Serialized while the session is still open
+        return UserResponse.model_validate(new_user)
+
 @router.post("/signup", response_model=UserResponse)
-def create_user(user_in: UserCreate, db: Session = Depends(get_db)) -> Any:
+async def create_user(user_in: UserCreate, request: Request, db: Session = Depends(get_db)) -> Any:
     """
     Register a new user.
     """
-    # Check if user exists
-    user = db.query(User).filter(User.email == user_in.email).first()
-    if user:
+    await run_in_threadpool(enforce_auth_rate_limit, request, "signup")
+
+    # Check if user exists; with sharding this also reserves the email in the
+    # shard directory and picks the shard the account is created on
+    user_id = generate_uuid()
+    shard = await run_in_threadpool(shard_router.claim_user, db, user_id, user_in.email)
+    if shard is None:
         raise HTTPException(
             status_code=400,
             detail="The user with this email already exists in the system.",
         )
-    
-    # Create User
-    # Note: We hash the 'auth_hash_derived' again before storing it for defense-in-depth.
-    # If the database is leaked, the attacker cannot login because they only have Hash(Hash(AuthKey)).
-    # They would need to reverse this to get Hash(AuthKey), which is what the login endpoint expects.
-    server_side_hash = get_password_hash(user_in.auth_hash_derived)
-
-    new_user = User(
-        email=user_in.email,
-        auth_hash=server_side_hash,
-        kdf_salt=user_in.kdf_salt,
-        encrypted_dek=user_in.encrypted_dek
-    )
-    db.add(new_user)
-    db.commit()
-    db.refresh(new_user)
-    
-    log_event(db, new_user.id, "SIGNUP", severity="INFO", details=f"New account created for {new_user.email}")
-    
-    return new_user
+
+    try:
+        # Create User
+        # Note: We hash the 'auth_hash_derived' again before storing it for defense-in-depth.
+        # If the database is leaked, the attacker cannot login because they only have Hash(Hash(AuthKey)).
+        # They would need to reverse this to get Hash(AuthKey), which is what the login endpoint expects.
+        server_side_hash = await get_password_hash(user_in.auth_hash_derived)
+        return await run_in_threadpool(_create_user, shard, user_id, user_in, server_side_hash)
+    except Exception:
+        # Free the email again
+        await run_in_threadpool(shard_router.release_user, db, user_id)
+        raise
+
+def _load_credentials(email: str) -> Optional[tuple]:
+    session_factory = shard_router.email_session_factory(email)
+    if session_factory is None:
+        return None
+    # Read and released before bcrypt runs, so no connection is held across the hash
+    with session_factory() as db:
+        return db.query(User.id, User.auth_hash, User.auth_hash_prehashed).filter(User.email == email).first()
+
+def _complete_login(email: str, user_id: str, upgrade: bool, new_hash: Optional[str], request: Request) -> dict:
+    # Routed by id: the credentials just checked belong to this user
+    with shard_router.session_factory(user_id)() as db:
+        user = db.get(User, user_id)
+        if user is None:
+            raise HTTPException(status_code=400, detail="Incorrect email or password")
+
+        if upgrade:
+            # Opportunistic upgrade: re-hash legacy accounts in the new format while we
+            # have the plaintext, then mark them so the legacy check is skipped from now on.
+            if new_hash is not None:
+                user.auth_hash = new_hash
+            user.auth_hash_prehashed = True
+            db.commit()
+            principal_cache.invalidate_user(user.id)
+
+        access_token = create_access_token(subject=user.id)
+
+        log_event(db, user.id, "LOGIN", severity="INFO", request=request)
+
+        return {
+            "access_token": access_token,
+            "token_type": "bearer",
+            # Serialized while the session is still open
+            "user": UserResponse.model_validate(user)
+        }
 
 @router.post("/login", response_model=Token)
-def login(user_in: UserLogin, request: Request, db: Session = Depends(get_db)) -> Any:
+async def login(user_in: UserLogin, request: Request) -> Any:
     """
     OAuth2 compatible token login.
     """
-    user = db.query(User).filter(User.email == user_in.email).first()
-    if not user:
+    await run_in_threadpool(enforce_auth_rate_limit, request, "login", user_in.email)
+
+    # The account's own shard (the one database unless sharded)
+    credentials = await run_in_threadpool(_load_credentials, user_in.email)
+    if not credentials:
         # TIMING ATTACK MIMIC (in production do this better)
         raise HTTPException(status_code=400, detail="Incorrect email or password")
-    
-    if not verify_password(user_in.auth_hash_derived, user.auth_hash):
+
+    scheme = await check_password(user_in.auth_hash_derived, credentials.auth_hash, allow_legacy=not credentials.auth_hash_prehashed)
+    if scheme is None:
          raise HTTPException(status_code=400, detail="Incorrect email or password")
-         
-    access_token = create_access_token(subject=user.id)
-    
-    log_event(db, user.id, "LOGIN", severity="INFO", request=request)
-    
-    return {
-        "access_token": access_token,
-        "token_type": "bearer",
-        "user": user
-    }
 
-@router.put("/rotate-key", response_model=UserResponse)
-def rotate_key(
-    data: UserRotateKey, 
-    request: Request,
-    db: Session = Depends(get_db), 
-    current_user: User = Depends(get_current_user)
-) -> Any:
-    """
-    Rotate the Master Password (re-encrypt DEK with new KEK).
-    """
+    new_hash = None
+    if not credentials.auth_hash_prehashed and scheme == HASH_SCHEME_LEGACY:
+        new_hash = await get_password_hash(user_in.auth_hash_derived)
+    return await run_in_threadpool(
+        _complete_login, user_in.email, credentials.id, not credentials.auth_hash_prehashed, new_hash, request
+    )
+
+def _apply_key_rotation(db: Session, current_user: User, data: UserRotateKey, server_side_hash: str, request: Request) -> UserResponse:
     # 1. Update Auth Hash
-    server_side_hash = get_password_hash(data.auth_hash_derived)
     current_user.auth_hash = server_side_hash
+    current_user.auth_hash_prehashed = True
     
     # 2. Update KDF Salt (so new KEK derivation is clean)
     current_user.kdf_salt = data.kdf_salt
     
     # 3. Update Encrypted DEK (wrapped with new KEK)
     current_user.encrypted_dek = data.encrypted_dek
+    # Clients holding the old wrapped DEK must re-sync
+    bump_vault_revision(db, current_user.id)
     
     db.commit()
     db.refresh(current_user)
+    # Other requests must not keep serving the pre-rotation row
+    principal_cache.invalidate_user(current_user.id)
     
     log_event(db, current_user.id, "KEY_ROTATION", severity="WARNING", details="Master password and keys rotated", request=request)
     
-    return current_user
+    return UserResponse.model_validate(current_user)
+
+@router.put("/rotate-key", response_model=UserResponse)
+async def rotate_key(
+    data: UserRotateKey, 
+    request: Request,
+    db: Session = Depends(get_user_db), 
+    current_user: User = Depends(get_current_user)
+) -> Any:
+    """
+    Rotate the Master Password (re-encrypt DEK with new KEK).
+    """
+    await run_in_threadpool(enforce_auth_rate_limit, request, "rotate-key", current_user.email)
+
+    server_side_hash = await get_password_hash(data.auth_hash_derived)
+    return await run_in_threadpool(_apply_key_rotation, db, current_user, data, server_side_hash, request)
 
 class UserSaltResponse(BaseModel):
     kdf_salt: str
 
+def get_salt_read_db(email: str):
+    # The account's shard; without sharding the replica, unless it lags the primary
+    # for this account (just created, or just rotated its keys)
+    session_factory = shard_router.email_session_factory(email, read=True)
+    if session_factory is None:
+        raise HTTPException(status_code=404, detail="User not found")
+    db = session_factory()
+    try:
+        if shard_router.uses_replica and not replica_is_current(db, User.email == email):
+            db.close()
+            db = shard_router.email_session_factory(email)()
+        yield db
+    finally:
+        db.close()
+
 @router.get("/salt/{email}", response_model=UserSaltResponse)
-def get_user_salt(email: str, db: Session = Depends(get_db)):
+def get_user_salt(email: str, db: Session = Depends(get_salt_read_db)):
     user = db.query(User).filter(User.email == email).first()
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
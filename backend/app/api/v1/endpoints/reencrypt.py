@@ -0,0 +1,228 @@
+import datetime
+from fastapi import APIRouter, HTTPException, Depends, Request
+from sqlalchemy import select, insert, update, delete, func, and_
+from sqlalchemy.orm import Session
+from typing import Any
+from app.schemas import ReencryptStageRequest, ReencryptCommitRequest, ReencryptSessionResponse
+from app.models.attachment import Attachment
+from app.models.item import VaultItem
+from app.models.reencrypt import ReencryptionSession, ReencryptionStagedItem
+from app.models.user import User
+from app.core.config import settings
+from app.api.deps import get_current_user, get_user_db, principal_cache
+from app.utils.security_logging import log_event
+from app.utils.fast_json import negotiated_response
+from app.utils.revision import vault_write
+from app.utils.wire import NegotiatedRoute
+
+# Staged uploads carry blobs, so they take MessagePack as well as JSON
+router = APIRouter(route_class=NegotiatedRoute)
+
+# Keeps IN (...) lists well under SQLite's bound-parameter limit
+STAGE_CHUNK_SIZE = 500
+MISSING_PAGE_SIZE = 1000
+
+def _staged_for_current_version(session_id: str):
+    # A staged row only counts if it was made from the item's current version
+    return and_(
+        ReencryptionStagedItem.session_id == session_id,
+        ReencryptionStagedItem.item_id == VaultItem.id,
+        ReencryptionStagedItem.version == VaultItem.version
+    )
+
+def _discard(db: Session, session: ReencryptionSession, status: str):
+    db.execute(delete(ReencryptionStagedItem).where(ReencryptionStagedItem.session_id == session.id))
+    session.status = status
+
+def _get_open_session(db: Session, session_id: str, user_id: str) -> ReencryptionSession:
+    session = db.query(ReencryptionSession).filter(
+        ReencryptionSession.id == session_id, ReencryptionSession.user_id == user_id
+    ).first()
+    if not session or session.status != "open":
+        raise HTTPException(status_code=404, detail="Re-encryption session not found")
+    if session.expires_at <= datetime.datetime.utcnow():
+        _discard(db, session, "expired")
+        db.commit()
+        raise HTTPException(status_code=404, detail="Re-encryption session expired")
+    return session
+
+def _refuse_attachments(db: Session, user_id: str):
+    # Attachment files are encrypted client-side and stored as-is; a session only swaps
+    # item blobs, so committing would strand every file under the discarded DEK
+    if db.execute(select(Attachment.digest).where(Attachment.user_id == user_id).limit(1)).first() is not None:
+        raise HTTPException(
+            status_code=409,
+            detail="CONFLICT: Re-encryption does not cover attachments yet; remove them before rotating the DEK."
+        )
+
+def _count_items(db: Session, user_id: str) -> int:
+    return db.execute(select(func.count()).select_from(VaultItem).where(VaultItem.user_id == user_id)).scalar()
+
+def _progress(db: Session, session: ReencryptionSession, user_id: str, missing_limit: int = MISSING_PAGE_SIZE) -> dict:
+    total = _count_items(db, user_id)
+    staged = db.execute(
+        select(func.count()).select_from(VaultItem).join(ReencryptionStagedItem, _staged_for_current_version(session.id))
+        .where(VaultItem.user_id == user_id)
+    ).scalar()
+    missing = []
+    if missing_limit and staged < total:
+        missing = db.execute(
+            select(VaultItem.id).outerjoin(ReencryptionStagedItem, _staged_for_current_version(session.id))
+            .where(VaultItem.user_id == user_id, ReencryptionStagedItem.item_id.is_(None))
+            .order_by(VaultItem.id).limit(missing_limit)
+        ).scalars().all()
+    return {
+        "id": session.id, "status": session.status, "expires_at": session.expires_at,
+        "total": total, "staged": staged, "missing": list(missing)
+    }
+
+@router.post("/", response_model=ReencryptSessionResponse)
+def open_session(
+    request: Request,
+    db: Session = Depends(get_user_db),
+    current_user: User = Depends(get_current_user)
+) -> Any:
+    """
+    Open a re-encryption session for a DEK rotation, or resume the one already open.
+    Upload every item re-encrypted under the new DEK, then commit; until the commit
+    the vault keeps serving the old ciphertext.
+    """
+    user_id = current_user.id
+    _refuse_attachments(db, user_id)
+    now = datetime.datetime.utcnow()
+    sessions = db.query(ReencryptionSession).filter(
+        ReencryptionSession.user_id == user_id, ReencryptionSession.status == "open"
+    ).all()
+    session = None
+    for candidate in sessions:
+        if candidate.expires_at > now and session is None:
+            session = candidate
+        else:
+            _discard(db, candidate, "expired")
+
+    if session is None:
+        session = ReencryptionSession(
+            user_id=user_id, created_at=now,
+            expires_at=now + datetime.timedelta(hours=settings.REENCRYPT_SESSION_TTL_HOURS)
+        )
+        db.add(session)
+    db.commit()
+    return negotiated_response(request, _progress(db, session, user_id))
+
+@router.get("/{session_id}", response_model=ReencryptSessionResponse)
+def read_session(
+    session_id: str,
+    request: Request,
+    db: Session = Depends(get_user_db),
+    current_user: User = Depends(get_current_user)
+) -> Any:
+    """
+    Progress of a session; 'missing' lists items still to upload (after a reconnect,
+    or because they changed since they were staged).
+    """
+    session = _get_open_session(db, session_id, current_user.id)
+    return negotiated_response(request, _progress(db, session, current_user.id))
+
+@router.put("/{session_id}/items", response_model=ReencryptSessionResponse)
+def stage_items(
+    session_id: str,
+    stage_in: ReencryptStageRequest,
+    request: Request,
+    db: Session = Depends(get_user_db),
+    current_user: User = Depends(get_current_user)
+) -> Any:
+    """
+    Upload a chunk of re-encrypted items. Re-sending an item replaces its staged copy,
+    so a chunk that may or may not have arrived can simply be sent again.
+    """
+    session = _get_open_session(db, session_id, current_user.id)
+
+    # Last upload of an id within the chunk wins
+    items = {item.id: item for item in stage_in.items}
+    ids = list(items)
+    for start in range(0, len(ids), STAGE_CHUNK_SIZE):
+        chunk = ids[start:start + STAGE_CHUNK_SIZE]
+        db.execute(delete(ReencryptionStagedItem).where(
+            ReencryptionStagedItem.session_id == session.id, ReencryptionStagedItem.item_id.in_(chunk)
+        ))
+    db.execute(insert(ReencryptionStagedItem), [
+        {
+            "session_id": session.id, "item_id": item.id, "version": item.version,
+            "enc_data": item.enc_data, "iv": item.iv, "auth_tag": item.auth_tag
+        }
+        for item in items.values()
+    ])
+    db.commit()
+    return negotiated_response(request, _progress(db, session, current_user.id, missing_limit=0))
+
+@router.post("/{session_id}/commit", response_model=ReencryptSessionResponse)
+def commit_session(
+    session_id: str,
+    commit_in: ReencryptCommitRequest,
+    request: Request,
+    db: Session = Depends(get_user_db),
+    current_user: User = Depends(get_current_user)
+) -> Any:
+    """
+    Atomically swap every staged item in and store the new wrapped DEK.
+    Fails with 409 (changing nothing) unless every item is staged at its current version.
+    """
+    user_id = current_user.id
+    session = _get_open_session(db, session_id, user_id)
+    # Every vault write takes the user's write lock first (vault_write), so this holds
+    # off concurrent creates, edits and deletes until the swap commits: nothing can
+    # land between the count and the swap
+    with vault_write(db, user_id) as revision:
+        _refuse_attachments(db, user_id)
+        progress = _progress(db, session, user_id, missing_limit=0)
+        if progress["staged"] != progress["total"]:
+            raise HTTPException(
+                status_code=409,
+                detail=f"CONFLICT: {progress['total'] - progress['staged']} items are not staged at their current version."
+            )
+
+        # One UPDATE ... FROM for the whole vault; only copies staged at the current
+        # version are swapped in
+        now = datetime.datetime.utcnow()
+        swapped = db.execute(
+            update(VaultItem)
+            .where(VaultItem.user_id == user_id, _staged_for_current_version(session.id))
+            .values(
+                enc_data=ReencryptionStagedItem.enc_data,
+                iv=ReencryptionStagedItem.iv,
+                auth_tag=ReencryptionStagedItem.auth_tag,
+                version=VaultItem.version + 1,
+                last_modified=now,
+                change_seq=revision
+            )
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        # Recounted in the same transaction: an item the swap didn't cover would be left
+        # under the old DEK, which is about to be gone
+        if swapped != progress["total"] or _count_items(db, user_id) != swapped:
+            raise HTTPException(status_code=409, detail="CONFLICT: Vault changed during commit. Check the session and retry.")
+
+        db.execute(
+            update(User).where(User.id == user_id).values(encrypted_dek=commit_in.encrypted_dek)
+            .execution_options(synchronize_session=False)
+        )
+        _discard(db, session, "committed")
+        db.commit()
+    # Other requests must not keep serving the old wrapped DEK
+    principal_cache.invalidate_user(user_id)
+
+    log_event(db, user_id, "KEY_ROTATION", severity="WARNING", details=f"Vault re-encrypted ({swapped} records)", request=request)
+
+    return negotiated_response(request, {**progress, "status": "committed", "staged": swapped})
+
+@router.delete("/{session_id}")
+def abort_session(
+    session_id: str,
+    request: Request,
+    db: Session = Depends(get_user_db),
+    current_user: User = Depends(get_current_user)
+) -> Any:
+    session = _get_open_session(db, session_id, current_user.id)
+    _discard(db, session, "aborted")
+    db.commit()
+    return negotiated_response(request, {"status": "success"})
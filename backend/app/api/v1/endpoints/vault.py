@@ -1,103 +1,513 @@
-from fastapi import APIRouter, HTTPException, Depends, Request
-from sqlalchemy.orm import Session
-from typing import List, Any
-from app.schemas import VaultItemCreate, VaultItemResponse, VaultItemUpdate
-from app.models.item import VaultItem
+import asyncio
+import datetime
+import json
+from collections import Counter
+from fastapi import APIRouter, HTTPException, Depends, Request, Query, Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+from sqlalchemy import select, insert, update, delete
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, defer
+from typing import List, Any, Optional, Union
+from app.schemas import (
+    VaultItemCreate, VaultItemResponse, VaultItemUpdate, VaultChangesResponse,
+    VaultBatchRequest, VaultBatchResponse, VaultFetchRequest, VaultItemMetaResponse,
+    StreamTokenResponse
+)
+from app.models.item import VaultItem, VaultItemTombstone, generate_uuid
 from app.models.user import User
-from app.db.session import get_db
+from app.db.sharding import shard_router
 from app.core import security
-from app.api.deps import get_current_user
+from app.core.config import settings
+from app.api.idempotency import IdempotentRoute, idempotent
+from app.api.deps import (
+    get_current_user, get_current_user_async, get_current_user_id, get_stream_user_id,
+    get_user_db, get_async_user_db, get_read_db, get_async_read_db
+)
+from app.core.notifications import change_hub
 from app.utils.security_logging import log_event
+from app.utils.pagination import encode_cursor, decode_cursor, encode_change_cursor, decode_change_cursor, after_position
+from app.utils.export import iter_export, gzip_stream, accepts_gzip
+from app.utils.attachments import change_refcounts, known_digests, parse_refs, dump_refs
+from app.utils.fast_json import negotiated_response, vault_items_response, vault_item_dict
+from app.utils.revision import (
+    vault_write, vault_revision_statement, make_etag, etag_matches, not_modified
+)
 
-router = APIRouter()
+# Bodies may be JSON (base64 blobs) or MessagePack (raw bytes); responses follow Accept.
+# Writes marked @idempotent honour an Idempotency-Key header.
+router = APIRouter(route_class=IdempotentRoute)
+
+# Keeps IN (...) lists well under SQLite's bound-parameter limit
+BATCH_CHUNK_SIZE = 500
+
+# Exactly what VaultItemResponse needs; listing rows never become full ORM objects
+LISTING_COLUMNS = (
+    VaultItem.type, VaultItem.id, VaultItem.user_id, VaultItem.enc_data, VaultItem.iv,
+    VaultItem.attachments, VaultItem.version, VaultItem.created_at, VaultItem.last_modified
+)
+
+# fields=meta: just enough for a client to decide what to refresh, no blobs
+META_COLUMNS = (VaultItem.id, VaultItem.type, VaultItem.version, VaultItem.last_modified)
+
+def _items_page_statement(user_id: str, position, skip: int, limit: int, fields: str = "full"):
+    columns = META_COLUMNS if fields == "meta" else LISTING_COLUMNS
+    stmt = select(*columns).where(VaultItem.user_id == user_id).order_by(VaultItem.last_modified, VaultItem.id)
+    if position:
+        stmt = stmt.where(after_position(VaultItem.last_modified, VaultItem.id, position))
+    elif skip:
+        stmt = stmt.offset(skip)
+    return stmt.limit(limit + 1)
+
+def _items_page(items: list, limit: int, response: Response) -> list:
+    if len(items) > limit:
+        items = items[:limit]
+        response.headers["X-Next-Cursor"] = encode_cursor(items[-1].last_modified, items[-1].id)
+    return items
+
+def _after_change(seq_col, id_col, position):
+    change_seq, last_id = position
+    if last_id is None:
+        return seq_col > change_seq
+    return after_position(seq_col, id_col, position)
+
+def _changes_statements(user_id: str, position, limit: int):
+    # Ordered by change_seq, not last_modified: the sequence is assigned under the
+    # user's write lock, so a change can never commit behind a cursor already handed out
+    items_stmt = select(VaultItem).where(VaultItem.user_id == user_id)
+    if position:
+        items_stmt = items_stmt.where(_after_change(VaultItem.change_seq, VaultItem.id, position))
+    items_stmt = items_stmt.order_by(VaultItem.change_seq, VaultItem.id).limit(limit + 1)
+
+    # A fresh client has nothing to delete, so tombstones only matter once it holds a cursor
+    tombstones_stmt = None
+    if position:
+        tombstones_stmt = select(VaultItemTombstone).where(
+            VaultItemTombstone.user_id == user_id,
+            _after_change(VaultItemTombstone.change_seq, VaultItemTombstone.item_id, position)
+        ).order_by(VaultItemTombstone.change_seq, VaultItemTombstone.item_id).limit(limit + 1)
+    return items_stmt, tombstones_stmt
+
+def _changes_page(items: list, tombstones: list, limit: int, since: Optional[str]) -> dict:
+    # Merge both streams in (change_seq, id) order so the cursor never skips a change
+    changes = sorted(
+        [(item.change_seq, item.id, item) for item in items] +
+        [(tomb.change_seq, tomb.item_id, tomb) for tomb in tombstones],
+        key=lambda change: (change[0], change[1])
+    )
+    has_more = len(changes) > limit
+    page = changes[:limit]
+
+    cursor = since
+    if page:
+        last_seq, last_id, _ = page[-1]
+        cursor = encode_change_cursor(last_seq, last_id)
+
+    return {
+        "items": [vault_item_dict(change[2]) for change in page if isinstance(change[2], VaultItem)],
+        "deleted": [
+            {"item_id": change[1], "deleted_at": change[2].deleted_at}
+            for change in page if isinstance(change[2], VaultItemTombstone)
+        ],
+        "cursor": cursor,
+        "has_more": has_more
+    }
 
-@router.get("/", response_model=List[VaultItemResponse])
 def read_items(
-    db: Session = Depends(get_db),
+    request: Request,
+    response: Response,
+    db: Session = Depends(get_read_db),
     skip: int = 0, 
-    limit: int = 100,
+    limit: int = Query(100, ge=1, le=1000),
+    cursor: Optional[str] = None,
+    fields: str = Query("full", pattern="^(full|meta)$"),
     current_user: User = Depends(get_current_user)
 ) -> Any:
     """
     Retrieve all encrypted vault items for the current user.
+    Pass the X-Next-Cursor response header back as 'cursor' to fetch the next page;
+    'skip' is kept for older clients but gets slower the deeper it goes.
+    Send the last ETag as If-None-Match to get a bodiless 304 when nothing changed.
+    With fields=meta only id, type, version and last_modified are returned; pull the
+    blobs that changed with POST /vault/fetch.
     """
-    items = db.query(VaultItem).filter(VaultItem.user_id == current_user.id).offset(skip).limit(limit).all()
-    return items
+    etag = make_etag("vault", db.execute(vault_revision_statement(current_user.id)).scalar())
+    if etag_matches(request, etag):
+        return not_modified(etag)
+    response.headers["ETag"] = etag
+
+    stmt = _items_page_statement(current_user.id, decode_cursor(cursor), skip, limit, fields)
+    items = db.execute(stmt).all()
+    return vault_items_response(request, _items_page(items, limit, response), response, fields)
+
+async def read_items_async(
+    request: Request,
+    response: Response,
+    db: AsyncSession = Depends(get_async_read_db),
+    skip: int = 0,
+    limit: int = Query(100, ge=1, le=1000),
+    cursor: Optional[str] = None,
+    fields: str = Query("full", pattern="^(full|meta)$"),
+    current_user: User = Depends(get_current_user_async)
+) -> Any:
+    """
+    Retrieve all encrypted vault items for the current user.
+    Pass the X-Next-Cursor response header back as 'cursor' to fetch the next page;
+    'skip' is kept for older clients but gets slower the deeper it goes.
+    Send the last ETag as If-None-Match to get a bodiless 304 when nothing changed.
+    With fields=meta only id, type, version and last_modified are returned; pull the
+    blobs that changed with POST /vault/fetch.
+    """
+    etag = make_etag("vault", (await db.execute(vault_revision_statement(current_user.id))).scalar())
+    if etag_matches(request, etag):
+        return not_modified(etag)
+    response.headers["ETag"] = etag
+
+    stmt = _items_page_statement(current_user.id, decode_cursor(cursor), skip, limit, fields)
+    items = (await db.execute(stmt)).all()
+    return vault_items_response(request, _items_page(items, limit, response), response, fields)
+
+def read_changes(
+    request: Request,
+    since: Optional[str] = None,
+    limit: int = Query(500, ge=1, le=1000),
+    db: Session = Depends(get_user_db),
+    current_user: User = Depends(get_current_user)
+) -> Any:
+    """
+    Incremental sync: items created/modified and tombstones of items deleted after the 'since' cursor.
+    Omit 'since' for the initial full sync, then keep passing back the returned cursor.
+    """
+    items_stmt, tombstones_stmt = _changes_statements(current_user.id, decode_change_cursor(since), limit)
+    items = db.execute(items_stmt).scalars().all()
+    tombstones = db.execute(tombstones_stmt).scalars().all() if tombstones_stmt is not None else []
+    return negotiated_response(request, _changes_page(items, tombstones, limit, since))
+
+async def read_changes_async(
+    request: Request,
+    since: Optional[str] = None,
+    limit: int = Query(500, ge=1, le=1000),
+    db: AsyncSession = Depends(get_async_user_db),
+    current_user: User = Depends(get_current_user_async)
+) -> Any:
+    """
+    Incremental sync: items created/modified and tombstones of items deleted after the 'since' cursor.
+    Omit 'since' for the initial full sync, then keep passing back the returned cursor.
+    """
+    items_stmt, tombstones_stmt = _changes_statements(current_user.id, decode_change_cursor(since), limit)
+    items = (await db.execute(items_stmt)).scalars().all()
+    tombstones = (await db.execute(tombstones_stmt)).scalars().all() if tombstones_stmt is not None else []
+    return negotiated_response(request, _changes_page(items, tombstones, limit, since))
+
+# Read paths run on AsyncSession when DB_ASYNC is enabled; mutations stay on the sync stack
+router.add_api_route(
+    "/", read_items_async if settings.DB_ASYNC else read_items,
+    methods=["GET"], response_model=Union[List[VaultItemResponse], List[VaultItemMetaResponse]]
+)
+router.add_api_route(
+    "/changes", read_changes_async if settings.DB_ASYNC else read_changes,
+    methods=["GET"], response_model=VaultChangesResponse
+)
+
+def _current_revision(user_id: str) -> int:
+    db = shard_router.session_factory(user_id)()
+    try:
+        return db.execute(vault_revision_statement(user_id)).scalar() or 0
+    finally:
+        db.close()
+
+def _revision_event(revision: int) -> str:
+    return f"id: {revision}\nevent: vault\ndata: {json.dumps({'revision': revision})}\n\n"
+
+@router.post("/events/token", response_model=StreamTokenResponse)
+def create_events_token(user_id: str = Depends(get_current_user_id)) -> Any:
+    """
+    Short-lived token for GET /events?token=..., for EventSource clients that
+    cannot send an Authorization header. Fetch a fresh one for each (re)connect.
+    """
+    return {"token": security.create_stream_token(user_id), "expires_in": settings.STREAM_TOKEN_EXPIRE_SECONDS}
+
+@router.get("/events")
+async def vault_events(user_id: str = Depends(get_stream_user_id)) -> Any:
+    """
+    Server-Sent Events stream of "vault changed" notifications, replacing polling.
+    Each event carries the new vault revision (the number in the listing ETag); the
+    current one is sent on connect, so a reconnecting client knows if it missed a change.
+    Authenticate with the Authorization header, or ?token= from POST /events/token.
+    """
+    queue = change_hub.subscribe(user_id)
+    if queue is None:
+        raise HTTPException(status_code=503, detail="Too many open event streams", headers={"Retry-After": "30"})
+
+    async def stream():
+        try:
+            revision = await run_in_threadpool(_current_revision, user_id)
+            yield f"retry: 5000\n{_revision_event(revision)}"
+            while True:
+                try:
+                    revision = await asyncio.wait_for(queue.get(), timeout=settings.NOTIFY_KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    # Comment line keeps proxies from closing an idle connection
+                    yield ": keepalive\n\n"
+                    continue
+                yield _revision_event(revision)
+        finally:
+            change_hub.unsubscribe(user_id, queue)
+
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    return StreamingResponse(stream(), media_type="text/event-stream", headers=headers)
+
+@router.post("/fetch", response_model=List[VaultItemResponse])
+def fetch_items(
+    fetch_in: VaultFetchRequest,
+    request: Request,
+    db: Session = Depends(get_user_db),
+    current_user: User = Depends(get_current_user)
+) -> Any:
+    """
+    Multi-get: full encrypted items for the given ids. Unknown ids are left out.
+    """
+    ids = list(dict.fromkeys(fetch_in.ids))
+    items = []
+    for start in range(0, len(ids), BATCH_CHUNK_SIZE):
+        chunk = ids[start:start + BATCH_CHUNK_SIZE]
+        stmt = select(*LISTING_COLUMNS).where(VaultItem.user_id == current_user.id, VaultItem.id.in_(chunk))
+        items.extend(db.execute(stmt).all())
+    return vault_items_response(request, items)
+
+@router.get("/export")
+def export_items(
+    request: Request,
+    db: Session = Depends(get_user_db),
+    current_user: User = Depends(get_current_user)
+) -> Any:
+    """
+    Stream the full encrypted vault as NDJSON (gzip-encoded when the client accepts it):
+    a user line with the KDF salt and wrapped key needed to decrypt it, then the items.
+    """
+    user_id = current_user.id
+    log_event(db, user_id, "EXPORT", severity="WARNING", details="Full vault export", request=request)
+
+    stream = iter_export(user_id)
+    headers = {"Content-Disposition": 'attachment; filename="valutx-export.ndjson"', "Vary": "Accept-Encoding"}
+    if accepts_gzip(request.headers.get("accept-encoding")):
+        stream = gzip_stream(stream)
+        headers["Content-Encoding"] = "gzip"
+    return StreamingResponse(stream, media_type="application/x-ndjson", headers=headers)
 
 @router.post("/", response_model=VaultItemResponse)
+@idempotent
 def create_item(
     item_in: VaultItemCreate,
     request: Request,
-    db: Session = Depends(get_db),
+    db: Session = Depends(get_user_db),
     current_user: User = Depends(get_current_user)
 ) -> Any:
     """
     Create a new encrypted vault entry.
+    Files go in as attachments: upload each to /vault/attachments first, then list their digests.
     """
-    item = VaultItem(
-        user_id=current_user.id,
-        type=item_in.type,
-        enc_data=item_in.enc_data,
-        iv=item_in.iv,
-        auth_tag=item_in.auth_tag
-    )
-    db.add(item)
-    db.commit()
+    # Under the user's write lock, like every vault write (see reencrypt.commit_session)
+    with vault_write(db, current_user.id) as revision:
+        attachments = list(dict.fromkeys(item_in.attachments))
+        change_refcounts(db, current_user.id, Counter(attachments), Counter())
+        item = VaultItem(
+            user_id=current_user.id,
+            type=item_in.type,
+            enc_data=item_in.enc_data,
+            iv=item_in.iv,
+            auth_tag=item_in.auth_tag,
+            attachments=dump_refs(attachments),
+            change_seq=revision
+        )
+        db.add(item)
+        db.commit()
     db.refresh(item)
     
-    log_event(db, current_user.id, "ITEM_CREATE", severity="INFO", details=f"New {item.type} record added", request=request)
+    log_event(db, item.user_id, "ITEM_CREATE", severity="INFO", details=f"New {item.type} record added", request=request)
     
-    return item
+    return negotiated_response(request, vault_item_dict(item))
 
 @router.put("/{item_id}", response_model=VaultItemResponse)
+@idempotent
 def update_item(
     item_id: str, 
     item_in: VaultItemUpdate,
     request: Request,
-    db: Session = Depends(get_db),
+    db: Session = Depends(get_user_db),
     current_user: User = Depends(get_current_user)
 ) -> Any:
     """
     Update a vault entry.
     """
-    item = db.query(VaultItem).filter(VaultItem.id == item_id, VaultItem.user_id == current_user.id).first()
-    if not item:
-        raise HTTPException(status_code=404, detail="Item not found")
-    
-    # Conflict Detection
-    if item_in.version is not None and item_in.version != item.version:
-        raise HTTPException(status_code=409, detail="CONFLICT: Remote record is newer. Sync required.")
-
-    if item_in.enc_data:
-        item.enc_data = item_in.enc_data
-    if item_in.iv:
-        item.iv = item_in.iv
-    if item_in.auth_tag:
-        item.auth_tag = item_in.auth_tag
-    
-    # Increment version on update
-    item.version += 1
+    with vault_write(db, current_user.id) as revision:
+        # The old blob is about to be replaced, so don't load it
+        item = db.query(VaultItem).options(defer(VaultItem.enc_data)).filter(VaultItem.id == item_id, VaultItem.user_id == current_user.id).first()
+        if not item:
+            raise HTTPException(status_code=404, detail="Item not found")
+        
+        # Conflict Detection
+        if item_in.version is not None and item_in.version != item.version:
+            raise HTTPException(status_code=409, detail="CONFLICT: Remote record is newer. Sync required.")
+
+        if item_in.enc_data:
+            item.enc_data = item_in.enc_data
+        if item_in.iv:
+            item.iv = item_in.iv
+        if item_in.auth_tag:
+            item.auth_tag = item_in.auth_tag
+        if item_in.attachments is not None:
+            old, new = set(parse_refs(item.attachments)), set(item_in.attachments)
+            change_refcounts(db, current_user.id, Counter(new - old), Counter(old - new))
+            item.attachments = dump_refs(item_in.attachments)
         
-    db.commit()
+        # Increment version on update
+        item.version += 1
+        item.change_seq = revision
+            
+        db.commit()
     db.refresh(item)
     
-    log_event(db, current_user.id, "ITEM_UPDATE", severity="INFO", details=f"Record {item.type} updated", request=request)
+    log_event(db, item.user_id, "ITEM_UPDATE", severity="INFO", details=f"Record {item.type} updated", request=request)
     
-    return item
+    return negotiated_response(request, vault_item_dict(item))
 @router.delete("/{item_id}")
 def delete_item(
     item_id: str,
     request: Request,
-    db: Session = Depends(get_db),
+    db: Session = Depends(get_user_db),
     current_user: User = Depends(get_current_user)
 ) -> Any:
-    item = db.query(VaultItem).filter(VaultItem.id == item_id, VaultItem.user_id == current_user.id).first()
-    if not item:
-        raise HTTPException(status_code=404, detail="Item not found")
-        
-    db.delete(item)
-    db.commit()
+    with vault_write(db, current_user.id) as revision:
+        item = db.query(VaultItem).options(defer(VaultItem.enc_data)).filter(VaultItem.id == item_id, VaultItem.user_id == current_user.id).first()
+        if not item:
+            raise HTTPException(status_code=404, detail="Item not found")
+            
+        # Its attachments become orphans (and are swept later) if no other item uses them
+        change_refcounts(db, current_user.id, Counter(), Counter(parse_refs(item.attachments)))
+        db.delete(item)
+        # Record the deletion so incremental sync can propagate it to other clients
+        db.add(VaultItemTombstone(item_id=item.id, user_id=current_user.id, change_seq=revision))
+        db.commit()
     
-    log_event(db, current_user.id, "ITEM_DELETE", severity="WARNING", details=f"Record {item.type} purged", request=request)
+    log_event(db, item.user_id, "ITEM_DELETE", severity="WARNING", details=f"Record {item.type} purged", request=request)
     
-    return {"status": "success"}
+    return negotiated_response(request, {"status": "success"})
+
+@router.post("/batch", response_model=VaultBatchResponse)
+def batch_items(
+    batch_in: VaultBatchRequest,
+    request: Request,
+    db: Session = Depends(get_user_db),
+    current_user: User = Depends(get_current_user)
+) -> Any:
+    """
+    Apply many create/update/delete operations in a single transaction (imports, offline reconciliation).
+    Each operation gets its own result; conflicts and missing items don't abort the rest.
+    """
+    user_id = current_user.id
+    operations = batch_in.operations
+
+    # Load (version, type, attachments) for every referenced item up front, without the blobs
+    target_ids = list({op.id for op in operations if op.op != "create" and op.id})
+    existing = {}
+    for start in range(0, len(target_ids), BATCH_CHUNK_SIZE):
+        chunk = target_ids[start:start + BATCH_CHUNK_SIZE]
+        rows = db.query(VaultItem.id, VaultItem.version, VaultItem.type, VaultItem.attachments).filter(
+            VaultItem.user_id == user_id, VaultItem.id.in_(chunk)
+        ).all()
+        existing.update({
+            row.id: {"version": row.version, "type": row.type, "attachments": set(parse_refs(row.attachments))}
+            for row in rows
+        })
+    # Attachments named by any operation must have been uploaded; one lookup for the whole batch
+    known = known_digests(db, user_id, (digest for op in operations for digest in op.attachments or ()))
+    refs_added, refs_removed = Counter(), Counter()
+
+    now = datetime.datetime.utcnow()
+    creates, updates, deletes, tombstones, results = [], {}, [], [], []
+
+    def result(index, op, status, status_code, item_id=None, version=None, detail=None):
+        results.append({
+            "index": index, "op": op.op, "status": status, "status_code": status_code,
+            "id": item_id, "version": version, "detail": detail
+        })
+
+    for index, op in enumerate(operations):
+        if op.op == "create":
+            if not op.type or not op.enc_data or not op.iv:
+                result(index, op, "invalid", 422, detail="create requires type, enc_data and iv")
+                continue
+            if not known.issuperset(op.attachments or ()):
+                result(index, op, "invalid", 422, detail="Unknown attachment; upload it first")
+                continue
+            item_id = generate_uuid()
+            attachments = list(dict.fromkeys(op.attachments or ()))
+            refs_added.update(attachments)
+            creates.append({
+                "id": item_id, "user_id": user_id, "type": op.type,
+                "enc_data": op.enc_data, "iv": op.iv, "auth_tag": op.auth_tag,
+                "attachments": dump_refs(attachments),
+                "created_at": now, "last_modified": now, "version": 1
+            })
+            result(index, op, "ok", 200, item_id, 1)
+            continue
+
+        current = existing.get(op.id)
+        if current is None:
+            result(index, op, "not_found", 404, op.id, detail="Item not found")
+            continue
+        # Conflict Detection (same rule as update_item, applied in batch order)
+        if op.version is not None and op.version != current["version"]:
+            result(index, op, "conflict", 409, op.id, current["version"], detail="CONFLICT: Remote record is newer. Sync required.")
+            continue
+
+        if op.op == "update":
+            if not known.issuperset(op.attachments or ()):
+                result(index, op, "invalid", 422, op.id, detail="Unknown attachment; upload it first")
+                continue
+            current["version"] += 1
+            values = updates.setdefault(op.id, {"id": op.id})
+            for field in ("enc_data", "iv", "auth_tag"):
+                if getattr(op, field):
+                    values[field] = getattr(op, field)
+            if op.attachments is not None:
+                new = set(op.attachments)
+                refs_added.update(new - current["attachments"])
+                refs_removed.update(current["attachments"] - new)
+                current["attachments"] = new
+                values["attachments"] = dump_refs(op.attachments)
+            values["version"] = current["version"]
+            values["last_modified"] = now
+            result(index, op, "ok", 200, op.id, current["version"])
+        else:
+            refs_removed.update(existing.pop(op.id)["attachments"])
+            updates.pop(op.id, None)
+            deletes.append(op.id)
+            tombstones.append({"item_id": op.id, "user_id": user_id, "deleted_at": now})
+            result(index, op, "ok", 200, op.id)
+
+    if creates or updates or deletes:
+        with vault_write(db, user_id) as revision:
+            change_refcounts(db, user_id, refs_added, refs_removed)
+            if creates:
+                db.execute(insert(VaultItem), [dict(values, change_seq=revision) for values in creates])
+            if updates:
+                # ORM bulk UPDATE by primary key; ownership was checked when loading 'existing'
+                db.execute(update(VaultItem), [dict(values, change_seq=revision) for values in updates.values()])
+            for start in range(0, len(deletes), BATCH_CHUNK_SIZE):
+                chunk = deletes[start:start + BATCH_CHUNK_SIZE]
+                db.execute(delete(VaultItem).where(VaultItem.user_id == user_id, VaultItem.id.in_(chunk)))
+            if tombstones:
+                db.execute(insert(VaultItemTombstone), [dict(values, change_seq=revision) for values in tombstones])
+            db.commit()
+
+    applied = sum(1 for r in results if r["status"] == "ok")
+    if applied:
+        log_event(
+            db, user_id, "ITEM_BATCH", severity="INFO",
+            details=f"Batch applied: {len(creates)} created, {len(updates)} updated, {len(deletes)} purged",
+            request=request
+        )
+
+    return negotiated_response(request, {"applied": applied, "results": results})
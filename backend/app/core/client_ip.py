@@ -0,0 +1,74 @@
+"""
+Client address behind a reverse proxy.
+
+On Render (and any load balancer) the TCP peer is the proxy, so every user would
+share one rate-limit bucket and one audit IP. The forwarding headers are only
+believed when the peer is listed in TRUSTED_PROXIES; a client talking to the app
+directly could otherwise claim any address it likes.
+"""
+import ipaddress
+from typing import List, Optional, Union
+from fastapi import Request
+from app.core.config import settings
+
+Network = Union[ipaddress.IPv4Network, ipaddress.IPv6Network]
+Address = Union[ipaddress.IPv4Address, ipaddress.IPv6Address]
+
+def parse_networks(value: str) -> List[Network]:
+    # Comma-separated addresses or CIDRs; a bare address is a /32 (or /128)
+    return [ipaddress.ip_network(part.strip(), strict=False) for part in value.split(",") if part.strip()]
+
+trusted_proxies = parse_networks(settings.TRUSTED_PROXIES)
+
+def _parse_address(value: str) -> Optional[Address]:
+    value = value.strip().strip('"')
+    if value.startswith("["):
+        # Forwarded: for="[2001:db8::1]:4711"
+        value = value[1:].split("]", 1)[0]
+    elif value.count(":") == 1:
+        # IPv4 with a port
+        value = value.split(":", 1)[0]
+    try:
+        return ipaddress.ip_address(value)
+    except ValueError:
+        return None
+
+def _is_trusted(address: Address) -> bool:
+    return any(address in network for network in trusted_proxies)
+
+def _forwarded_hops(request: Request) -> List[str]:
+    # X-Forwarded-For is what Render and most proxies send; RFC 7239 Forwarded otherwise
+    hops = []
+    for header in request.headers.getlist("x-forwarded-for"):
+        hops.extend(part for part in header.split(",") if part.strip())
+    if hops:
+        return hops
+    for header in request.headers.getlist("forwarded"):
+        for element in header.split(","):
+            for pair in element.split(";"):
+                name, _, value = pair.partition("=")
+                if name.strip().lower() == "for" and value.strip():
+                    hops.append(value)
+    return hops
+
+def client_ip(request: Request) -> str:
+    """
+    Address of the client that sent the request. Walks the forwarding chain from
+    the right, skipping trusted proxies; the first hop that isn't one is the client
+    (each proxy appends the address it received the request from).
+    """
+    peer = request.client.host if request.client else None
+    if peer is None:
+        return "unknown"
+    address = _parse_address(peer)
+    if address is None or not _is_trusted(address):
+        return peer
+    for hop in reversed(_forwarded_hops(request)):
+        hop_address = _parse_address(hop)
+        if hop_address is None:
+            # Garbage (or "unknown") in the chain: don't look past it
+            break
+        address = hop_address
+        if not _is_trusted(address):
+            break
+    return str(address)
@@ -1,3 +1,4 @@
+from typing import Optional
 from pydantic_settings import BaseSettings
 
 class Settings(BaseSettings):
@@ -8,6 +9,99 @@ class Settings(BaseSettings):
     
     # Database
     DATABASE_URL: str = "sqlite:///./valutx.db"
+    # Serve read endpoints from an AsyncSession (aiosqlite / asyncpg) instead of the threadpool
+    DB_ASYNC: bool = False
+    # Optional read replica for listings and salt lookups
+    DATABASE_READ_URL: str = ""
+    # Horizontal sharding: comma-separated database URLs, one per shard (empty keeps all
+    # data on DATABASE_URL). The user -> shard directory always lives on DATABASE_URL.
+    DATABASE_SHARD_URLS: str = ""
+    SHARD_VIRTUAL_NODES: int = 128        # Points per shard on the consistent-hash ring
+    SHARD_DIRECTORY_TTL: float = 5.0      # Seconds a worker may serve a cached user -> shard entry
+    SHARD_MOVE_BATCH_SIZE: int = 1000     # Rows per round trip when rebalancing a user
+
+    # Engine profile: pool for server databases (Postgres)
+    DB_POOL_SIZE: int = 10
+    DB_MAX_OVERFLOW: int = 20
+    DB_POOL_TIMEOUT: float = 10.0
+    DB_POOL_RECYCLE: int = 1800           # Seconds; stay under server/proxy idle timeouts
+    DB_POOL_PRE_PING: bool = True
+    # Engine profile: pragmas applied to every SQLite connection
+    SQLITE_JOURNAL_MODE: str = "WAL"
+    SQLITE_SYNCHRONOUS: str = "NORMAL"
+    SQLITE_CACHE_SIZE_KB: int = 65536
+    SQLITE_MMAP_SIZE: int = 268435456
+    SQLITE_BUSY_TIMEOUT_MS: int = 5000
+
+    # Apply pending schema migrations at startup. Unset: only on SQLite (local development);
+    # server databases are migrated by a release step, not by every worker at import
+    DB_AUTO_MIGRATE: Optional[bool] = None
+    MIGRATION_BATCH_SIZE: int = 5000      # Rows per transaction in batched backfills
+
+    # Cache of verified tokens and user rows used by get_current_user
+    PRINCIPAL_CACHE_SIZE: int = 10000     # 0 disables
+    PRINCIPAL_CACHE_TTL: float = 60.0     # Seconds a cached user row may be served
+
+    # Idempotency-Key support on vault writes: a retried request gets the original response
+    IDEMPOTENCY_TTL_SECONDS: int = 86400  # How long a key (and its response) is remembered
+    IDEMPOTENCY_CACHE_SIZE: int = 10000   # In-memory tier per worker (0 disables); the database tier is shared
+    IDEMPOTENCY_WAIT_SECONDS: float = 10.0    # A duplicate waits this long for the original before a 409
+    IDEMPOTENCY_PENDING_TIMEOUT: float = 60.0 # A claim without a response after this long counts as abandoned
+
+    # Audit retention: rows older than this many days move to compressed archive segments (0 keeps everything hot)
+    AUDIT_RETENTION_DAYS: int = 0
+    AUDIT_ARCHIVE_DIR: str = "./audit_archive"
+    AUDIT_ARCHIVE_BATCH_SIZE: int = 5000
+    AUDIT_ARCHIVE_INTERVAL: float = 3600.0
+
+    # Throttling of login/signup/rotate-key (token buckets keyed by client IP and by email)
+    RATE_LIMIT_ENABLED: bool = True
+    RATE_LIMIT_BACKEND: str = "memory"    # "memory" (per process) or "sqlite" (shared by workers on a host)
+    RATE_LIMIT_SQLITE_PATH: str = "./ratelimit.db"
+    RATE_LIMIT_IP_PER_MINUTE: int = 30
+    RATE_LIMIT_EMAIL_PER_MINUTE: int = 10
+    # Reverse proxies (comma-separated IPs/CIDRs) whose X-Forwarded-For/Forwarded headers are
+    # believed for the client IP; empty uses the TCP peer address as is
+    TRUSTED_PROXIES: str = ""
+
+    # Password hashing pool (bcrypt runs out of the request threadpool; auth endpoints await it)
+    PASSWORD_HASH_WORKERS: int = 2        # 0 runs bcrypt on a thread of this process instead
+    PASSWORD_HASH_MAX_PENDING: int = 32   # In-flight hashes beyond this get a 503
+    PASSWORD_HASH_TIMEOUT: float = 10.0
+
+    # Audit log pipeline: events are queued and bulk-inserted by a background worker
+    AUDIT_BUFFERED: bool = True
+    AUDIT_BATCH_SIZE: int = 500           # Flush once this many events are queued...
+    AUDIT_FLUSH_INTERVAL: float = 0.5     # ...or this many seconds after the first one
+    AUDIT_QUEUE_SIZE: int = 10000         # Bounded so a stalled DB can't eat all memory
+    AUDIT_ENQUEUE_TIMEOUT: float = 0.05   # Wait this long on a full queue before writing inline
+    AUDIT_WRITE_RETRIES: int = 3          # A failed batch is retried this often (with backoff), then written row by row
+    AUDIT_RETRY_BACKOFF: float = 0.5      # Seconds before the first retry; doubles each time
+
+    # Listing responses at least this large are gzip/brotli-compressed when the client accepts it
+    RESPONSE_COMPRESSION_MIN_BYTES: int = 1024
+
+    # Vault re-encryption sessions (DEK rotation) are discarded after this long without a commit
+    REENCRYPT_SESSION_TTL_HOURS: int = 24
+
+    # Encrypted attachments: content-addressed files on local disk, referenced from vault items
+    ATTACHMENT_DIR: str = "./attachments"
+    ATTACHMENT_MAX_BYTES: int = 100 * 1024 * 1024
+    ATTACHMENT_ORPHAN_GRACE_HOURS: int = 24   # Unreferenced files are deleted after this long
+
+    # Push notifications of vault changes (Server-Sent Events at /vault/events)
+    NOTIFY_BROKER: str = "local"          # "local" (one worker) or "postgres" (LISTEN/NOTIFY across workers)
+    NOTIFY_KEEPALIVE_SECONDS: float = 25.0
+    NOTIFY_MAX_SUBSCRIBERS: int = 50000   # Open streams per worker
+    STREAM_TOKEN_EXPIRE_SECONDS: int = 60 # Lifetime of the query-string token EventSource connects with
+
+    # Prometheus metrics at /metrics (bearer METRICS_TOKEN required when set)
+    METRICS_ENABLED: bool = True
+    METRICS_TOKEN: str = ""
+    SLOW_REQUEST_SECONDS: float = 1.0
+
+    # Admin bulk backup (GET /api/v1/admin/backup); disabled while empty
+    ADMIN_BACKUP_TOKEN: str = ""
 
     # CORS
     # We use str here so Pydantic doesn't try to parse it as JSON
@@ -0,0 +1,157 @@
+import asyncio
+import multiprocessing
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Dict, Optional
+import bcrypt
+
+# Worker-side functions. Kept at module level (and this module kept free of app imports)
+# so spawned pool processes can unpickle them cheaply.
+
+def bcrypt_check(password_bytes: bytes, hashed: bytes) -> bool:
+    return bcrypt.checkpw(password_bytes, hashed)
+
+def bcrypt_hash(password_bytes: bytes) -> bytes:
+    return bcrypt.hashpw(password_bytes, bcrypt.gensalt())
+
+class PasswordHashingBusy(Exception):
+    """
+    Raised when the hashing pool is saturated or too slow; mapped to a 503 by the API.
+    """
+    pass
+
+class PasswordHashExecutor:
+    """
+    Runs bcrypt on a dedicated, size-limited process pool instead of the shared
+    request threadpool, so a login storm can't starve every other endpoint.
+    Callers await the result on the event loop; no request thread waits on a hash.
+    Work beyond 'max_pending' in-flight calls is rejected immediately rather than queued.
+
+    A call holds its slot until the hash actually stops running, not just until its
+    caller gives up: a timed-out bcrypt keeps a worker busy all the same. A pool whose
+    worker died is replaced on the next call, and the failed call is reported as busy.
+    """
+
+    def __init__(
+        self,
+        workers: int,
+        max_pending: int,
+        timeout: float,
+        on_complete: Optional[Callable[[str, float], None]] = None,
+        on_reject: Optional[Callable[[str], None]] = None
+    ):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.timeout = timeout
+        # Optional observers (metrics); called with the operation name
+        self.on_complete = on_complete
+        self.on_reject = on_reject
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._stats: Dict[str, Dict[str, float]] = {}
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._pool is None:
+                # 'spawn' avoids forking a process that already runs threads
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context("spawn")
+                )
+            return self._pool
+
+    def _discard_pool(self, pool: ProcessPoolExecutor):
+        # Only the caller that saw this pool break replaces it
+        with self._lock:
+            if self._pool is pool:
+                self._pool = None
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    def _release(self, *_):
+        with self._lock:
+            self._pending -= 1
+
+    async def run(self, fn: Callable, *args) -> Any:
+        with self._lock:
+            saturated = self._pending >= self.max_pending
+            if not saturated:
+                self._pending += 1
+        if saturated:
+            self._record_rejection(fn.__name__)
+            raise PasswordHashingBusy("Password hashing queue is full")
+
+        start = time.perf_counter()
+        try:
+            if self.workers <= 0:
+                # No pool configured: a thread of asyncio's default executor, which is
+                # separate from the threadpool serving sync endpoints
+                def call():
+                    try:
+                        return fn(*args)
+                    finally:
+                        self._release()
+                waiter = asyncio.ensure_future(asyncio.to_thread(call))
+            else:
+                pool = self._get_pool()
+                try:
+                    future = pool.submit(fn, *args)
+                except BrokenProcessPool:
+                    self._release()
+                    self._discard_pool(pool)
+                    self._record_rejection(fn.__name__)
+                    raise PasswordHashingBusy("Password hashing pool failed")
+                except BaseException:
+                    self._release()
+                    raise
+                # Fires once the hash finished, failed, or was cancelled before it started
+                future.add_done_callback(self._release)
+                waiter = asyncio.wrap_future(future)
+            try:
+                # On timeout this cancels a hash still queued; a running one finishes
+                # (and only then frees its slot)
+                return await asyncio.wait_for(waiter, self.timeout)
+            except asyncio.TimeoutError:
+                self._record_rejection(fn.__name__)
+                raise PasswordHashingBusy("Password hashing timed out")
+            except BrokenProcessPool:
+                self._discard_pool(pool)
+                self._record_rejection(fn.__name__)
+                raise PasswordHashingBusy("Password hashing pool failed")
+        finally:
+            self._record(fn.__name__, time.perf_counter() - start)
+
+    def _record(self, name: str, elapsed: float):
+        with self._lock:
+            stats = self._stats.setdefault(name, {"count": 0, "seconds": 0.0, "max_seconds": 0.0, "rejected": 0})
+            stats["count"] += 1
+            stats["seconds"] += elapsed
+            stats["max_seconds"] = max(stats["max_seconds"], elapsed)
+        if self.on_complete is not None:
+            self.on_complete(name, elapsed)
+
+    def _record_rejection(self, name: str):
+        with self._lock:
+            stats = self._stats.setdefault(name, {"count": 0, "seconds": 0.0, "max_seconds": 0.0, "rejected": 0})
+            stats["rejected"] += 1
+        if self.on_reject is not None:
+            self.on_reject(name)
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Snapshot of queue depth and per-operation timings (wall time including queueing).
+        """
+        with self._lock:
+            return {
+                "pending": self._pending,
+                "workers": self.workers,
+                "operations": {name: dict(values) for name, values in self._stats.items()}
+            }
+
+    def shutdown(self):
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=True, cancel_futures=True)
@@ -0,0 +1,231 @@
+import bisect
+import contextvars
+import logging
+import threading
+import time
+from collections import defaultdict
+from typing import Callable, Dict, List, Optional, Tuple
+from sqlalchemy import event
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Latency buckets in seconds (Prometheus convention)
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 100)
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+class Counter:
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._values: Dict[tuple, float] = defaultdict(float)
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount: float = 1.0):
+        with self._lock:
+            self._values[labels] += amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for labels, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labelnames, labels)} {value}")
+        return lines
+
+class Histogram:
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = tuple(buckets)
+        # labels -> [per-bucket counts..., +Inf count, sum]
+        self._values: Dict[tuple, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, *labels, value: float):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._values.get(labels)
+            if series is None:
+                series = self._values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for labels, series in sorted(self._values.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets, series):
+                    cumulative += count
+                    bucket_labels = _format_labels(self.labelnames, labels, 'le="%s"' % bound)
+                    lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+                cumulative += series[len(self.buckets)]
+                bucket_labels = _format_labels(self.labelnames, labels, 'le="+Inf"')
+                lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+                lines.append(f"{self.name}_sum{_format_labels(self.labelnames, labels)} {series[-1]}")
+                lines.append(f"{self.name}_count{_format_labels(self.labelnames, labels)} {cumulative}")
+        return lines
+
+class Gauge:
+    """
+    Metric whose samples are read from a callback at scrape time. Also used (with
+    kind="counter") to expose counters that another component already keeps.
+    """
+
+    def __init__(self, name: str, documentation: str, collect: Callable[[], List[Tuple[dict, float]]], kind: str = "gauge"):
+        self.name = name
+        self.documentation = documentation
+        self.collect = collect
+        self.kind = kind
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for labels, value in self.collect():
+            names = tuple(labels.keys())
+            lines.append(f"{self.name}{_format_labels(names, tuple(labels.values()))} {value}")
+        return lines
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+registry = Registry()
+
+http_requests = registry.register(Counter(
+    "valutx_http_requests_total", "HTTP requests by route and status.", ("method", "route", "status")))
+http_latency = registry.register(Histogram(
+    "valutx_http_request_duration_seconds", "HTTP request latency by route.", ("method", "route")))
+http_db_queries = registry.register(Histogram(
+    "valutx_http_request_db_queries", "Database queries issued per HTTP request.", ("method", "route"), COUNT_BUCKETS))
+http_db_seconds = registry.register(Histogram(
+    "valutx_http_request_db_seconds", "Time spent in database queries per HTTP request.", ("method", "route")))
+db_query_latency = registry.register(Histogram(
+    "valutx_db_query_duration_seconds", "Latency of individual database queries."))
+db_pool_wait = registry.register(Histogram(
+    "valutx_db_pool_checkout_wait_seconds", "Time spent waiting to check a connection out of the pool."))
+password_hash_latency = registry.register(Histogram(
+    "valutx_password_hash_duration_seconds", "bcrypt calls including queueing on the hashing pool.", ("operation",)))
+password_hash_rejected = registry.register(Counter(
+    "valutx_password_hash_rejected_total", "bcrypt calls rejected because the hashing pool was saturated.", ("operation",)))
+audit_write_retries = registry.register(Counter(
+    "valutx_audit_write_retries_total", "Audit batches retried after a failed insert."))
+audit_events_dropped = registry.register(Counter(
+    "valutx_audit_events_dropped_total", "Audit events that could not be written even row by row (logged at ERROR)."))
+
+class RequestStats:
+    """
+    Per-request database accounting, shared by the middleware and the engine hooks.
+    """
+    __slots__ = ("queries", "query_seconds", "statements")
+
+    def __init__(self):
+        self.queries = 0
+        self.query_seconds = 0.0
+        self.statements: Dict[str, List[float]] = defaultdict(lambda: [0, 0.0])
+
+    def record(self, statement: str, elapsed: float):
+        self.queries += 1
+        self.query_seconds += elapsed
+        entry = self.statements[statement]
+        entry[0] += 1
+        entry[1] += elapsed
+
+    def top_statements(self, count: int = 5) -> List[Tuple[str, int, float]]:
+        ranked = sorted(self.statements.items(), key=lambda item: item[1][1], reverse=True)[:count]
+        return [(" ".join(statement.split())[:200], calls, seconds) for statement, (calls, seconds) in ranked]
+
+# Holds a mutable RequestStats; copied contexts (threadpool, tasks) share the same object
+current_request_stats: contextvars.ContextVar[Optional[RequestStats]] = contextvars.ContextVar("current_request_stats", default=None)
+
+def instrument_engine(engine):
+    """
+    Hooks query timing and pool checkout wait measurement onto a SQLAlchemy engine.
+    """
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_start_time", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["query_start_time"].pop()
+        db_query_latency.observe(value=elapsed)
+        stats = current_request_stats.get()
+        if stats is not None:
+            stats.record(statement, elapsed)
+
+    # The pool has no "before checkout" event, so time the call that blocks on it.
+    # Wrapping the engine (not the pool) survives engine.dispose() replacing the pool.
+    raw_connection = engine.raw_connection
+
+    def timed_raw_connection(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return raw_connection(*args, **kwargs)
+        finally:
+            db_pool_wait.observe(value=time.perf_counter() - start)
+
+    engine.raw_connection = timed_raw_connection
+
+def _route_template(scope) -> str:
+    # Routes from include_router() are resolved lazily: scope["route"] holds the
+    # path relative to its router, the full template lives on the route context.
+    context = (scope.get("fastapi") or {}).get("effective_route_context")
+    path = getattr(context, "path", None)
+    if path:
+        return path
+    return getattr(scope.get("route"), "path", None) or "unmatched"
+
+async def metrics_middleware(request, call_next):
+    """
+    Records latency and per-request DB query counts by route template, and logs
+    requests slower than SLOW_REQUEST_SECONDS with their query breakdown.
+    """
+    stats = RequestStats()
+    token = current_request_stats.set(stats)
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        elapsed = time.perf_counter() - start
+        current_request_stats.reset(token)
+
+        # Label by route template, never the raw path, to keep cardinality bounded
+        route_path = _route_template(request.scope)
+        method = request.method
+        http_requests.inc(method, route_path, str(status))
+        http_latency.observe(method, route_path, value=elapsed)
+        http_db_queries.observe(method, route_path, value=stats.queries)
+        http_db_seconds.observe(method, route_path, value=stats.query_seconds)
+
+        if elapsed >= settings.SLOW_REQUEST_SECONDS:
+            breakdown = "; ".join(
+                f"{calls}x {seconds * 1000:.1f}ms {statement}" for statement, calls, seconds in stats.top_statements()
+            )
+            logger.warning(
+                "Slow request %s %s -> %s in %.1fms (%d queries, %.1fms in DB) %s",
+                method, route_path, status, elapsed * 1000, stats.queries, stats.query_seconds * 1000, breakdown
+            )
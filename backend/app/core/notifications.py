@@ -0,0 +1,136 @@
+import asyncio
+import logging
+from typing import Callable, Dict, Optional, Set
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+# deliver(user_id, revision), always called on the event loop
+Deliver = Callable[[str, int], None]
+
+class LocalBroker:
+    """
+    Fan-out inside this process only. Enough for a single worker (and for tests).
+    """
+
+    def __init__(self):
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._deliver: Optional[Deliver] = None
+
+    async def start(self, loop: asyncio.AbstractEventLoop, deliver: Deliver):
+        self._loop = loop
+        self._deliver = deliver
+
+    async def stop(self):
+        self._loop = None
+
+    def publish(self, user_id: str, revision: int):
+        loop = self._loop
+        if loop is not None and not loop.is_closed():
+            loop.call_soon_threadsafe(self._deliver, user_id, revision)
+
+class PostgresBroker:
+    """
+    Cross-worker fan-out over Postgres LISTEN/NOTIFY on one asyncpg connection per worker.
+    """
+
+    def __init__(self, dsn: str, channel: str = "valutx_vault_changes"):
+        self.dsn = dsn
+        self.channel = channel
+        self._conn = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    async def start(self, loop: asyncio.AbstractEventLoop, deliver: Deliver):
+        import asyncpg
+
+        def on_notify(connection, pid, channel, payload):
+            user_id, _, revision = payload.partition(":")
+            deliver(user_id, int(revision))
+
+        self._loop = loop
+        self._conn = await asyncpg.connect(self.dsn)
+        await self._conn.add_listener(self.channel, on_notify)
+
+    async def stop(self):
+        conn, self._conn = self._conn, None
+        if conn is not None:
+            await conn.close()
+
+    def publish(self, user_id: str, revision: int):
+        if self._conn is None or self._loop is None or self._loop.is_closed():
+            return
+        future = asyncio.run_coroutine_threadsafe(
+            self._conn.execute("SELECT pg_notify($1, $2)", self.channel, f"{user_id}:{revision}"), self._loop
+        )
+        future.add_done_callback(_log_publish_failure)
+
+def _log_publish_failure(future):
+    if future.exception() is not None:
+        logger.warning("Change notification could not be published: %s", future.exception())
+
+class ChangeHub:
+    """
+    In-process pub/sub of "vault changed (revision N)" per user, fed through a
+    pluggable broker so commits on any worker reach subscribers on every worker.
+
+    A subscriber is one bounded asyncio.Queue, nothing else: idle connections cost
+    no task or thread of their own. Only the newest revision matters, so a slow
+    subscriber's pending value is overwritten instead of queueing up.
+    """
+
+    def __init__(self, broker):
+        self.broker = broker
+        self._subscribers: Dict[str, Set[asyncio.Queue]] = {}
+        self._count = 0
+
+    async def start(self):
+        await self.broker.start(asyncio.get_running_loop(), self._deliver)
+
+    async def stop(self):
+        await self.broker.stop()
+
+    @property
+    def subscriber_count(self) -> int:
+        return self._count
+
+    def subscribe(self, user_id: str) -> Optional[asyncio.Queue]:
+        """
+        Returns the queue to read revisions from, or None when this worker is full.
+        """
+        if self._count >= settings.NOTIFY_MAX_SUBSCRIBERS:
+            return None
+        queue = asyncio.Queue(maxsize=1)
+        self._subscribers.setdefault(user_id, set()).add(queue)
+        self._count += 1
+        return queue
+
+    def unsubscribe(self, user_id: str, queue: asyncio.Queue):
+        queues = self._subscribers.get(user_id)
+        if queues and queue in queues:
+            queues.discard(queue)
+            self._count -= 1
+            if not queues:
+                del self._subscribers[user_id]
+
+    def publish(self, user_id: str, revision: int):
+        """
+        Thread-safe; called from request threads after a commit.
+        """
+        try:
+            self.broker.publish(user_id, revision)
+        except Exception:
+            # Notifications are best effort; clients still converge on their next read
+            logger.exception("Change notification failed")
+
+    def _deliver(self, user_id: str, revision: int):
+        for queue in self._subscribers.get(user_id, ()):
+            if queue.full():
+                queue.get_nowait()
+            queue.put_nowait(revision)
+
+def _build_broker():
+    if settings.NOTIFY_BROKER == "postgres":
+        return PostgresBroker(settings.DATABASE_URL.replace("postgres://", "postgresql://", 1))
+    return LocalBroker()
+
+change_hub = ChangeHub(_build_broker())
@@ -0,0 +1,131 @@
+import logging
+import math
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional, Tuple
+from fastapi import HTTPException, Request
+from app.core.config import settings
+from app.core.client_ip import client_ip
+
+logger = logging.getLogger(__name__)
+
+class MemoryRateLimitBackend:
+    """
+    Per-process token buckets. Bounded: the least recently used keys are forgotten first.
+    """
+
+    def __init__(self, max_keys: int = 100000):
+        self.max_keys = max_keys
+        self._buckets: "OrderedDict[str, Tuple[float, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key: str, capacity: int, refill_per_second: float) -> float:
+        """
+        Takes one token from 'key'. Returns 0 if allowed, else seconds until a token is available.
+        """
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.get(key, (float(capacity), now))
+            tokens = min(float(capacity), tokens + (now - updated) * refill_per_second)
+            if tokens >= 1:
+                self._buckets[key] = (tokens - 1, now)
+                wait = 0.0
+            else:
+                self._buckets[key] = (tokens, now)
+                wait = (1 - tokens) / refill_per_second
+            self._buckets.move_to_end(key)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+            return wait
+
+class SQLiteRateLimitBackend:
+    """
+    Token buckets in a shared SQLite file, so every worker process on a host sees the
+    same counts. Each take() is a single short IMMEDIATE transaction.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        self._connection().execute(
+            "CREATE TABLE IF NOT EXISTS rate_limits (key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)"
+        )
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=1.0, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def take(self, key: str, capacity: int, refill_per_second: float) -> float:
+        # Wall clock, since monotonic clocks are not comparable across processes
+        now = time.time()
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT tokens, updated FROM rate_limits WHERE key = ?", (key,)).fetchone()
+            tokens, updated = row if row else (float(capacity), now)
+            tokens = min(float(capacity), tokens + max(0.0, now - updated) * refill_per_second)
+            if tokens >= 1:
+                tokens -= 1
+                wait = 0.0
+            else:
+                wait = (1 - tokens) / refill_per_second
+            conn.execute(
+                "INSERT INTO rate_limits (key, tokens, updated) VALUES (?, ?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET tokens = excluded.tokens, updated = excluded.updated",
+                (key, tokens, now)
+            )
+            conn.execute("COMMIT")
+            return wait
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+class RateLimiter:
+    """
+    Token-bucket limiter over a pluggable backend. Each rule allows 'per_minute'
+    attempts per key, refilling continuously, with bursts up to the same amount.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+
+    def check(self, key: str, per_minute: int) -> float:
+        if per_minute <= 0:
+            return 0.0
+        try:
+            return self.backend.take(key, per_minute, per_minute / 60.0)
+        except Exception:
+            # A broken limiter store must not lock everyone out
+            logger.exception("Rate limiter backend failed; allowing request")
+            return 0.0
+
+def _build_backend():
+    if settings.RATE_LIMIT_BACKEND == "sqlite":
+        return SQLiteRateLimitBackend(settings.RATE_LIMIT_SQLITE_PATH)
+    return MemoryRateLimitBackend()
+
+rate_limiter = RateLimiter(_build_backend())
+
+def enforce_auth_rate_limit(request: Request, scope: str, email: Optional[str] = None):
+    """
+    Throttles credential endpoints per client IP and per account email before any
+    bcrypt work is done. Raises 429 with Retry-After when a bucket is empty.
+    """
+    if not settings.RATE_LIMIT_ENABLED:
+        return
+    ip = client_ip(request)
+    wait = rate_limiter.check(f"{scope}:ip:{ip}", settings.RATE_LIMIT_IP_PER_MINUTE)
+    if email:
+        wait = max(wait, rate_limiter.check(f"{scope}:email:{email.strip().lower()}", settings.RATE_LIMIT_EMAIL_PER_MINUTE))
+    if wait > 0:
+        raise HTTPException(
+            status_code=429,
+            detail="Too many attempts, please try again later.",
+            headers={"Retry-After": str(max(1, math.ceil(wait)))},
+        )
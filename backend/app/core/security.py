@@ -1,12 +1,28 @@
-import bcrypt
 import hashlib
 from datetime import datetime, timedelta
 from typing import Optional, Any, Union
 from jose import jwt
+from app.core import metrics
 from app.core.config import settings
+from app.core.hashing import PasswordHashExecutor, PasswordHashingBusy, bcrypt_check, bcrypt_hash
 
 ALGORITHM = "HS256"
 
+# 'scope' claim of tokens that only open the change stream; access tokens carry none
+STREAM_TOKEN_SCOPE = "stream"
+
+# Which format matched in check_password
+HASH_SCHEME_PREHASHED = "prehashed"
+HASH_SCHEME_LEGACY = "legacy"
+
+hash_executor = PasswordHashExecutor(
+    workers=settings.PASSWORD_HASH_WORKERS,
+    max_pending=settings.PASSWORD_HASH_MAX_PENDING,
+    timeout=settings.PASSWORD_HASH_TIMEOUT,
+    on_complete=lambda operation, seconds: metrics.password_hash_latency.observe(operation, value=seconds),
+    on_reject=lambda operation: metrics.password_hash_rejected.inc(operation)
+)
+
 def create_access_token(subject: Union[str, Any], expires_delta: timedelta = None) -> str:
     if expires_delta:
         expire = datetime.utcnow() + expires_delta
@@ -17,6 +33,15 @@ def create_access_token(subject: Union[str, Any], expires_delta: timedelta = Non
     encoded_jwt = jwt.encode(to_encode, settings.SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
+def create_stream_token(subject: Union[str, Any]) -> str:
+    """
+    Short-lived token for EventSource, which can only authenticate in the URL
+    (and so in proxy and access logs). It opens /vault/events and nothing else.
+    """
+    expire = datetime.utcnow() + timedelta(seconds=settings.STREAM_TOKEN_EXPIRE_SECONDS)
+    to_encode = {"exp": expire, "sub": str(subject), "scope": STREAM_TOKEN_SCOPE}
+    return jwt.encode(to_encode, settings.SECRET_KEY, algorithm=ALGORITHM)
+
 def _get_prehashed_password(password: str) -> bytes:
     """
     Bcrypt has a 72-character limit. To safely handle any input length,
@@ -24,33 +49,46 @@ def _get_prehashed_password(password: str) -> bytes:
     """
     return hashlib.sha256(password.encode("utf-8")).hexdigest().encode("utf-8")
 
-def verify_password(plain_password: str, hashed_password: str) -> bool:
+async def check_password(plain_password: str, hashed_password: str, allow_legacy: bool = True) -> Optional[str]:
     """
-    Verifies a password against its hash.
-    Tries the NEW format (SHA256 pre-hash) first.
-    If that fails, tries the OLD format (Direct) for backwards compatibility.
+    Verifies a password against its hash and reports which format matched
+    (HASH_SCHEME_PREHASHED / HASH_SCHEME_LEGACY), or None if neither did.
+    The OLD format is only tried when 'allow_legacy' is set, so users already
+    known to be on the new format never pay for a second bcrypt run.
     """
     try:
+        hashed_bytes = hashed_password.encode("utf-8")
+
         # 1. Try NEW format (Safe for any length)
         password_bytes = _get_prehashed_password(plain_password)
-        if bcrypt.checkpw(password_bytes, hashed_password.encode("utf-8")):
-            return True
+        if await hash_executor.run(bcrypt_check, password_bytes, hashed_bytes):
+            return HASH_SCHEME_PREHASHED
         
         # 2. Try OLD format (Backwards compatibility)
         # Note: bcrypt.checkpw only accepts passwords <= 72 bytes.
         original_password_bytes = plain_password.encode("utf-8")
-        if len(original_password_bytes) <= 72:
-            return bcrypt.checkpw(original_password_bytes, hashed_password.encode("utf-8"))
+        if allow_legacy and len(original_password_bytes) <= 72:
+            if await hash_executor.run(bcrypt_check, original_password_bytes, hashed_bytes):
+                return HASH_SCHEME_LEGACY
             
-        return False
-    except Exception:
-        return False
+        return None
+    except ValueError:
+        # Malformed stored hash: it can't match anything. Anything else (overload,
+        # a broken pool) is not a wrong password and propagates
+        return None
+
+async def verify_password(plain_password: str, hashed_password: str) -> bool:
+    """
+    Verifies a password against its hash.
+    Tries the NEW format (SHA256 pre-hash) first.
+    If that fails, tries the OLD format (Direct) for backwards compatibility.
+    """
+    return await check_password(plain_password, hashed_password) is not None
 
-def get_password_hash(password: str) -> str:
+async def get_password_hash(password: str) -> str:
     """
-    Hashes a password using direct bcrypt call.
+    Hashes a password with bcrypt (on the hashing pool).
     """
     password_bytes = _get_prehashed_password(password)
-    salt = bcrypt.gensalt()
-    hashed = bcrypt.hashpw(password_bytes, salt)
+    hashed = await hash_executor.run(bcrypt_hash, password_bytes)
     return hashed.decode("utf-8")
@@ -1,4 +1,8 @@
 from app.db.session import Base
 from app.models.user import User
-from app.models.item import VaultItem
-from app.models.audit import AuditLog
+from app.models.item import VaultItem, VaultItemTombstone
+from app.models.audit import AuditLog, AuditDailyCount
+from app.models.reencrypt import ReencryptionSession, ReencryptionStagedItem
+from app.models.shard import UserShard
+from app.models.idempotency import IdempotencyKey
+from app.models.attachment import Attachment
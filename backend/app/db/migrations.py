@@ -0,0 +1,631 @@
+"""
+Versioned schema migrations.
+
+The applied version lives in a one-row-per-migration 'schema_version' table, so
+the startup check is a single indexed MAX() instead of reflecting every table.
+Migrations run in order; each one either runs inside a single transaction, or
+(online=True) gets the engine and commits in batches so large backfills and
+index builds never hold one long lock.
+
+Run from backend/:
+    python -m app.db.migrations upgrade
+    python -m app.db.migrations current
+    python -m app.db.migrations rehearse --url postgresql://.../scratch
+"""
+import argparse
+import base64
+import logging
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Callable, Dict, Iterator, List, Optional
+from sqlalchemy import (
+    Boolean, Column, DateTime, ForeignKey, Integer, MetaData, String, Table, Text, func, inspect, select, text
+)
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.exc import DBAPIError, OperationalError, ProgrammingError
+from app.core.config import settings
+from app.db.base import Base
+
+logger = logging.getLogger(__name__)
+
+# Kept out of Base.metadata so create_all() never touches it
+version_metadata = MetaData()
+schema_version = Table(
+    "schema_version",
+    version_metadata,
+    Column("version", Integer, primary_key=True),
+    Column("name", String, nullable=False),
+    Column("applied_at", DateTime, nullable=False),
+)
+
+# Arbitrary constant for pg_advisory_lock so concurrent instances migrate one at a time
+MIGRATION_LOCK_ID = 7318201
+MIGRATION_LOCK_POLL_SECONDS = 1.0
+
+class Migration:
+    def __init__(self, version: int, name: str, upgrade: Callable, online: bool = False):
+        self.version = version
+        self.name = name
+        self.upgrade = upgrade
+        # online migrations receive the Engine and manage their own (batched) transactions
+        self.online = online
+
+MIGRATIONS: List[Migration] = []
+
+def migration(version: int, name: str, online: bool = False):
+    """
+    Registers an upgrade step. Versions must be added in increasing order.
+    """
+    def decorator(fn):
+        if MIGRATIONS and version <= MIGRATIONS[-1].version:
+            raise ValueError(f"Migration {version} registered out of order")
+        MIGRATIONS.append(Migration(version, name, fn, online))
+        return fn
+    return decorator
+
+def head_version() -> int:
+    return MIGRATIONS[-1].version if MIGRATIONS else 0
+
+# ---------------------------------------------------------------------------
+# Helpers for migrations (SQLite and Postgres)
+# ---------------------------------------------------------------------------
+
+def column_names(conn: Connection, table: str) -> List[str]:
+    return [column["name"] for column in inspect(conn).get_columns(table)]
+
+def add_column(conn: Connection, table: str, ddl: str):
+    """
+    Adds a column if it does not exist yet. 'ddl' is "<name> <type> [DEFAULT ...]".
+    """
+    name = ddl.split()[0]
+    if name not in column_names(conn, table):
+        conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {ddl}"))
+
+def create_index(engine: Engine, name: str, table: str, columns: List[str]):
+    """
+    Builds an index without blocking writers where the database allows it
+    (CREATE INDEX CONCURRENTLY on Postgres, which must run outside a transaction).
+    """
+    column_list = ", ".join(columns)
+    if engine.dialect.name == "postgresql":
+        with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            conn.execute(text(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {table} ({column_list})"))
+    else:
+        with engine.begin() as conn:
+            conn.execute(text(f"CREATE INDEX IF NOT EXISTS {name} ON {table} ({column_list})"))
+
+def backfill(
+    engine: Engine,
+    table: str,
+    key: str,
+    assignments: str,
+    where: str,
+    batch_size: Optional[int] = None,
+    params: Optional[dict] = None
+) -> int:
+    """
+    Runs "UPDATE table SET assignments WHERE where" in key-ordered chunks of
+    'batch_size' rows, one short transaction per chunk. 'where' must stop
+    matching a row once it has been updated, or the loop never ends.
+    Returns the number of rows updated.
+    """
+    batch_size = batch_size or settings.MIGRATION_BATCH_SIZE
+    statement = text(
+        f"UPDATE {table} SET {assignments} WHERE {key} IN "
+        f"(SELECT {key} FROM {table} WHERE {where} ORDER BY {key} LIMIT :batch_size)"
+    )
+    total = 0
+    while True:
+        with engine.begin() as conn:
+            updated = conn.execute(statement, {**(params or {}), "batch_size": batch_size}).rowcount
+        total += updated
+        if updated < batch_size:
+            return total
+        logger.info("Backfilled %d rows of %s", total, table)
+
+def rebuild_sqlite_table(conn: Connection, table_name: str, converters: Dict[str, Callable], batch_size: Optional[int] = None):
+    """
+    SQLite cannot change a column's type in place: rename the table away, create
+    it again from the model (with its indexes) and copy the rows across in
+    batches, passing the columns named in 'converters' through their function.
+    """
+    batch_size = batch_size or settings.MIGRATION_BATCH_SIZE
+    old = f"{table_name}__old"
+    # Keep foreign keys in other tables pointing at the name, not the renamed table
+    conn.exec_driver_sql("PRAGMA legacy_alter_table=ON")
+    conn.exec_driver_sql(f"ALTER TABLE {table_name} RENAME TO {old}")
+    indexes = conn.exec_driver_sql(
+        "SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = ? AND sql IS NOT NULL", (old,)
+    ).scalars().all()
+    for index_name in indexes:
+        conn.exec_driver_sql(f"DROP INDEX {index_name}")
+    Base.metadata.tables[table_name].create(conn)
+
+    new_columns = column_names(conn, table_name)
+    columns = [name for name in column_names(conn, old) if name in new_columns]
+    insert = f"INSERT INTO {table_name} ({', '.join(columns)}) VALUES ({', '.join('?' for _ in columns)})"
+    result = conn.exec_driver_sql(f"SELECT {', '.join(columns)} FROM {old}")
+    copied = 0
+    while True:
+        rows = result.fetchmany(batch_size)
+        if not rows:
+            break
+        conn.exec_driver_sql(insert, [
+            tuple(converters[name](value) if name in converters else value for name, value in zip(columns, row))
+            for row in rows
+        ])
+        copied += len(rows)
+        logger.info("Copied %d rows of %s", copied, table_name)
+    conn.exec_driver_sql(f"DROP TABLE {old}")
+    conn.exec_driver_sql("PRAGMA legacy_alter_table=OFF")
+
+# ---------------------------------------------------------------------------
+# Runner
+# ---------------------------------------------------------------------------
+
+def current_version(engine: Engine) -> Optional[int]:
+    """
+    Applied schema version, or None when the database has never been migrated.
+    """
+    try:
+        with engine.connect() as conn:
+            return conn.execute(select(func.max(schema_version.c.version))).scalar() or 0
+    except (OperationalError, ProgrammingError):
+        return None
+
+def _record(conn: Connection, step: Migration):
+    conn.execute(schema_version.insert().values(
+        version=step.version, name=step.name, applied_at=datetime.now(timezone.utc)
+    ))
+
+def _is_applied(conn: Connection, step: Migration) -> bool:
+    return conn.execute(select(schema_version.c.version).where(schema_version.c.version == step.version)).first() is not None
+
+@contextmanager
+def _runner_lock(engine: Engine) -> Iterator[None]:
+    """
+    Holds the migration lock for a whole run on Postgres, online steps included,
+    on a connection of its own (a session-level advisory lock outlives the steps'
+    transactions). Other instances wait, then find every step applied.
+
+    Waiters poll outside any transaction: a transaction blocked in pg_advisory_lock
+    would in turn block the holder's CREATE INDEX CONCURRENTLY, which waits for
+    every open transaction to finish.
+    """
+    if engine.dialect.name != "postgresql":
+        # SQLite's single writer serializes the transactional steps already
+        yield
+        return
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        while not conn.execute(text("SELECT pg_try_advisory_lock(:id)"), {"id": MIGRATION_LOCK_ID}).scalar():
+            time.sleep(MIGRATION_LOCK_POLL_SECONDS)
+        try:
+            yield
+        finally:
+            conn.execute(text("SELECT pg_advisory_unlock(:id)"), {"id": MIGRATION_LOCK_ID})
+
+def upgrade(engine: Engine, target: Optional[int] = None) -> int:
+    """
+    Applies pending migrations up to 'target' (default: head) and returns the new version.
+    An empty database is created straight from the models and stamped at head.
+    """
+    target = head_version() if target is None else target
+    with _runner_lock(engine):
+        with engine.begin() as conn:
+            version_metadata.create_all(conn)
+            tables = set(inspect(conn).get_table_names()) - {"schema_version"}
+            applied = conn.execute(select(func.max(schema_version.c.version))).scalar() or 0
+            if applied == 0 and not tables and target == head_version():
+                logger.info("Empty database, creating schema at version %d", target)
+                Base.metadata.create_all(conn)
+                for step in MIGRATIONS:
+                    _record(conn, step)
+                return target
+
+        for step in MIGRATIONS:
+            if step.version <= applied or step.version > target:
+                continue
+            logger.info("Applying migration %d: %s", step.version, step.name)
+            if step.online:
+                # Online steps must be idempotent: on SQLite two instances may run one concurrently
+                step.upgrade(engine)
+                with engine.begin() as conn:
+                    if not _is_applied(conn, step):
+                        _record(conn, step)
+            else:
+                with engine.begin() as conn:
+                    # Another instance may have applied it meanwhile (SQLite has no runner lock)
+                    if not _is_applied(conn, step):
+                        step.upgrade(conn)
+                        _record(conn, step)
+            applied = step.version
+        return applied
+
+def ensure_schema(engine: Engine):
+    """
+    Startup check: one query when the schema is current. Pending migrations are
+    applied when auto-migration is on (DB_AUTO_MIGRATE; by default only for SQLite,
+    i.e. local development), otherwise startup fails so a stale instance never
+    serves against a schema it does not understand.
+    """
+    applied = current_version(engine)
+    if applied == head_version():
+        return
+    auto_migrate = settings.DB_AUTO_MIGRATE
+    if auto_migrate is None:
+        auto_migrate = engine.dialect.name == "sqlite"
+    if not auto_migrate:
+        raise RuntimeError(
+            f"Database schema is at version {applied or 'unversioned'}, expected {head_version()}; "
+            "run 'python -m app.db.migrations upgrade'"
+        )
+    upgrade(engine)
+
+# ---------------------------------------------------------------------------
+# Migrations
+# ---------------------------------------------------------------------------
+
+# The schema as it was before versioning, frozen here: migration 1 must not
+# create tables from today's models (uuid keys, later tables), or they would
+# clash with the varchar keys migration 3 has yet to convert.
+baseline_metadata = MetaData()
+Table(
+    "users", baseline_metadata,
+    Column("id", String, primary_key=True),
+    Column("email", String, unique=True, index=True, nullable=False),
+    Column("auth_hash", String, nullable=False),
+    Column("auth_hash_prehashed", Boolean, nullable=True),
+    Column("kdf_salt", String, nullable=False),
+    Column("encrypted_dek", String, nullable=False),
+    Column("created_at", DateTime),
+    Column("vault_revision", Integer, nullable=False, server_default="0"),
+    Column("audit_revision", Integer, nullable=False, server_default="0"),
+)
+Table(
+    "vault_items", baseline_metadata,
+    Column("id", String, primary_key=True),
+    Column("user_id", String, ForeignKey("users.id"), nullable=False, index=True),
+    Column("type", String, nullable=False),
+    Column("enc_data", Text, nullable=False),
+    Column("iv", String, nullable=False),
+    Column("auth_tag", String, nullable=True),
+    Column("created_at", DateTime),
+    Column("last_modified", DateTime),
+    Column("version", Integer, nullable=False, server_default="1"),
+)
+Table(
+    "vault_item_tombstones", baseline_metadata,
+    Column("item_id", String, primary_key=True),
+    Column("user_id", String, ForeignKey("users.id"), nullable=False),
+    Column("deleted_at", DateTime, nullable=False),
+)
+Table(
+    "audit_logs", baseline_metadata,
+    Column("id", String, primary_key=True),
+    Column("user_id", String, ForeignKey("users.id"), nullable=False, index=True),
+    Column("event_type", String, nullable=False),
+    Column("severity", String),
+    Column("details", Text, nullable=True),
+    Column("ip_address", String, nullable=True),
+    Column("user_agent", String, nullable=True),
+    Column("timestamp", DateTime),
+)
+
+@migration(1, "baseline")
+def baseline(conn: Connection):
+    # Databases created by create_all() or the old migrate_db.py script: bring
+    # them up to the pre-versioning schema without touching existing data.
+    baseline_metadata.create_all(conn, checkfirst=True)
+    add_column(conn, "vault_items", "version INTEGER DEFAULT 1 NOT NULL")
+    # Left NULL for existing rows; they are verified (and upgraded) on next login
+    add_column(conn, "users", "auth_hash_prehashed BOOLEAN")
+    add_column(conn, "users", "vault_revision INTEGER DEFAULT 0 NOT NULL")
+    add_column(conn, "users", "audit_revision INTEGER DEFAULT 0 NOT NULL")
+
+@migration(2, "keyset pagination indexes", online=True)
+def keyset_indexes(engine: Engine):
+    create_index(engine, "ix_vault_items_user_id_last_modified_id", "vault_items", ["user_id", "last_modified", "id"])
+    create_index(engine, "ix_audit_logs_user_id_timestamp_id", "audit_logs", ["user_id", "timestamp", "id"])
+    create_index(engine, "ix_vault_item_tombstones_user_id_deleted_at", "vault_item_tombstones", ["user_id", "deleted_at", "item_id"])
+
+# Key columns that moved from uuid4 text to CompactUUID
+UUID_KEY_COLUMNS = {
+    "users": ["id"],
+    "vault_items": ["id", "user_id"],
+    "vault_item_tombstones": ["item_id", "user_id"],
+    "audit_logs": ["id", "user_id"],
+}
+
+def _uuid_bytes(value):
+    if value is None or isinstance(value, bytes):
+        return value
+    return uuid.UUID(value).bytes
+
+def _uuid_foreign_keys(conn: Connection):
+    """
+    Every foreign key touching a converted key column, wherever it is declared,
+    plus the referencing columns that must change type along with their target.
+    """
+    converted = {(table, name) for table, columns in UUID_KEY_COLUMNS.items() for name in columns}
+    inspector = inspect(conn)
+    foreign_keys, referencing = [], set()
+    for table in inspector.get_table_names():
+        for fk in inspector.get_foreign_keys(table):
+            pairs = list(zip(fk["constrained_columns"], fk["referred_columns"]))
+            targets = {(fk["referred_table"], referred) for _, referred in pairs}
+            sources = {(table, constrained) for constrained, _ in pairs}
+            if not (targets | sources) & converted:
+                continue
+            foreign_keys.append((table, fk))
+            referencing.update(
+                (table, constrained) for constrained, referred in pairs if (fk["referred_table"], referred) in converted
+            )
+    return foreign_keys, referencing
+
+@migration(3, "compact uuid keys")
+def compact_uuid_keys(conn: Connection):
+    # Existing ids keep their (uuid4) value, only the storage changes; new rows
+    # get time-ordered uuid7 keys from the models.
+    if conn.dialect.name == "postgresql":
+        inspector = inspect(conn)
+        foreign_keys, referencing = _uuid_foreign_keys(conn)
+        for table, fk in foreign_keys:
+            conn.execute(text(f'ALTER TABLE {table} DROP CONSTRAINT "{fk["name"]}"'))
+        columns_by_table: Dict[str, set] = {}
+        for table, name in referencing | {(t, c) for t, columns in UUID_KEY_COLUMNS.items() for c in columns}:
+            columns_by_table.setdefault(table, set()).add(name)
+        for table, columns in sorted(columns_by_table.items()):
+            for column in inspector.get_columns(table):
+                if column["name"] in columns and not isinstance(column["type"], postgresql.UUID):
+                    name = column["name"]
+                    conn.execute(text(f"ALTER TABLE {table} ALTER COLUMN {name} TYPE uuid USING {name}::uuid"))
+        for table, fk in foreign_keys:
+            conn.execute(text(
+                f'ALTER TABLE {table} ADD CONSTRAINT "{fk["name"]}" FOREIGN KEY ({", ".join(fk["constrained_columns"])}) '
+                f'REFERENCES {fk["referred_table"]} ({", ".join(fk["referred_columns"])})'
+            ))
+    else:
+        for table, columns in UUID_KEY_COLUMNS.items():
+            rebuild_sqlite_table(conn, table, {name: _uuid_bytes for name in columns})
+
+BLOB_COLUMNS = ("enc_data", "iv", "auth_tag")
+
+# Where migration 4 moves items whose stored text is not base64 (the pre-bytes API took
+# any string), so one bad row can't stop the upgrade. Kept verbatim, for an operator.
+quarantine_metadata = MetaData()
+vault_items_quarantine = Table(
+    "vault_items_quarantine", quarantine_metadata,
+    Column("id", String, primary_key=True),
+    Column("user_id", String, nullable=False),
+    Column("type", String),
+    Column("enc_data", Text),
+    Column("iv", Text),
+    Column("auth_tag", Text),
+    Column("created_at", DateTime),
+    Column("last_modified", DateTime),
+    Column("version", Integer),
+    Column("reason", Text, nullable=False),
+    Column("quarantined_at", DateTime, nullable=False),
+)
+
+def _blob_bytes(value):
+    if value is None or isinstance(value, bytes):
+        return value
+    # Whitespace is skipped like Postgres' decode(..., 'base64') does
+    return base64.b64decode("".join(value.split()), validate=True)
+
+def _key_text(value) -> str:
+    # Keys are uuid on Postgres and 16 raw bytes on SQLite by now
+    return str(uuid.UUID(bytes=value) if isinstance(value, bytes) else value)
+
+def quarantine_undecodable_blobs(conn: Connection, columns=BLOB_COLUMNS, where: str = "1 = 1") -> int:
+    """
+    Moves vault items whose text blobs don't decode as base64 to
+    vault_items_quarantine, logging each id. Returns the number moved.
+    """
+    result = conn.execute(text(
+        f"SELECT id, user_id, type, enc_data, iv, auth_tag, created_at, last_modified, version "
+        f"FROM vault_items WHERE {where}"
+    ).columns(created_at=DateTime, last_modified=DateTime))
+    bad = []
+    while True:
+        rows = result.fetchmany(settings.MIGRATION_BATCH_SIZE)
+        if not rows:
+            break
+        for row in rows:
+            values = row._mapping
+            failed = []
+            for name in columns:
+                try:
+                    _blob_bytes(values[name])
+                except ValueError:
+                    failed.append(name)
+            if failed:
+                bad.append((row, failed))
+    if not bad:
+        return 0
+    quarantine_metadata.create_all(conn, checkfirst=True)
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    for row, failed in bad:
+        values = dict(row._mapping, id=_key_text(row.id), user_id=_key_text(row.user_id))
+        conn.execute(vault_items_quarantine.insert().values(
+            **values, reason=f"not base64: {', '.join(failed)}", quarantined_at=now
+        ))
+        conn.execute(text("DELETE FROM vault_items WHERE id = :id"), {"id": row.id})
+        logger.warning("Moved vault item %s (user %s) to vault_items_quarantine: %s is not base64",
+                       _key_text(row.id), _key_text(row.user_id), ", ".join(failed))
+    return len(bad)
+
+@migration(4, "binary vault blobs", online=True)
+def binary_vault_blobs(engine: Engine):
+    if engine.dialect.name == "postgresql":
+        with engine.connect() as conn:
+            types = {column["name"]: column["type"] for column in inspect(conn).get_columns("vault_items")}
+        pending = [name for name in BLOB_COLUMNS if not isinstance(types[name], postgresql.BYTEA)]
+        if not pending:
+            return
+        # Decode into shadow columns in batches, then swap them in under a short lock.
+        # The final pass catches rows written by old instances during the backfill.
+        with engine.begin() as conn:
+            for name in pending:
+                conn.execute(text(f"ALTER TABLE vault_items ADD COLUMN IF NOT EXISTS {name}_bin bytea"))
+        assignments = ", ".join(f"{name}_bin = decode({name}, 'base64')" for name in pending)
+        stale = f"({pending[0]}_bin IS NULL AND {pending[0]} IS NOT NULL)"
+        unconverted = " OR ".join(f"({name}_bin IS NULL AND {name} IS NOT NULL)" for name in pending)
+        while True:
+            try:
+                backfill(engine, "vault_items", "id", assignments, stale)
+                break
+            except DBAPIError:
+                # A batch hit a value decode() rejects: set those rows aside, then resume
+                with engine.begin() as conn:
+                    if not quarantine_undecodable_blobs(conn, pending, unconverted):
+                        raise
+        with engine.begin() as conn:
+            conn.execute(text("LOCK TABLE vault_items IN EXCLUSIVE MODE"))
+            quarantine_undecodable_blobs(conn, pending, unconverted)
+            conn.execute(text(f"UPDATE vault_items SET {assignments} WHERE {unconverted}"))
+            for name in pending:
+                conn.execute(text(f"ALTER TABLE vault_items DROP COLUMN {name}"))
+                conn.execute(text(f"ALTER TABLE vault_items RENAME COLUMN {name}_bin TO {name}"))
+            for name in ("enc_data", "iv"):
+                if name in pending:
+                    conn.execute(text(f"ALTER TABLE vault_items ALTER COLUMN {name} SET NOT NULL"))
+    else:
+        # SQLite has a single writer anyway: rebuild the table, decoding as rows are copied
+        with engine.begin() as conn:
+            quarantine_undecodable_blobs(conn)
+            rebuild_sqlite_table(conn, "vault_items", {name: _blob_bytes for name in BLOB_COLUMNS})
+
+@migration(5, "vault re-encryption sessions")
+def reencryption_sessions(conn: Connection):
+    Base.metadata.create_all(conn, tables=[
+        Base.metadata.tables["vault_reencrypt_sessions"], Base.metadata.tables["vault_reencrypt_staged"]
+    ])
+
+@migration(6, "shard directory")
+def shard_directory(conn: Connection):
+    # Created on every database so shards share one schema; only the primary's copy is used
+    Base.metadata.create_all(conn, tables=[Base.metadata.tables["user_shards"]])
+
+@migration(7, "idempotency keys")
+def idempotency_keys(conn: Connection):
+    Base.metadata.create_all(conn, tables=[Base.metadata.tables["idempotency_keys"]])
+
+@migration(8, "audit filter indexes", online=True)
+def audit_filter_indexes(engine: Engine):
+    create_index(engine, "ix_audit_logs_user_id_event_type_timestamp_id", "audit_logs", ["user_id", "event_type", "timestamp", "id"])
+    create_index(engine, "ix_audit_logs_user_id_severity_timestamp_id", "audit_logs", ["user_id", "severity", "timestamp", "id"])
+
+@migration(9, "audit daily rollups")
+def audit_daily_rollups(conn: Connection):
+    # Seeded from the events still in audit_logs; from here on the writers keep it current
+    rollups = Base.metadata.tables["audit_daily_counts"]
+    logs = Base.metadata.tables["audit_logs"]
+    rollups.create(conn, checkfirst=True)
+    severity = func.coalesce(logs.c.severity, "INFO")
+    day = func.date(logs.c.timestamp)
+    conn.execute(rollups.insert().from_select(
+        ["user_id", "day", "event_type", "severity", "count"],
+        select(logs.c.user_id, day, logs.c.event_type, severity, func.count())
+        .group_by(logs.c.user_id, day, logs.c.event_type, severity)
+    ))
+
+@migration(10, "vault attachments")
+def vault_attachments(conn: Connection):
+    add_column(conn, "vault_items", "attachments TEXT")
+    Base.metadata.create_all(conn, tables=[Base.metadata.tables["attachments"]])
+
+@migration(11, "vault change sequence")
+def vault_change_sequence(conn: Connection):
+    # Existing rows sort before every later write (the next one gets revision >= 1),
+    # in id order among themselves
+    add_column(conn, "vault_items", "change_seq BIGINT DEFAULT 0 NOT NULL")
+    add_column(conn, "vault_item_tombstones", "change_seq BIGINT DEFAULT 0 NOT NULL")
+
+@migration(12, "vault change sequence indexes", online=True)
+def vault_change_sequence_indexes(engine: Engine):
+    create_index(engine, "ix_vault_items_user_id_change_seq_id", "vault_items", ["user_id", "change_seq", "id"])
+    create_index(
+        engine, "ix_vault_item_tombstones_user_id_change_seq_item_id", "vault_item_tombstones",
+        ["user_id", "change_seq", "item_id"]
+    )
+
+@migration(13, "idempotency applied revision")
+def idempotency_applied_revision(conn: Connection):
+    add_column(conn, "idempotency_keys", "applied_revision INTEGER")
+
+@migration(14, "idempotency expiry index", online=True)
+def idempotency_expiry_index(engine: Engine):
+    create_index(engine, "ix_idempotency_keys_expires_at", "idempotency_keys", ["expires_at"])
+
+# ---------------------------------------------------------------------------
+# Rehearsal
+# ---------------------------------------------------------------------------
+
+REHEARSAL_USER_ID = "6f1c2a9e-2b1d-4c55-9d1f-0a6a7f0e1a11"
+REHEARSAL_ITEM_ID = "0b7a6b1e-5f43-4a0e-8f5a-1c2d3e4f5a6b"
+
+def rehearse(engine: Engine) -> int:
+    """
+    Runs the whole chain on an empty scratch database the way production meets
+    it: the pre-versioning schema with a user, an item and an audit event, then
+    every migration. Fails unless the rows come out intact under their old ids.
+    """
+    if set(inspect(engine).get_table_names()):
+        raise RuntimeError("Rehearsal needs an empty database")
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    tables = baseline_metadata.tables
+    with engine.begin() as conn:
+        baseline_metadata.create_all(conn)
+        conn.execute(tables["users"].insert().values(
+            id=REHEARSAL_USER_ID, email="rehearsal@example.com", auth_hash="x", kdf_salt="s",
+            encrypted_dek="d", created_at=now
+        ))
+        conn.execute(tables["vault_items"].insert().values(
+            id=REHEARSAL_ITEM_ID, user_id=REHEARSAL_USER_ID, type="login", enc_data="ZW5j", iv="aXY=",
+            created_at=now, last_modified=now
+        ))
+        conn.execute(tables["audit_logs"].insert().values(
+            id=str(uuid.uuid4()), user_id=REHEARSAL_USER_ID, event_type="LOGIN", severity="INFO", timestamp=now
+        ))
+    version = upgrade(engine)
+
+    items = Base.metadata.tables["vault_items"]
+    with engine.connect() as conn:
+        row = conn.execute(select(items.c.user_id, items.c.enc_data).where(items.c.id == REHEARSAL_ITEM_ID)).first()
+        events = conn.execute(
+            select(func.count()).select_from(Base.metadata.tables["audit_logs"])
+            .where(Base.metadata.tables["audit_logs"].c.user_id == REHEARSAL_USER_ID)
+        ).scalar()
+    if row is None or row.user_id != REHEARSAL_USER_ID or row.enc_data != b"enc" or events != 1:
+        raise RuntimeError(f"Rehearsal rows did not survive the upgrade: {row!r}, {events} audit events")
+    return version
+
+if __name__ == "__main__":
+    from app.db.sharding import shard_router
+
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    parser = argparse.ArgumentParser(description="ValutX schema migrations")
+    parser.add_argument("command", choices=["upgrade", "current", "rehearse"])
+    parser.add_argument("--target", type=int, help="Stop at this version (default: latest)")
+    parser.add_argument("--url", help="Scratch database for 'rehearse' (must be empty)")
+    args = parser.parse_args()
+
+    if args.command == "rehearse":
+        from sqlalchemy import create_engine
+        if not args.url:
+            parser.error("rehearse needs --url")
+        scratch = create_engine(args.url)
+        print(f"{scratch.url!r}  baseline upgraded to version {rehearse(scratch)}, rows intact")
+        raise SystemExit(0)
+
+    # The primary plus every shard database
+    for engine in shard_router.engines():
+        if args.command == "current":
+            print(f"{engine.url!r}  current: {current_version(engine)}  head: {head_version()}")
+        else:
+            print(f"{engine.url!r}  schema at version {upgrade(engine, args.target)}")
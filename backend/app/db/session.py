@@ -1,22 +1,118 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker, declarative_base
 from app.core.config import settings
+from app.core.metrics import instrument_engine
 
-db_url = settings.DATABASE_URL
-# Fix for Render/PostgreSQL: SQLAlchemy requires 'postgresql://' but many services provide 'postgres://'
-if db_url and db_url.startswith("postgres://"):
-    db_url = db_url.replace("postgres://", "postgresql://", 1)
+def normalize_url(url: str) -> str:
+    # Fix for Render/PostgreSQL: SQLAlchemy requires 'postgresql://' but many services provide 'postgres://'
+    if url and url.startswith("postgres://"):
+        return url.replace("postgres://", "postgresql://", 1)
+    return url
 
-engine = create_engine(
-    db_url, connect_args={"check_same_thread": False} if "sqlite" in db_url else {}
-)
+db_url = normalize_url(settings.DATABASE_URL)
+read_db_url = normalize_url(settings.DATABASE_READ_URL)
+
+def engine_options(url: str) -> dict:
+    """
+    Engine profile for the database behind 'url': pool sizing for server databases,
+    thread sharing for SQLite (whose tuning happens per connection, see below).
+    """
+    if url.startswith("sqlite"):
+        return {"connect_args": {"check_same_thread": False}} if "aiosqlite" not in url else {}
+    return {
+        "pool_size": settings.DB_POOL_SIZE,
+        "max_overflow": settings.DB_MAX_OVERFLOW,
+        "pool_timeout": settings.DB_POOL_TIMEOUT,
+        "pool_recycle": settings.DB_POOL_RECYCLE,
+        "pool_pre_ping": settings.DB_POOL_PRE_PING,
+    }
+
+def apply_sqlite_pragmas(engine):
+    """
+    WAL lets readers run alongside the single writer; the rest trades a little
+    durability on power loss (synchronous=NORMAL) for far fewer fsyncs, and gives
+    each connection a bigger page cache and memory-mapped reads.
+    """
+    in_memory = engine.url.database in (None, "", ":memory:")
+
+    @event.listens_for(engine, "connect")
+    def _set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        if not in_memory:
+            cursor.execute(f"PRAGMA journal_mode={settings.SQLITE_JOURNAL_MODE}")
+            cursor.execute(f"PRAGMA mmap_size={settings.SQLITE_MMAP_SIZE}")
+        cursor.execute(f"PRAGMA synchronous={settings.SQLITE_SYNCHRONOUS}")
+        # Negative cache_size is in KiB rather than pages
+        cursor.execute(f"PRAGMA cache_size=-{settings.SQLITE_CACHE_SIZE_KB}")
+        cursor.execute(f"PRAGMA busy_timeout={settings.SQLITE_BUSY_TIMEOUT_MS}")
+        cursor.execute("PRAGMA temp_store=MEMORY")
+        cursor.close()
+
+def build_engine(url: str):
+    engine = create_engine(url, **engine_options(url))
+    if engine.dialect.name == "sqlite":
+        apply_sqlite_pragmas(engine)
+    instrument_engine(engine)
+    return engine
+
+engine = build_engine(db_url)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# Optional read replica for hot read paths; without one, reads use the primary
+read_engine = build_engine(read_db_url) if read_db_url else engine
+ReadSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=read_engine) if read_db_url else SessionLocal
+
 Base = declarative_base()
 
+def get_async_url(url: str) -> str:
+    """
+    Maps a sync database URL onto its async driver (aiosqlite / asyncpg).
+    """
+    if url.startswith("sqlite://"):
+        return url.replace("sqlite://", "sqlite+aiosqlite://", 1)
+    if url.startswith("postgresql://"):
+        return url.replace("postgresql://", "postgresql+asyncpg://", 1)
+    return url
+
+def build_async_engine(url: str):
+    async_url = get_async_url(url)
+    engine = create_async_engine(async_url, **engine_options(async_url))
+    if engine.dialect.name == "sqlite":
+        apply_sqlite_pragmas(engine.sync_engine)
+    instrument_engine(engine.sync_engine)
+    return engine
+
+# Async stack, only built when DB_ASYNC is on (the async drivers are optional otherwise)
+async_engine = None
+AsyncSessionLocal = None
+AsyncReadSessionLocal = None
+if settings.DB_ASYNC:
+    async_engine = build_async_engine(db_url)
+    # Objects stay readable after commit without an implicit (blocking) refresh
+    AsyncSessionLocal = async_sessionmaker(async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
+    AsyncReadSessionLocal = AsyncSessionLocal
+    if read_db_url:
+        AsyncReadSessionLocal = async_sessionmaker(
+            build_async_engine(read_db_url), class_=AsyncSession, autoflush=False, expire_on_commit=False
+        )
+
+def read_session_factory(use_async: bool = False):
+    """
+    The replica's sessionmaker, or the primary's when there is no replica. Callers
+    fall back to the primary when the replica lags the user (see utils/revision.py).
+    """
+    if read_db_url:
+        return AsyncReadSessionLocal if use_async else ReadSessionLocal
+    return AsyncSessionLocal if use_async else SessionLocal
+
 def get_db():
     db = SessionLocal()
     try:
         yield db
     finally:
         db.close()
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
@@ -0,0 +1,435 @@
+"""
+Horizontal sharding of user data by user_id.
+
+With DATABASE_SHARD_URLS set, each user's rows (the user row, vault items,
+tombstones, audit events, re-encryption sessions, idempotency keys, attachment
+records) live together on one shard, so every request still runs its queries
+and transaction against one database.
+A directory on the primary (DATABASE_URL) records where each user lives; new
+accounts are placed by consistent hashing of their id, and
+
+    python -m app.db.sharding rebalance
+
+moves users whose directory entry no longer matches the ring (e.g. after a shard
+was appended to DATABASE_SHARD_URLS) while the service keeps running. Existing
+single-database deployments enabling sharding first run `init` to fill the directory.
+
+Without DATABASE_SHARD_URLS everything stays on DATABASE_URL as before.
+"""
+import argparse
+import bisect
+import hashlib
+import logging
+import time
+from typing import Iterator, List, Optional, Tuple
+from sqlalchemy import delete, func, insert, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+from sqlalchemy.orm import Session, sessionmaker
+from app.core.cache import LRUTTLCache
+from app.core.config import settings
+from app.db import session as db_session
+from app.db.base import (
+    User, VaultItem, VaultItemTombstone, AuditLog, AuditDailyCount, ReencryptionSession, ReencryptionStagedItem,
+    UserShard, IdempotencyKey, Attachment
+)
+
+logger = logging.getLogger(__name__)
+
+class ShardMoving(Exception):
+    """
+    The user's rows are being moved to another shard; retry shortly.
+    """
+
+def _ring_hash(key: str) -> int:
+    return int.from_bytes(hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest(), "big")
+
+class HashRing:
+    """
+    Consistent hashing of user ids onto shard indexes. Each shard owns 'vnodes'
+    points named after its index, so appending a shard leaves every existing point
+    in place and only takes over about 1/N of the keyspace.
+    """
+
+    def __init__(self, shard_count: int, vnodes: int):
+        points = sorted(
+            (_ring_hash(f"shard-{index}#{vnode}"), index)
+            for index in range(shard_count) for vnode in range(vnodes)
+        )
+        self._hashes = [point for point, _ in points]
+        self._shards = [index for _, index in points]
+
+    def shard_for(self, key: str) -> int:
+        if len(set(self._shards)) <= 1:
+            return 0
+        position = bisect.bisect(self._hashes, _ring_hash(key)) % len(self._hashes)
+        return self._shards[position]
+
+class Shard:
+    def __init__(self, index: int, url: str):
+        self.index = index
+        self.url = url
+        self.async_engine = None
+        self.AsyncSessionLocal = None
+        if url == db_session.db_url:
+            # The primary doubles as a shard: share its pools
+            self.engine = db_session.engine
+            self.SessionLocal = db_session.SessionLocal
+            self.AsyncSessionLocal = db_session.AsyncSessionLocal
+            return
+        self.engine = db_session.build_engine(url)
+        self.SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=self.engine)
+        if settings.DB_ASYNC:
+            self.async_engine = db_session.build_async_engine(url)
+            self.AsyncSessionLocal = async_sessionmaker(
+                self.async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False
+            )
+
+def _user_tables(user_id: str) -> list:
+    # Every table holding a user's rows, parents first, with the predicate selecting them
+    sessions = select(ReencryptionSession.id).where(ReencryptionSession.user_id == user_id)
+    return [
+        (User.__table__, User.id == user_id),
+        (VaultItem.__table__, VaultItem.user_id == user_id),
+        (VaultItemTombstone.__table__, VaultItemTombstone.user_id == user_id),
+        (AuditLog.__table__, AuditLog.user_id == user_id),
+        (AuditDailyCount.__table__, AuditDailyCount.user_id == user_id),
+        (ReencryptionSession.__table__, ReencryptionSession.user_id == user_id),
+        (ReencryptionStagedItem.__table__, ReencryptionStagedItem.session_id.in_(sessions)),
+        (IdempotencyKey.__table__, IdempotencyKey.user_id == user_id),
+        (Attachment.__table__, Attachment.user_id == user_id),
+    ]
+
+class ShardRouter:
+    """
+    Maps a user to the sessionmaker of the database holding their rows.
+    Directory entries are cached per worker for SHARD_DIRECTORY_TTL seconds.
+    """
+
+    def __init__(self, urls: List[str]):
+        self.shards = [Shard(index, url) for index, url in enumerate(urls)]
+        self.ring = HashRing(len(self.shards), settings.SHARD_VIRTUAL_NODES)
+        self._directory = LRUTTLCache(settings.PRINCIPAL_CACHE_SIZE or 10000, settings.SHARD_DIRECTORY_TTL)
+
+    @property
+    def sharded(self) -> bool:
+        return bool(self.shards)
+
+    def engines(self) -> list:
+        """
+        The primary followed by every other shard engine (for migrations).
+        """
+        engines = [db_session.engine]
+        for shard in self.shards:
+            if shard.engine is not db_session.engine:
+                engines.append(shard.engine)
+        return engines
+
+    def session_factories(self) -> List[sessionmaker]:
+        if not self.sharded:
+            return [db_session.SessionLocal]
+        return [shard.SessionLocal for shard in self.shards]
+
+    def shard_sessionmaker(self, index: int) -> sessionmaker:
+        return self.shards[index].SessionLocal if self.sharded else db_session.SessionLocal
+
+    def lookup(self, user_id: str) -> Optional[Tuple[int, str]]:
+        """
+        (shard, state) from the directory, or None for a user it doesn't know.
+        """
+        entry = self._directory.get(user_id)
+        if entry is not None:
+            return entry
+        db = db_session.SessionLocal()
+        try:
+            row = db.execute(select(UserShard.shard, UserShard.state).where(UserShard.user_id == user_id)).first()
+        finally:
+            db.close()
+        if row is None:
+            return None
+        entry = (row.shard, row.state)
+        self._directory.set(user_id, entry)
+        return entry
+
+    def shard_index(self, user_id: str, allow_moving: bool = False) -> int:
+        if not self.sharded:
+            return 0
+        entry = self.lookup(user_id)
+        if entry is None:
+            # Unknown ids go where a new account would; no user row will be found there
+            return self.ring.shard_for(user_id)
+        shard, state = entry
+        if state == "moving" and not allow_moving:
+            raise ShardMoving(user_id)
+        return shard
+
+    def session_factory(self, user_id: str, use_async: bool = False, allow_moving: bool = False):
+        """
+        Sessionmaker for the user's shard. Raises ShardMoving while the user is being
+        rebalanced, unless 'allow_moving' (background writers that drain before the copy).
+        """
+        if not self.sharded:
+            return db_session.AsyncSessionLocal if use_async else db_session.SessionLocal
+        shard = self.shards[self.shard_index(user_id, allow_moving)]
+        return shard.AsyncSessionLocal if use_async else shard.SessionLocal
+
+    @property
+    def uses_replica(self) -> bool:
+        # Shards have no replicas of their own
+        return not self.sharded and bool(db_session.read_db_url)
+
+    def read_session_factory(self, user_id: str, use_async: bool = False):
+        if not self.sharded:
+            return db_session.read_session_factory(use_async)
+        # Shards have no replicas of their own: reads go to the user's shard
+        return self.session_factory(user_id, use_async)
+
+    def email_session_factory(self, email: str, read: bool = False) -> Optional[sessionmaker]:
+        """
+        Sessionmaker for the shard holding the account with this email (logins and
+        salt lookups, which come before there is a token). With sharding, None when
+        the directory has no such email: every account is entered there before its
+        user row is created, so no shard holds one that counts.
+        """
+        if not self.sharded:
+            return db_session.read_session_factory() if read else db_session.SessionLocal
+        db = db_session.SessionLocal()
+        try:
+            row = db.execute(select(UserShard.shard, UserShard.state).where(UserShard.email == email)).first()
+        finally:
+            db.close()
+        if row is None:
+            return None
+        if row.state == "moving":
+            raise ShardMoving(email)
+        return self.shards[row.shard].SessionLocal
+
+    def claim_user(self, db: Session, user_id: str, email: str) -> Optional[int]:
+        """
+        Reserves 'email' for a new account and returns the shard to create it on,
+        or None if the email is already registered. 'db' is a primary session.
+        """
+        if not self.sharded:
+            return None if db.query(User.id).filter(User.email == email).first() else 0
+        shard = self.ring.shard_for(user_id)
+        db.add(UserShard(user_id=user_id, email=email, shard=shard))
+        try:
+            db.commit()
+        except IntegrityError:
+            db.rollback()
+            return None
+        return shard
+
+    def release_user(self, db: Session, user_id: str):
+        """
+        Undoes claim_user() when creating the account itself failed.
+        """
+        if self.sharded:
+            db.execute(delete(UserShard).where(UserShard.user_id == user_id))
+            db.commit()
+            self._directory.delete(user_id)
+
+    async def dispose_async(self):
+        for shard in self.shards:
+            if shard.async_engine is not None:
+                await shard.async_engine.dispose()
+
+    # ------------------------------------------------------------------
+    # Rebalancing
+    # ------------------------------------------------------------------
+
+    def init_directory(self, batch_size: int = None) -> int:
+        """
+        Adds a directory entry for every user row found on a shard without one
+        (turning sharding on for an existing database). Returns the number added.
+        """
+        batch_size = batch_size or settings.SHARD_MOVE_BATCH_SIZE
+        added = 0
+        directory = db_session.SessionLocal()
+        try:
+            for shard in self.shards:
+                db = shard.SessionLocal()
+                try:
+                    result = db.execute(
+                        select(User.id, User.email).order_by(User.id).execution_options(yield_per=batch_size)
+                    )
+                    for partition in result.partitions():
+                        ids = [row.id for row in partition]
+                        known = set(directory.execute(
+                            select(UserShard.user_id).where(UserShard.user_id.in_(ids))
+                        ).scalars())
+                        rows = [
+                            {"user_id": row.id, "email": row.email, "shard": shard.index, "state": "active"}
+                            for row in partition if row.id not in known
+                        ]
+                        if rows:
+                            directory.execute(insert(UserShard), rows)
+                            directory.commit()
+                            added += len(rows)
+                finally:
+                    db.close()
+        finally:
+            directory.close()
+        return added
+
+    def misplaced(self, batch_size: int = None) -> Iterator[Tuple[str, int, int]]:
+        """
+        Yields (user_id, current shard, ring shard) for every user the ring places elsewhere.
+        """
+        batch_size = batch_size or settings.SHARD_MOVE_BATCH_SIZE
+        db = db_session.SessionLocal()
+        try:
+            after = None
+            while True:
+                stmt = select(UserShard.user_id, UserShard.shard).order_by(UserShard.user_id).limit(batch_size)
+                if after is not None:
+                    stmt = stmt.where(UserShard.user_id > after)
+                rows = db.execute(stmt).all()
+                if not rows:
+                    return
+                for row in rows:
+                    target = self.ring.shard_for(row.user_id)
+                    if target != row.shard:
+                        yield row.user_id, row.shard, target
+                after = rows[-1].user_id
+        finally:
+            db.close()
+
+    def move_user(self, user_id: str, target: int, drain: float = None) -> int:
+        """
+        Moves one user's rows to shard 'target' while everything else keeps serving.
+        Only this user pauses: their requests get ShardMoving (503) from the moment
+        the directory says 'moving' until the copy has committed on the target.
+        Returns the number of rows copied.
+        """
+        if drain is None:
+            # Long enough for every worker's cached entry to expire into 'moving', and
+            # for requests and audit flushes already routed to the source to finish
+            drain = settings.SHARD_DIRECTORY_TTL + settings.AUDIT_FLUSH_INTERVAL + 1.0
+        directory = db_session.SessionLocal()
+        try:
+            entry = directory.get(UserShard, user_id)
+            if entry is None:
+                raise ValueError(f"User {user_id} is not in the shard directory")
+            source = entry.shard
+            if source == target:
+                return 0
+            entry.state = "moving"
+            directory.commit()
+            self._directory.delete(user_id)
+            time.sleep(drain)
+
+            try:
+                copied = self._copy_user(user_id, self.shards[source], self.shards[target])
+            except Exception:
+                # Nothing switched over: the source is still authoritative
+                entry.state = "active"
+                directory.commit()
+                raise
+            entry.shard = target
+            entry.state = "active"
+            directory.commit()
+            self._directory.delete(user_id)
+        finally:
+            directory.close()
+
+        self._delete_user(user_id, self.shards[source])
+        return copied
+
+    def _copy_user(self, user_id: str, source: Shard, target: Shard) -> int:
+        tables = _user_tables(user_id)
+        copied = 0
+        src = source.SessionLocal()
+        dst = target.SessionLocal()
+        try:
+            # Leftovers of an earlier, interrupted move
+            for table, where in reversed(tables):
+                dst.execute(delete(table).where(where))
+            for table, where in tables:
+                result = src.execute(
+                    select(table).where(where).execution_options(yield_per=settings.SHARD_MOVE_BATCH_SIZE)
+                )
+                for partition in result.mappings().partitions():
+                    dst.execute(insert(table), [dict(row) for row in partition])
+                    copied += len(partition)
+            # One transaction on the target: the copy lands completely or not at all
+            dst.commit()
+        except Exception:
+            dst.rollback()
+            raise
+        finally:
+            src.close()
+            dst.close()
+        return copied
+
+    def _delete_user(self, user_id: str, shard: Shard):
+        db = shard.SessionLocal()
+        try:
+            for table, where in reversed(_user_tables(user_id)):
+                db.execute(delete(table).where(where))
+            db.commit()
+        finally:
+            db.close()
+
+    def status(self) -> List[Tuple[int, int]]:
+        """
+        (shard, users) per shard according to the directory.
+        """
+        db = db_session.SessionLocal()
+        try:
+            counts = dict(db.execute(select(UserShard.shard, func.count()).group_by(UserShard.shard)).all())
+        finally:
+            db.close()
+        return [(shard.index, counts.get(shard.index, 0)) for shard in self.shards]
+
+shard_urls = [
+    db_session.normalize_url(url.strip()) for url in settings.DATABASE_SHARD_URLS.split(",") if url.strip()
+]
+shard_router = ShardRouter(shard_urls)
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    parser = argparse.ArgumentParser(description="ValutX shard maintenance")
+    subcommands = parser.add_subparsers(dest="command", required=True)
+    subcommands.add_parser("status", help="Users per shard")
+    subcommands.add_parser("init", help="Fill the directory from the users already on each shard")
+    rebalance = subcommands.add_parser("rebalance", help="Move users the hash ring places on another shard")
+    rebalance.add_argument("--limit", type=int, help="Stop after this many users")
+    rebalance.add_argument("--dry-run", action="store_true", help="Only list the moves")
+    move = subcommands.add_parser("move", help="Move one user to a given shard")
+    move.add_argument("user_id")
+    move.add_argument("shard", type=int)
+    args = parser.parse_args()
+
+    if not shard_router.sharded:
+        parser.exit(1, "DATABASE_SHARD_URLS is not set\n")
+    if args.command in ("rebalance", "move"):
+        from app.db.migrations import ensure_schema
+
+        # A newly added shard gets its schema before anything is copied to it
+        for engine in shard_router.engines():
+            ensure_schema(engine)
+
+    if args.command == "status":
+        for index, users in shard_router.status():
+            print(f"shard {index}: {users} users")
+    elif args.command == "init":
+        print(f"Added {shard_router.init_directory()} directory entries")
+    elif args.command == "move":
+        if not 0 <= args.shard < len(shard_router.shards):
+            parser.exit(1, f"No shard {args.shard}\n")
+        print(f"Copied {shard_router.move_user(args.user_id, args.shard)} rows")
+    else:
+        # Collected first: moving rewrites the directory being paged through
+        moves = []
+        for move_args in shard_router.misplaced():
+            moves.append(move_args)
+            if args.limit and len(moves) >= args.limit:
+                break
+        for user_id, source, target in moves:
+            if args.dry_run:
+                print(f"{user_id}: shard {source} -> {target}")
+                continue
+            rows = shard_router.move_user(user_id, target)
+            logger.info("Moved %s from shard %d to %d (%d rows)", user_id, source, target, rows)
+        print(f"{len(moves)} users {'to move' if args.dry_run else 'moved'}")
@@ -0,0 +1,52 @@
+import os
+import time
+import uuid
+from sqlalchemy import LargeBinary
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.types import TypeDecorator
+
+def uuid7() -> uuid.UUID:
+    """
+    Time-ordered UUID (RFC 9562 version 7): 48-bit Unix milliseconds followed by
+    random bits, so new keys land at the right-hand edge of the B-tree.
+    """
+    value = (time.time_ns() // 1_000_000) << 80 | int.from_bytes(os.urandom(10), "big")
+    # Version 7 in bits 48-51, RFC 4122 variant in bits 64-65
+    value = (value & ~(0xF << 76)) | (0x7 << 76)
+    value = (value & ~(0x3 << 62)) | (0x2 << 62)
+    return uuid.UUID(int=value)
+
+def generate_uuid() -> str:
+    return str(uuid7())
+
+class CompactUUID(TypeDecorator):
+    """
+    UUID key stored in 16 bytes: native uuid on Postgres, a 16-byte blob elsewhere.
+    Python code keeps seeing the canonical string form, so models, tokens and API
+    responses are unchanged. A string that is not a UUID binds as NULL and simply
+    matches nothing (a malformed id in a URL is a 404, as it was with text keys).
+    """
+    impl = LargeBinary(16)
+    cache_ok = True
+
+    def load_dialect_impl(self, dialect):
+        if dialect.name == "postgresql":
+            return dialect.type_descriptor(postgresql.UUID(as_uuid=True))
+        return dialect.type_descriptor(LargeBinary(16))
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        if not isinstance(value, uuid.UUID):
+            try:
+                value = uuid.UUID(bytes=value) if isinstance(value, bytes) else uuid.UUID(str(value))
+            except ValueError:
+                return None
+        return value if dialect.name == "postgresql" else value.bytes
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        if isinstance(value, uuid.UUID):
+            return str(value)
+        return str(uuid.UUID(bytes=bytes(value)))
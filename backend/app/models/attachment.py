@@ -0,0 +1,24 @@
+from sqlalchemy import Column, String, DateTime, Integer, BigInteger, Index
+from app.db.session import Base
+from app.db.types import CompactUUID
+import datetime
+
+class Attachment(Base):
+    __tablename__ = "attachments"
+
+    # Encrypted files referenced from vault items. The ciphertext lives on disk under
+    # ATTACHMENT_DIR, addressed by its SHA-256; rows are per user, so identical
+    # uploads by one user are stored once but nothing is shared across users.
+    user_id = Column(CompactUUID, primary_key=True)
+    digest = Column(String(64), primary_key=True)  # Lowercase hex SHA-256 of the ciphertext
+    size = Column(BigInteger, nullable=False)
+
+    # Number of vault items referencing the file; at 0 it is an orphan and gets
+    # swept once untouched for ATTACHMENT_ORPHAN_GRACE_HOURS
+    refcount = Column(Integer, nullable=False, default=0)
+    created_at = Column(DateTime, default=datetime.datetime.utcnow, nullable=False)
+    touched_at = Column(DateTime, default=datetime.datetime.utcnow, nullable=False)  # Last upload or reference change
+
+    __table_args__ = (
+        Index("ix_attachments_refcount_touched_at", "refcount", "touched_at"),
+    )
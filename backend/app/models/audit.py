@@ -1,16 +1,13 @@
-from sqlalchemy import Column, String, DateTime, ForeignKey, Text
+from sqlalchemy import Column, String, Date, DateTime, ForeignKey, Integer, Text, Index
 from app.db.session import Base
-import uuid
+from app.db.types import CompactUUID, generate_uuid
 import datetime
 
-def generate_uuid():
-    return str(uuid.uuid4())
-
 class AuditLog(Base):
     __tablename__ = "audit_logs"
 
-    id = Column(String, primary_key=True, default=generate_uuid)
-    user_id = Column(String, ForeignKey("users.id"), nullable=False, index=True)
+    id = Column(CompactUUID, primary_key=True, default=generate_uuid)
+    user_id = Column(CompactUUID, ForeignKey("users.id"), nullable=False, index=True)
     
     event_type = Column(String, nullable=False) # 'LOGIN', 'LOGOUT', 'VAULT_PURGE', 'KEY_ROTATION', 'ITEM_ACCESS', 'EXPORT'
     severity = Column(String, default='INFO') # INFO, WARNING, CRITICAL
@@ -20,3 +17,23 @@ class AuditLog(Base):
     user_agent = Column(String, nullable=True)
     
     timestamp = Column(DateTime, default=datetime.datetime.utcnow)
+
+    __table_args__ = (
+        # Keyset pagination orders by (timestamp DESC, id DESC) within a user
+        Index("ix_audit_logs_user_id_timestamp_id", "user_id", "timestamp", "id"),
+        # Filtered listings (by type or severity) keep the same order
+        Index("ix_audit_logs_user_id_event_type_timestamp_id", "user_id", "event_type", "timestamp", "id"),
+        Index("ix_audit_logs_user_id_severity_timestamp_id", "user_id", "severity", "timestamp", "id"),
+    )
+
+class AuditDailyCount(Base):
+    __tablename__ = "audit_daily_counts"
+
+    # Rollup of audit_logs: events per user, UTC day, type and severity. Updated in the
+    # same transaction as the events themselves, so dashboards read a handful of rows
+    # instead of scanning history (and keep counting events after they are archived).
+    user_id = Column(CompactUUID, primary_key=True)
+    day = Column(Date, primary_key=True)
+    event_type = Column(String, primary_key=True)
+    severity = Column(String, primary_key=True)
+    count = Column(Integer, nullable=False, default=0)
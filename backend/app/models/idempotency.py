@@ -0,0 +1,29 @@
+from sqlalchemy import Column, String, DateTime, Integer, LargeBinary, Text, Index
+from app.db.session import Base
+from app.db.types import CompactUUID
+import datetime
+
+class IdempotencyKey(Base):
+    __tablename__ = "idempotency_keys"
+
+    # Responses of vault writes sent with an Idempotency-Key, replayed when the
+    # client retries. Scoped per user; expired rows are purged by the retention worker.
+    user_id = Column(CompactUUID, primary_key=True)
+    key = Column(String(255), primary_key=True)
+    # SHA-256 of method, path and body; a reused key with a different request is rejected
+    fingerprint = Column(LargeBinary(32), nullable=False)
+
+    # NULL while the original request is still running
+    status_code = Column(Integer, nullable=True)
+    headers = Column(Text, nullable=True)  # JSON object
+    body = Column(LargeBinary, nullable=True)
+    # Vault revision of the request's write, set in the write's own transaction: a
+    # claim whose worker died before storing the response must not run again
+    applied_revision = Column(Integer, nullable=True)
+
+    created_at = Column(DateTime, default=datetime.datetime.utcnow, nullable=False)
+    expires_at = Column(DateTime, nullable=False)
+
+    __table_args__ = (
+        Index("ix_idempotency_keys_expires_at", "expires_at"),
+    )
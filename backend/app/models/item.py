@@ -1,29 +1,54 @@
-from sqlalchemy import Column, String, DateTime, ForeignKey, Text, Integer
+from sqlalchemy import BigInteger, Column, String, DateTime, ForeignKey, Integer, Index, LargeBinary, Text
 from sqlalchemy.orm import relationship
 from app.db.session import Base
-import uuid
+from app.db.types import CompactUUID, generate_uuid
 import datetime
 
-def generate_uuid():
-    return str(uuid.uuid4())
-
 class VaultItem(Base):
     __tablename__ = "vault_items"
 
-    id = Column(String, primary_key=True, default=generate_uuid)
-    user_id = Column(String, ForeignKey("users.id"), nullable=False, index=True)
+    id = Column(CompactUUID, primary_key=True, default=generate_uuid)
+    user_id = Column(CompactUUID, ForeignKey("users.id"), nullable=False, index=True)
     
     # Metadata (Visible to Server)
     type = Column(String, nullable=False) # 'login', 'card', 'id', 'note'
     
     # Encrypted Data (Zero Knowledge)
-    enc_data = Column(Text, nullable=False) # The big encrypted JSON blob
-    iv = Column(String, nullable=False)     # Unique IV for this item
-    auth_tag = Column(String, nullable=True) # Optional, depends on GCM implementation details
+    # Raw bytes; base64 only exists on the JSON wire format
+    enc_data = Column(LargeBinary, nullable=False) # The big encrypted JSON blob
+    iv = Column(LargeBinary, nullable=False)     # Unique IV for this item
+    auth_tag = Column(LargeBinary, nullable=True) # Optional, depends on GCM implementation details
+    # Digests of encrypted attachments (JSON list); the files themselves live in the attachment store
+    attachments = Column(Text, nullable=True)
     
     created_at = Column(DateTime, default=datetime.datetime.utcnow)
     last_modified = Column(DateTime, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow)
     version = Column(Integer, default=1, nullable=False)
+    # User's vault_revision of the write that last changed the item. Writes hold the
+    # user's lock, so this follows commit order (timestamps are taken before commit)
+    change_seq = Column(BigInteger, default=0, server_default="0", nullable=False)
     
     # Relationships
     owner = relationship("User", backref="items")
+
+    __table_args__ = (
+        # Keyset pagination / delta sync order by (last_modified, id) within a user
+        Index("ix_vault_items_user_id_last_modified_id", "user_id", "last_modified", "id"),
+        # Delta sync orders by (change_seq, id)
+        Index("ix_vault_items_user_id_change_seq_id", "user_id", "change_seq", "id"),
+    )
+
+class VaultItemTombstone(Base):
+    __tablename__ = "vault_item_tombstones"
+
+    # Deletion log so incremental sync can tell clients which items to drop.
+    # Items are still hard-deleted; only the id and deletion time survive here.
+    item_id = Column(CompactUUID, primary_key=True)
+    user_id = Column(CompactUUID, ForeignKey("users.id"), nullable=False)
+    deleted_at = Column(DateTime, default=datetime.datetime.utcnow, nullable=False)
+    change_seq = Column(BigInteger, default=0, server_default="0", nullable=False)
+
+    __table_args__ = (
+        Index("ix_vault_item_tombstones_user_id_deleted_at", "user_id", "deleted_at", "item_id"),
+        Index("ix_vault_item_tombstones_user_id_change_seq_item_id", "user_id", "change_seq", "item_id"),
+    )
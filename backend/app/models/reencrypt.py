@@ -0,0 +1,29 @@
+from sqlalchemy import Column, String, DateTime, ForeignKey, Integer, LargeBinary
+from app.db.session import Base
+from app.db.types import CompactUUID, generate_uuid
+import datetime
+
+class ReencryptionSession(Base):
+    __tablename__ = "vault_reencrypt_sessions"
+
+    # Full-vault re-encryption (DEK rotation): items are staged here and swapped
+    # in with one transaction on commit, so a dropped client never leaves a
+    # vault half under the old key and half under the new one.
+    id = Column(CompactUUID, primary_key=True, default=generate_uuid)
+    user_id = Column(CompactUUID, ForeignKey("users.id"), nullable=False, index=True)
+    status = Column(String, nullable=False, default="open") # 'open', 'committed', 'aborted'
+
+    created_at = Column(DateTime, default=datetime.datetime.utcnow, nullable=False)
+    expires_at = Column(DateTime, nullable=False)
+
+class ReencryptionStagedItem(Base):
+    __tablename__ = "vault_reencrypt_staged"
+
+    session_id = Column(CompactUUID, ForeignKey("vault_reencrypt_sessions.id"), primary_key=True)
+    item_id = Column(CompactUUID, primary_key=True)
+    # Version of the item the client re-encrypted; commit refuses stale uploads
+    version = Column(Integer, nullable=False)
+
+    enc_data = Column(LargeBinary, nullable=False)
+    iv = Column(LargeBinary, nullable=False)
+    auth_tag = Column(LargeBinary, nullable=True)
@@ -0,0 +1,14 @@
+from sqlalchemy import Column, String, Integer
+from app.db.session import Base
+from app.db.types import CompactUUID
+
+class UserShard(Base):
+    __tablename__ = "user_shards"
+
+    # Shard directory, kept on the primary (DATABASE_URL) only: which shard holds
+    # each user's rows. Logins look users up here by email before they have a token.
+    user_id = Column(CompactUUID, primary_key=True)
+    email = Column(String, unique=True, index=True, nullable=False)
+    shard = Column(Integer, nullable=False)
+    # 'moving' while a rebalance copies the user; their requests get a 503 meanwhile
+    state = Column(String, nullable=False, default="active")
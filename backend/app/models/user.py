@@ -1,27 +1,29 @@
-from sqlalchemy import Column, String, DateTime
-from sqlalchemy.dialects.postgresql import UUID
+from sqlalchemy import Column, String, DateTime, Boolean, Integer
 from app.db.session import Base
-import uuid
+from app.db.types import CompactUUID, generate_uuid
 import datetime
 
-# Helper for SQLite UUID compatibility if needed, though usually String is easier for cross-compat in simple demos
-# But strictly following "Production-minded", we try to respect types. 
-# For SQLite, UUID acts as CHAR(32).
-
-def generate_uuid():
-    return str(uuid.uuid4())
+# Keys are time-ordered UUIDs (v7) kept in 16 bytes: native uuid on Postgres,
+# a blob on SQLite. The ORM still hands out the canonical string form.
 
 class User(Base):
     __tablename__ = "users"
 
-    id = Column(String, primary_key=True, default=generate_uuid)
+    id = Column(CompactUUID, primary_key=True, default=generate_uuid)
     email = Column(String, unique=True, index=True, nullable=False)
     
     # Authentication
     auth_hash = Column(String, nullable=False) # Hash of the Client's Auth Key
+    # True once auth_hash is known to use the SHA-256 pre-hash format; NULL for older
+    # accounts that may still hold a legacy direct-bcrypt hash (upgraded on next login).
+    auth_hash_prehashed = Column(Boolean, nullable=True, default=True)
     
     # Key Management (Zero Knowledge)
     kdf_salt = Column(String, nullable=False)        # Public salt for Client KDF
     encrypted_dek = Column(String, nullable=False)   # DEK wrapped by KEK
     
     created_at = Column(DateTime, default=datetime.datetime.utcnow)
+
+    # Change counters exposed as ETags; bumped on every vault/key change and audit write
+    vault_revision = Column(Integer, default=0, nullable=False)
+    audit_revision = Column(Integer, default=0, nullable=False)
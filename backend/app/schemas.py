@@ -1,8 +1,39 @@
-from pydantic import BaseModel, EmailStr, Field
-from typing import Optional
-from datetime import datetime
+import base64
+import binascii
+import json
+from pydantic import BaseModel, EmailStr, Field, BeforeValidator, WithJsonSchema
+from typing import Optional, List, Dict, Annotated
+from datetime import date, datetime
 from uuid import UUID
 
+def _decode_blob(value):
+    # JSON clients send base64 text; MessagePack clients send the raw bytes
+    if isinstance(value, str):
+        try:
+            return base64.b64decode(value, validate=True)
+        except binascii.Error:
+            raise ValueError("must be base64 encoded")
+    return value
+
+def _encode_blob(value):
+    return base64.b64encode(value).decode("ascii") if isinstance(value, bytes) else value
+
+def _decode_refs(value):
+    # vault_items.attachments holds a JSON list, NULL when the item has none
+    if value is None:
+        return []
+    return json.loads(value) if isinstance(value, str) else value
+
+# Ciphertext field: bytes on the server, base64 in JSON, 'bin' in MessagePack
+Blob = Annotated[bytes, BeforeValidator(_decode_blob), WithJsonSchema({"type": "string", "contentEncoding": "base64"})]
+# Same field on the way out, when a stored (bytes) row is validated into a response
+BlobText = Annotated[str, BeforeValidator(_encode_blob)]
+# Lowercase hex SHA-256 of an uploaded attachment's ciphertext
+AttachmentDigest = Annotated[str, Field(pattern="^[0-9a-f]{64}$")]
+MAX_ITEM_ATTACHMENTS = 100
+# Same list on the way out, from a stored row
+AttachmentRefs = Annotated[List[str], BeforeValidator(_decode_refs)]
+
 # --- User Schemas ---
 
 class UserCreate(BaseModel):
@@ -43,21 +74,24 @@ class VaultItemBase(BaseModel):
     # For this secure architecture, 'title' should be inside enc_data to avoid leaking habits.
     
 class VaultItemCreate(VaultItemBase):
-    enc_data: str = Field(..., description="Base64 encoded encrypted JSON blob")
-    iv: str = Field(..., description="Base64 encoded IV")
-    auth_tag: Optional[str] = None # Often appended to enc_data, but can be separate
+    enc_data: Blob = Field(..., description="Base64 encoded encrypted JSON blob")
+    iv: Blob = Field(..., description="Base64 encoded IV")
+    auth_tag: Optional[Blob] = None # Often appended to enc_data, but can be separate
+    attachments: List[AttachmentDigest] = Field(default_factory=list, max_length=MAX_ITEM_ATTACHMENTS, description="Digests of uploaded attachments")
 
 class VaultItemUpdate(BaseModel):
-    enc_data: Optional[str] = None
-    iv: Optional[str] = None
-    auth_tag: Optional[str] = None
+    enc_data: Optional[Blob] = None
+    iv: Optional[Blob] = None
+    auth_tag: Optional[Blob] = None
+    attachments: Optional[List[AttachmentDigest]] = Field(None, max_length=MAX_ITEM_ATTACHMENTS, description="Replaces the item's attachments when set")
     version: Optional[int] = None # For conflict detection
 
 class VaultItemResponse(VaultItemBase):
     id: UUID
     user_id: UUID
-    enc_data: str
-    iv: str
+    enc_data: BlobText = Field(..., description="Base64 encoded (raw bytes with Accept: application/msgpack)")
+    iv: BlobText
+    attachments: AttachmentRefs = Field(default_factory=list)
     version: int
     created_at: datetime
     last_modified: datetime
@@ -65,6 +99,87 @@ class VaultItemResponse(VaultItemBase):
     class Config:
         from_attributes = True
 
+class VaultItemMetaResponse(BaseModel):
+    id: UUID
+    type: str
+    version: int
+    last_modified: datetime
+
+    class Config:
+        from_attributes = True
+
+class VaultFetchRequest(BaseModel):
+    ids: List[str] = Field(..., min_length=1, max_length=1000)
+
+class VaultBatchOperation(BaseModel):
+    op: str = Field(..., pattern="^(create|update|delete)$")
+    id: Optional[str] = Field(None, description="Target item (update/delete)")
+    type: Optional[str] = Field(None, pattern="^(login|card|id|note)$", description="Item type (create)")
+    enc_data: Optional[Blob] = None
+    iv: Optional[Blob] = None
+    auth_tag: Optional[Blob] = None
+    attachments: Optional[List[AttachmentDigest]] = Field(None, max_length=MAX_ITEM_ATTACHMENTS, description="Attachment digests (create/update)")
+    version: Optional[int] = None # For conflict detection (update/delete)
+
+class VaultBatchRequest(BaseModel):
+    operations: List[VaultBatchOperation] = Field(..., min_length=1, max_length=5000)
+
+class VaultBatchResult(BaseModel):
+    index: int
+    op: str
+    status: str = Field(..., description="ok, conflict, not_found or invalid")
+    status_code: int
+    id: Optional[str] = None
+    version: Optional[int] = None
+    detail: Optional[str] = None
+
+class VaultBatchResponse(BaseModel):
+    applied: int
+    results: List[VaultBatchResult]
+
+class AttachmentResponse(BaseModel):
+    digest: str
+    size: int
+    created: bool = Field(..., description="False when the user had already stored this file")
+
+class VaultItemTombstoneResponse(BaseModel):
+    item_id: UUID
+    deleted_at: datetime
+
+    class Config:
+        from_attributes = True
+
+class StreamTokenResponse(BaseModel):
+    token: str
+    expires_in: int
+
+class VaultChangesResponse(BaseModel):
+    items: List[VaultItemResponse] = Field(default_factory=list, description="Items created or modified after the cursor")
+    deleted: List[VaultItemTombstoneResponse] = Field(default_factory=list, description="Items deleted after the cursor")
+    cursor: Optional[str] = Field(None, description="Opaque cursor to pass as 'since' on the next call")
+    has_more: bool = False
+
+class ReencryptStagedItem(BaseModel):
+    id: str
+    version: int = Field(..., description="Version of the item that was re-encrypted")
+    enc_data: Blob
+    iv: Blob
+    auth_tag: Optional[Blob] = None
+
+class ReencryptStageRequest(BaseModel):
+    items: List[ReencryptStagedItem] = Field(..., min_length=1, max_length=1000)
+
+class ReencryptCommitRequest(BaseModel):
+    encrypted_dek: str = Field(..., description="The new Data Encryption Key, wrapped by the KEK")
+
+class ReencryptSessionResponse(BaseModel):
+    id: str
+    status: str
+    expires_at: datetime
+    total: int = Field(..., description="Items currently in the vault")
+    staged: int = Field(..., description="Items uploaded for the current version")
+    missing: List[str] = Field(default_factory=list, description="Items still to upload (first page); empty when ready to commit")
+
 class AuditLogResponse(BaseModel):
     id: str
     event_type: str
@@ -75,3 +190,17 @@ class AuditLogResponse(BaseModel):
 
     class Config:
         from_attributes = True
+
+class AuditSummaryBucket(BaseModel):
+    day: date
+    event_type: str
+    severity: str
+    count: int
+
+class AuditSummaryResponse(BaseModel):
+    since: date
+    until: date
+    total: int
+    by_event_type: Dict[str, int]
+    by_severity: Dict[str, int]
+    daily: List[AuditSummaryBucket] = Field(..., description="Non-empty (day, type, severity) buckets, oldest first")
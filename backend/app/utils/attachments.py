@@ -0,0 +1,248 @@
+"""
+Encrypted attachment store.
+
+Clients encrypt a file, upload the ciphertext once under its SHA-256
+(PUT /vault/attachments/{digest}) and list the digest in a vault item's
+'attachments'. Files sit on local disk at
+
+    ATTACHMENT_DIR/<user_id>/<digest[:2]>/<digest>
+
+with one 'attachments' row per user and digest counting the items that
+reference it. Files no item has referenced for ATTACHMENT_ORPHAN_GRACE_HOURS
+are deleted, on that user's next upload or with
+
+    python -m app.utils.attachments sweep
+"""
+import datetime
+import hashlib
+import json
+import os
+import uuid
+from collections import Counter
+from typing import AsyncIterator, Callable, Dict, Iterable, List, Optional, Set, Tuple
+from fastapi import HTTPException
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import delete, insert, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from app.core.config import settings
+from app.db.sharding import shard_router
+from app.models.attachment import Attachment
+
+# Keeps IN (...) lists well under SQLite's bound-parameter limit
+REF_CHUNK_SIZE = 500
+SWEEP_BATCH_SIZE = 1000
+
+def _utcnow() -> datetime.datetime:
+    return datetime.datetime.utcnow()
+
+def attachment_path(user_id: str, digest: str) -> str:
+    user_id = str(user_id)
+    if not user_id or os.sep in user_id or user_id in (".", ".."):
+        raise ValueError("Invalid user id for attachment path")
+    return os.path.join(settings.ATTACHMENT_DIR, user_id, digest[:2], digest)
+
+def _tmp_dir() -> str:
+    # Inside ATTACHMENT_DIR so the final os.replace() never crosses filesystems
+    path = os.path.join(settings.ATTACHMENT_DIR, "tmp")
+    os.makedirs(path, exist_ok=True)
+    return path
+
+def _remove(path: str):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+def parse_refs(value: Optional[str]) -> List[str]:
+    return json.loads(value) if value else []
+
+def dump_refs(digests: Iterable[str]) -> Optional[str]:
+    # Stored in list order with duplicates dropped; no attachments stays NULL
+    digests = list(dict.fromkeys(digests))
+    return json.dumps(digests, separators=(",", ":")) if digests else None
+
+def known_digests(db: Session, user_id: str, digests: Iterable[str]) -> Set[str]:
+    digests = sorted(set(digests))
+    found = set()
+    for start in range(0, len(digests), REF_CHUNK_SIZE):
+        chunk = digests[start:start + REF_CHUNK_SIZE]
+        found.update(db.execute(
+            select(Attachment.digest).where(Attachment.user_id == user_id, Attachment.digest.in_(chunk))
+        ).scalars())
+    return found
+
+def change_refcounts(db: Session, user_id: str, added: Counter, removed: Counter):
+    """
+    Applies reference changes (digest -> number of items) inside the caller's
+    transaction. Raises a 400 if an added digest was never uploaded or already swept.
+    """
+    by_delta: Dict[int, List[str]] = {}
+    for digest in set(added) | set(removed):
+        delta = added[digest] - removed[digest]
+        if delta:
+            by_delta.setdefault(delta, []).append(digest)
+    now = _utcnow()
+    for delta, digests in sorted(by_delta.items()):
+        digests.sort()
+        for start in range(0, len(digests), REF_CHUNK_SIZE):
+            chunk = digests[start:start + REF_CHUNK_SIZE]
+            matched = db.execute(
+                update(Attachment)
+                .where(Attachment.user_id == user_id, Attachment.digest.in_(chunk))
+                .values(refcount=Attachment.refcount + delta, touched_at=now)
+                .execution_options(synchronize_session=False)
+            ).rowcount
+            if delta > 0 and matched != len(chunk):
+                raise HTTPException(status_code=400, detail="Unknown attachment; upload it first")
+
+def touch_existing(user_id: str, digest: str) -> Optional[int]:
+    """
+    Size of an attachment the user already stored (so the upload can be skipped),
+    or None. Touching it keeps a sweep from removing it before it gets referenced.
+    """
+    db = shard_router.session_factory(user_id)()
+    try:
+        row = db.get(Attachment, (user_id, digest))
+        if row is None or not os.path.exists(attachment_path(user_id, digest)):
+            return None
+        matched = db.execute(
+            update(Attachment)
+            .where(Attachment.user_id == user_id, Attachment.digest == digest)
+            .values(touched_at=_utcnow())
+        ).rowcount
+        db.commit()
+        return row.size if matched else None
+    finally:
+        db.close()
+
+def stored_size(user_id: str, digest: str) -> Optional[int]:
+    db = shard_router.session_factory(user_id)()
+    try:
+        return db.execute(
+            select(Attachment.size).where(Attachment.user_id == user_id, Attachment.digest == digest)
+        ).scalar()
+    finally:
+        db.close()
+
+async def receive_upload(chunks: AsyncIterator[bytes], max_bytes: int) -> Tuple[str, str, int]:
+    """
+    Streams a request body into a temp file, hashing as it goes.
+    Returns (temp path, hex SHA-256, size); memory use stays at one chunk.
+    """
+    tmp_path = os.path.join(await run_in_threadpool(_tmp_dir), uuid.uuid4().hex)
+    digest = hashlib.sha256()
+    size = 0
+    handle = await run_in_threadpool(open, tmp_path, "wb")
+    try:
+        async for chunk in chunks:
+            size += len(chunk)
+            if size > max_bytes:
+                raise HTTPException(status_code=413, detail="Attachment too large")
+            digest.update(chunk)
+            await run_in_threadpool(handle.write, chunk)
+        await run_in_threadpool(handle.flush)
+        await run_in_threadpool(os.fsync, handle.fileno())
+    except BaseException:
+        handle.close()
+        await run_in_threadpool(_remove, tmp_path)
+        raise
+    handle.close()
+    return tmp_path, digest.hexdigest(), size
+
+def store_upload(user_id: str, digest: str, size: int, tmp_path: str):
+    """
+    Records the attachment, then moves the verified temp file into place.
+    The row comes first: a sweep only deletes files whose row it removed.
+    """
+    db = shard_router.session_factory(user_id)()
+    try:
+        now = _utcnow()
+        try:
+            db.execute(insert(Attachment).values(
+                user_id=user_id, digest=digest, size=size, refcount=0, created_at=now, touched_at=now
+            ))
+            db.commit()
+        except IntegrityError:
+            # Concurrent upload of the same file, or a re-upload of a missing one
+            db.rollback()
+            db.execute(
+                update(Attachment)
+                .where(Attachment.user_id == user_id, Attachment.digest == digest)
+                .values(touched_at=now)
+            )
+            db.commit()
+        final_path = attachment_path(user_id, digest)
+        os.makedirs(os.path.dirname(final_path), exist_ok=True)
+        os.replace(tmp_path, final_path)
+    except BaseException:
+        _remove(tmp_path)
+        raise
+    finally:
+        db.close()
+
+def sweep_orphans(
+    session_factory: Callable[[], Session],
+    user_id: Optional[str] = None,
+    cutoff: Optional[datetime.datetime] = None
+) -> int:
+    """
+    Deletes attachments no item has referenced since 'cutoff' (default: now minus
+    ATTACHMENT_ORPHAN_GRACE_HOURS), for one user or everyone on the database.
+    Returns the number of files removed.
+    """
+    if cutoff is None:
+        cutoff = _utcnow() - datetime.timedelta(hours=settings.ATTACHMENT_ORPHAN_GRACE_HOURS)
+    orphaned = (Attachment.refcount <= 0, Attachment.touched_at < cutoff)
+    removed = 0
+    db = session_factory()
+    try:
+        while True:
+            stmt = select(Attachment.user_id, Attachment.digest).where(*orphaned)
+            if user_id is not None:
+                stmt = stmt.where(Attachment.user_id == user_id)
+            rows = db.execute(stmt.limit(SWEEP_BATCH_SIZE)).all()
+            if not rows:
+                break
+            gone = []
+            for row in rows:
+                # Re-checked in the DELETE: a reference or upload since the SELECT keeps the row
+                deleted = db.execute(delete(Attachment).where(
+                    Attachment.user_id == row.user_id, Attachment.digest == row.digest, *orphaned
+                )).rowcount
+                if deleted:
+                    gone.append(row)
+            db.commit()
+            for row in gone:
+                _sweep_file(db, row.user_id, row.digest)
+                removed += 1
+            if len(rows) < SWEEP_BATCH_SIZE:
+                break
+    finally:
+        db.close()
+    return removed
+
+def _sweep_file(db: Session, user_id: str, digest: str):
+    # The same file may have been uploaded again after the row was deleted: set it
+    # aside, and only unlink it if no row came back in the meantime
+    path = attachment_path(user_id, digest)
+    aside = os.path.join(_tmp_dir(), f"sweep-{uuid.uuid4().hex}")
+    try:
+        os.replace(path, aside)
+    except FileNotFoundError:
+        return
+    if db.get(Attachment, (user_id, digest), populate_existing=True) is not None and not os.path.exists(path):
+        os.replace(aside, path)
+    else:
+        _remove(aside)
+    db.rollback()
+
+if __name__ == "__main__":
+    # One-off run, e.g. from cron: python -m app.utils.attachments sweep
+    import argparse
+    import app.db.base  # noqa: F401 (registers all models)
+
+    parser = argparse.ArgumentParser(description="ValutX attachment store")
+    parser.add_argument("command", choices=["sweep"])
+    parser.parse_args()
+    print(f"Removed {sum(sweep_orphans(factory) for factory in shard_router.session_factories())} orphaned attachments")
@@ -0,0 +1,311 @@
+import datetime
+import gzip
+import json
+import logging
+import os
+import threading
+import uuid
+from contextlib import contextmanager
+from typing import Callable, Iterable, Iterator, List, Optional, Set, Tuple
+from sqlalchemy import delete, select, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+from app.api.idempotency import purge_expired_keys
+from app.core.config import settings
+from app.db.session import SessionLocal
+from app.db.sharding import shard_router
+from app.models.audit import AuditLog
+from app.utils.revision import bump_audit_revision
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - Windows: local runs are not serialized
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# pg_try_advisory_lock key for the single archiving run per database (migrations use 7318201)
+ARCHIVE_LOCK_ID = 7318202
+ARCHIVE_LOCK_FILE = ".archive.lock"
+
+# Segment files are named <first>_<last>_<nonce>.ndjson.gz; this timestamp format sorts chronologically
+SEGMENT_TIME_FORMAT = "%Y%m%dT%H%M%S%f"
+SEGMENT_SUFFIX = ".ndjson.gz"
+
+ARCHIVE_COLUMNS = (
+    AuditLog.id, AuditLog.user_id, AuditLog.event_type, AuditLog.severity,
+    AuditLog.details, AuditLog.ip_address, AuditLog.user_agent, AuditLog.timestamp
+)
+
+def _user_dir(archive_dir: str, user_id: str) -> str:
+    user_id = str(user_id)
+    if not user_id or os.sep in user_id or user_id in (".", ".."):
+        raise ValueError("Invalid user id for archive path")
+    return os.path.join(archive_dir, user_id)
+
+def _segment_range(name: str) -> Tuple[datetime.datetime, datetime.datetime]:
+    first, last, _ = name[:-len(SEGMENT_SUFFIX)].split("_")
+    return (
+        datetime.datetime.strptime(first, SEGMENT_TIME_FORMAT),
+        datetime.datetime.strptime(last, SEGMENT_TIME_FORMAT)
+    )
+
+def _read_segment(path: str) -> Iterator[dict]:
+    with gzip.open(path, "rt", encoding="utf-8") as segment:
+        for line in segment:
+            yield json.loads(line)
+
+def _write_segment(archive_dir: str, user_id: str, rows: List[dict]):
+    """
+    Writes one immutable, gzip-compressed NDJSON segment (rows in ascending time order).
+    The file only appears under its final name once fully written and fsynced.
+    """
+    directory = _user_dir(archive_dir, user_id)
+    os.makedirs(directory, exist_ok=True)
+    name = "{}_{}_{}{}".format(
+        rows[0]["timestamp"].strftime(SEGMENT_TIME_FORMAT),
+        rows[-1]["timestamp"].strftime(SEGMENT_TIME_FORMAT),
+        uuid.uuid4().hex[:8],
+        SEGMENT_SUFFIX
+    )
+    final_path = os.path.join(directory, name)
+    tmp_path = final_path + ".tmp"
+    with open(tmp_path, "wb") as raw:
+        with gzip.GzipFile(fileobj=raw, mode="wb") as gz:
+            for row in rows:
+                values = dict(row, timestamp=row["timestamp"].isoformat())
+                gz.write((json.dumps(values, separators=(",", ":")) + "\n").encode("utf-8"))
+        raw.flush()
+        os.fsync(raw.fileno())
+    os.replace(tmp_path, final_path)
+
+@contextmanager
+def _runner_lock(engine: Engine, archive_dir: str) -> Iterator[bool]:
+    """
+    Yields whether this process may archive now. One run at a time per database
+    (Postgres advisory lock) or per archive directory (file lock, for SQLite, which
+    has no row locks to keep two runs off the same rows).
+    """
+    if engine.dialect.name == "postgresql":
+        with engine.connect() as conn:
+            acquired = conn.execute(text("SELECT pg_try_advisory_lock(:id)"), {"id": ARCHIVE_LOCK_ID}).scalar()
+            conn.commit()
+            try:
+                yield bool(acquired)
+            finally:
+                if acquired:
+                    conn.execute(text("SELECT pg_advisory_unlock(:id)"), {"id": ARCHIVE_LOCK_ID})
+                    conn.commit()
+        return
+    if fcntl is None:
+        yield True
+        return
+    os.makedirs(archive_dir, exist_ok=True)
+    with open(os.path.join(archive_dir, ARCHIVE_LOCK_FILE), "a") as handle:
+        try:
+            fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(handle, fcntl.LOCK_UN)
+
+def archive_expired_logs(
+    session_factory: Callable[[], Session] = SessionLocal,
+    cutoff: Optional[datetime.datetime] = None,
+    batch_size: int = None,
+    archive_dir: str = None
+) -> int:
+    """
+    Moves audit rows older than the retention window out of the table into archive
+    segments, one batch at a time. Segments are written before the rows are deleted,
+    so a crash can at worst archive a batch twice, never lose it (compaction drops
+    the duplicate). Returns the number of rows archived; 0 if another run is active.
+    """
+    if cutoff is None:
+        cutoff = datetime.datetime.utcnow() - datetime.timedelta(days=settings.AUDIT_RETENTION_DAYS)
+    batch_size = batch_size or settings.AUDIT_ARCHIVE_BATCH_SIZE
+    archive_dir = archive_dir or settings.AUDIT_ARCHIVE_DIR
+
+    probe = session_factory()
+    try:
+        engine = probe.get_bind()
+    finally:
+        probe.close()
+
+    with _runner_lock(engine, archive_dir) as acquired:
+        if not acquired:
+            logger.info("Audit archiving already running elsewhere, skipping")
+            return 0
+        archived = 0
+        touched: Set[Tuple[str, datetime.date]] = set()
+        while True:
+            db = session_factory()
+            try:
+                stmt = (
+                    select(*ARCHIVE_COLUMNS)
+                    .where(AuditLog.timestamp < cutoff)
+                    .order_by(AuditLog.timestamp, AuditLog.id)
+                    .limit(batch_size)
+                )
+                rows = [dict(row) for row in db.execute(stmt).mappings()]
+                if not rows:
+                    db.rollback()
+                    break
+
+                # One segment per user and UTC day, so a day's segments can be merged later
+                by_user_day = {}
+                for row in rows:
+                    by_user_day.setdefault((row["user_id"], row["timestamp"].date()), []).append(row)
+                for (user_id, _), day_rows in by_user_day.items():
+                    _write_segment(archive_dir, user_id, day_rows)
+                touched.update(by_user_day)
+
+                ids = [row["id"] for row in rows]
+                for start in range(0, len(ids), 500):
+                    db.execute(delete(AuditLog).where(AuditLog.id.in_(ids[start:start + 500])))
+                # Hot listings changed, so their ETags must too
+                bump_audit_revision(db, {user_id for user_id, _ in by_user_day})
+                db.commit()
+                archived += len(rows)
+            except Exception:
+                db.rollback()
+                raise
+            finally:
+                db.close()
+
+        # Still under the lock: nobody else writes these directories meanwhile
+        compact_segments(archive_dir, touched)
+        return archived
+
+def compact_segments(archive_dir: str, user_days: Iterable[Tuple[str, datetime.date]]) -> int:
+    """
+    Merges each (user, day)'s segments into one, dropping rows archived twice, so
+    the segment count grows with days of history rather than with archiving runs.
+    The merged file is in place before the old ones go; a crash in between leaves
+    duplicates that the next compaction of that day removes.
+    Returns the number of segments removed.
+    """
+    removed = 0
+    by_user = {}
+    for user_id, day in user_days:
+        by_user.setdefault(user_id, set()).add(day)
+    for user_id, days in by_user.items():
+        directory = _user_dir(archive_dir, user_id)
+        if not os.path.isdir(directory):
+            continue
+        groups = {}
+        for name in os.listdir(directory):
+            if not name.endswith(SEGMENT_SUFFIX):
+                continue
+            first, last = _segment_range(name)
+            if first.date() == last.date() and first.date() in days:
+                groups.setdefault(first.date(), []).append(name)
+        for names in groups.values():
+            if len(names) < 2:
+                continue
+            rows = {}
+            for name in sorted(names):
+                for row in _read_segment(os.path.join(directory, name)):
+                    rows[row["id"]] = dict(row, timestamp=datetime.datetime.fromisoformat(row["timestamp"]))
+            _write_segment(archive_dir, user_id, sorted(rows.values(), key=lambda row: (row["timestamp"], row["id"])))
+            for name in names:
+                os.remove(os.path.join(directory, name))
+            removed += len(names)
+    return removed
+
+def iter_archived_logs(
+    user_id: str,
+    since: Optional[datetime.datetime] = None,
+    until: Optional[datetime.datetime] = None,
+    archive_dir: str = None
+) -> Iterator[dict]:
+    """
+    Streams a user's archived audit rows in ascending time order, optionally limited
+    to [since, until). Segments outside the range are skipped by file name alone.
+    """
+    # Stored timestamps are naive UTC
+    if since is not None and since.tzinfo is not None:
+        since = since.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    if until is not None and until.tzinfo is not None:
+        until = until.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+
+    directory = _user_dir(archive_dir or settings.AUDIT_ARCHIVE_DIR, user_id)
+    position, resumed = None, False
+    while True:
+        if not os.path.isdir(directory):
+            return
+        try:
+            for row, timestamp in _iter_segments(directory, since, until):
+                if resumed and (timestamp, row["id"]) <= position:
+                    continue
+                position = (timestamp, row["id"])
+                yield row
+            return
+        except FileNotFoundError:
+            # A compaction replaced segments while we read: list them again and
+            # carry on after the last row already returned
+            resumed = position is not None
+
+def _iter_segments(directory: str, since, until) -> Iterator[Tuple[dict, datetime.datetime]]:
+    for name in sorted(os.listdir(directory)):
+        if not name.endswith(SEGMENT_SUFFIX):
+            continue
+        first, last = _segment_range(name)
+        if (since and last < since) or (until and first >= until):
+            continue
+        for row in _read_segment(os.path.join(directory, name)):
+            timestamp = datetime.datetime.fromisoformat(row["timestamp"])
+            if (since and timestamp < since) or (until and timestamp >= until):
+                continue
+            yield row, timestamp
+
+class AuditRetentionWorker:
+    """
+    Runs archive_expired_logs periodically on a background thread, and sweeps
+    expired idempotency keys of every user on the same schedule.
+    """
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="audit-retention", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                count = sum(archive_expired_logs(factory) for factory in shard_router.session_factories())
+                if count:
+                    logger.info("Archived %d audit events", count)
+            except Exception:
+                logger.exception("Audit log archiving failed")
+            try:
+                count = sum(purge_expired_keys(factory) for factory in shard_router.session_factories())
+                if count:
+                    logger.info("Purged %d expired idempotency keys", count)
+            except Exception:
+                logger.exception("Idempotency key purge failed")
+            self._stop.wait(self.interval)
+
+retention_worker = AuditRetentionWorker(settings.AUDIT_ARCHIVE_INTERVAL)
+
+if __name__ == "__main__":
+    # One-off run, e.g. from cron: python -m app.utils.audit_archive
+    import app.db.base  # noqa: F401 (registers all models)
+    print(f"Archived {sum(archive_expired_logs(factory) for factory in shard_router.session_factories())} audit events")
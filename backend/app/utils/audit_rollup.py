@@ -0,0 +1,69 @@
+import datetime
+from collections import Counter
+from typing import Iterable, List, Optional
+from sqlalchemy import select
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+from app.models.audit import AuditDailyCount
+
+def _upsert_statement(dialect_name: str):
+    insert = postgresql.insert if dialect_name == "postgresql" else sqlite.insert
+    stmt = insert(AuditDailyCount)
+    return stmt.on_conflict_do_update(
+        index_elements=["user_id", "day", "event_type", "severity"],
+        set_={"count": AuditDailyCount.count + stmt.excluded.count}
+    )
+
+def add_to_rollups(db: Session, rows: Iterable[dict]):
+    """
+    Counts a batch of audit rows into audit_daily_counts, inside the caller's
+    transaction. One upsert per (user, day, type, severity) bucket, not per event.
+    """
+    buckets = Counter(
+        (row["user_id"], row["timestamp"].date(), row["event_type"], row.get("severity") or "INFO")
+        for row in rows
+    )
+    if not buckets:
+        return
+    # Sorted so concurrent writers take row locks in the same order
+    values = [
+        {"user_id": user_id, "day": day, "event_type": event_type, "severity": severity, "count": count}
+        for (user_id, day, event_type, severity), count in sorted(buckets.items())
+    ]
+    db.execute(_upsert_statement(db.get_bind().dialect.name), values)
+
+def summary_statement(
+    user_id: str,
+    since: datetime.date,
+    until: datetime.date,
+    event_types: Optional[List[str]] = None,
+    severities: Optional[List[str]] = None
+):
+    # Primary-key range scan: at most days x types x severities rows
+    stmt = (
+        select(AuditDailyCount.day, AuditDailyCount.event_type, AuditDailyCount.severity, AuditDailyCount.count)
+        .where(AuditDailyCount.user_id == user_id, AuditDailyCount.day >= since, AuditDailyCount.day <= until)
+        .order_by(AuditDailyCount.day, AuditDailyCount.event_type, AuditDailyCount.severity)
+    )
+    if event_types:
+        stmt = stmt.where(AuditDailyCount.event_type.in_(event_types))
+    if severities:
+        stmt = stmt.where(AuditDailyCount.severity.in_(severities))
+    return stmt
+
+def summarize(rows, since: datetime.date, until: datetime.date) -> dict:
+    daily = []
+    by_event_type: Counter = Counter()
+    by_severity: Counter = Counter()
+    for row in rows:
+        daily.append({"day": row.day, "event_type": row.event_type, "severity": row.severity, "count": row.count})
+        by_event_type[row.event_type] += row.count
+        by_severity[row.severity] += row.count
+    return {
+        "since": since,
+        "until": until,
+        "total": sum(by_event_type.values()),
+        "by_event_type": dict(by_event_type),
+        "by_severity": dict(by_severity),
+        "daily": daily,
+    }
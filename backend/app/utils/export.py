@@ -0,0 +1,113 @@
+import base64
+import datetime
+import json
+import zlib
+from typing import Iterable, Iterator, Optional
+from sqlalchemy import select
+from app.db.sharding import shard_router
+from app.models.item import VaultItem
+from app.models.user import User
+from app.utils.attachments import parse_refs
+
+EXPORT_FORMAT = "valutx-ndjson"
+EXPORT_VERSION = 1
+
+# Rows fetched per round trip from the server-side cursor
+EXPORT_YIELD_PER = 500
+# Bytes buffered before a chunk is handed to the response
+EXPORT_CHUNK_BYTES = 64 * 1024
+
+ITEM_COLUMNS = (
+    VaultItem.id, VaultItem.user_id, VaultItem.type, VaultItem.enc_data, VaultItem.iv,
+    VaultItem.auth_tag, VaultItem.attachments, VaultItem.version, VaultItem.created_at, VaultItem.last_modified
+)
+USER_COLUMNS = (
+    User.id, User.email, User.auth_hash, User.auth_hash_prehashed,
+    User.kdf_salt, User.encrypted_dek, User.created_at
+)
+# What a user's own export needs to decrypt its items (salt and wrapped key);
+# the login verifier stays in the admin backup only
+OWN_USER_COLUMNS = (User.id, User.email, User.kdf_salt, User.encrypted_dek, User.created_at)
+
+def _line(record: str, row: dict) -> str:
+    values = {"record": record}
+    for key, value in row.items():
+        if key == "attachments":
+            value = parse_refs(value)
+        elif isinstance(value, datetime.datetime):
+            value = value.isoformat()
+        elif isinstance(value, bytes):
+            value = base64.b64encode(value).decode("ascii")
+        values[key] = value
+    return json.dumps(values, separators=(",", ":")) + "\n"
+
+def _stream_rows(db, stmt) -> Iterator[dict]:
+    # yield_per turns on a server-side cursor where the driver supports one,
+    # so memory stays flat no matter how many rows match
+    for partition in db.execute(stmt.execution_options(yield_per=EXPORT_YIELD_PER)).mappings().partitions():
+        yield from partition
+
+def iter_export(user_id: Optional[str] = None) -> Iterator[bytes]:
+    """
+    Streams an NDJSON export: a header line, then one line per record.
+    With 'user_id' only that user's row (without auth_hash) and vault items are
+    exported; without it every user row and every vault item is (admin backup),
+    shard by shard.
+    """
+    if user_id is not None:
+        session_factories = [shard_router.session_factory(user_id)]
+    else:
+        session_factories = shard_router.session_factories()
+
+    header = {"format": EXPORT_FORMAT, "version": EXPORT_VERSION, "exported_at": datetime.datetime.utcnow()}
+    if user_id:
+        header["user_id"] = user_id
+    buffer = [_line("header", header)]
+    size = len(buffer[0])
+
+    def records():
+        # All user lines come before the first item line, as with a single database
+        if user_id is None:
+            users_stmt = select(*USER_COLUMNS).order_by(User.id)
+        else:
+            users_stmt = select(*OWN_USER_COLUMNS).where(User.id == user_id)
+        for session_factory in session_factories:
+            with session_factory() as db:
+                for row in _stream_rows(db, users_stmt):
+                    yield _line("user", row)
+        items_stmt = select(*ITEM_COLUMNS).order_by(VaultItem.user_id, VaultItem.id)
+        if user_id is not None:
+            items_stmt = items_stmt.where(VaultItem.user_id == user_id)
+        for session_factory in session_factories:
+            with session_factory() as db:
+                for row in _stream_rows(db, items_stmt):
+                    yield _line("item", row)
+
+    for line in records():
+        buffer.append(line)
+        size += len(line)
+        if size >= EXPORT_CHUNK_BYTES:
+            yield "".join(buffer).encode("utf-8")
+            buffer, size = [], 0
+    if buffer:
+        yield "".join(buffer).encode("utf-8")
+
+def gzip_stream(chunks: Iterable[bytes]) -> Iterator[bytes]:
+    """
+    Gzip-compresses a byte stream incrementally.
+    """
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+def accepts_gzip(accept_encoding: Optional[str]) -> bool:
+    if not accept_encoding:
+        return False
+    for part in accept_encoding.split(","):
+        coding, _, params = part.strip().partition(";")
+        if coding.strip().lower() == "gzip":
+            return params.replace(" ", "") != "q=0"
+    return False
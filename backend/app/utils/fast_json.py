@@ -0,0 +1,127 @@
+import base64
+import datetime
+import gzip
+import json
+from typing import Any, Iterable, Optional
+from fastapi import Request, Response
+from app.core.config import settings
+from app.utils.attachments import parse_refs
+from app.utils.wire import MSGPACK_MEDIA_TYPE, accepts_msgpack, packb
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - falls back to the stdlib encoder
+    orjson = None
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - brotli is optional
+    brotli = None
+
+def _default(value: Any):
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    # Ciphertext is stored as bytes; JSON clients get it base64 encoded
+    if isinstance(value, bytes):
+        return base64.b64encode(value).decode("ascii")
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+def dumps(payload: Any) -> bytes:
+    """
+    Encodes plain dicts/lists to JSON bytes, with orjson when it is installed.
+    Naive datetimes come out exactly as Pydantic would render them.
+    """
+    if orjson is not None:
+        return orjson.dumps(payload, default=_default)
+    return json.dumps(payload, default=_default, separators=(",", ":")).encode("utf-8")
+
+# Field order and names match VaultItemResponse
+VAULT_ITEM_FIELDS = ("type", "id", "user_id", "enc_data", "iv", "attachments", "version", "created_at", "last_modified")
+AUDIT_LOG_FIELDS = ("id", "event_type", "severity", "details", "ip_address", "timestamp")
+
+def vault_item_dict(item) -> dict:
+    """
+    Row/ORM object -> response dict without a Pydantic round trip.
+    Rows come from our own database, so re-validating them buys nothing.
+    """
+    return {
+        "type": item.type,
+        "id": str(item.id),
+        "user_id": str(item.user_id),
+        "enc_data": item.enc_data,
+        "iv": item.iv,
+        "attachments": parse_refs(item.attachments),
+        "version": item.version,
+        "created_at": item.created_at,
+        "last_modified": item.last_modified,
+    }
+
+def vault_item_meta_dict(item) -> dict:
+    return {
+        "id": str(item.id),
+        "type": item.type,
+        "version": item.version,
+        "last_modified": item.last_modified,
+    }
+
+def audit_log_dict(log) -> dict:
+    return {
+        "id": str(log.id),
+        "event_type": log.event_type,
+        "severity": log.severity,
+        "details": log.details,
+        "ip_address": log.ip_address,
+        "timestamp": log.timestamp,
+    }
+
+def _accepted_encodings(request: Request) -> set:
+    accepted = set()
+    for part in request.headers.get("accept-encoding", "").split(","):
+        coding, _, params = part.strip().partition(";")
+        if coding and params.replace(" ", "") != "q=0":
+            accepted.add(coding.strip().lower())
+    return accepted
+
+def json_response(request: Request, payload: Any, response: Optional[Response] = None, status_code: int = 200) -> Response:
+    """
+    Serializes 'payload' once and compresses it (brotli, then gzip) when the client
+    accepts it and the body is big enough to be worth it. Headers already set on
+    the endpoint's injected 'response' (ETag, cursors) are carried over.
+    """
+    return _encoded_response(request, dumps(payload), "application/json", response, status_code)
+
+def negotiated_response(request: Request, payload: Any, response: Optional[Response] = None, status_code: int = 200) -> Response:
+    """
+    Like json_response, but answers in MessagePack (blobs as raw bytes) when the
+    client asks for it in Accept.
+    """
+    if accepts_msgpack(request):
+        return _encoded_response(request, packb(payload), MSGPACK_MEDIA_TYPE, response, status_code, vary="Accept, Accept-Encoding")
+    return _encoded_response(request, dumps(payload), "application/json", response, status_code, vary="Accept, Accept-Encoding")
+
+def _encoded_response(
+    request: Request,
+    body: bytes,
+    media_type: str,
+    response: Optional[Response],
+    status_code: int,
+    vary: str = "Accept-Encoding"
+) -> Response:
+    headers = dict(response.headers) if response is not None else {}
+    headers.pop("content-length", None)
+    headers["Vary"] = vary
+
+    if len(body) >= settings.RESPONSE_COMPRESSION_MIN_BYTES:
+        accepted = _accepted_encodings(request)
+        if brotli is not None and "br" in accepted:
+            body = brotli.compress(body, quality=4)
+            headers["Content-Encoding"] = "br"
+        elif "gzip" in accepted:
+            body = gzip.compress(body, compresslevel=5)
+            headers["Content-Encoding"] = "gzip"
+
+    return Response(content=body, status_code=status_code, media_type=media_type, headers=headers)
+
+def vault_items_response(request: Request, items: Iterable, response: Optional[Response] = None, fields: str = "full") -> Response:
+    to_dict = vault_item_meta_dict if fields == "meta" else vault_item_dict
+    return negotiated_response(request, [to_dict(item) for item in items], response)
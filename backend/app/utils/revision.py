@@ -0,0 +1,110 @@
+from contextlib import contextmanager
+from typing import Iterable, Iterator, Optional
+from fastapi import Request, Response
+from sqlalchemy import event, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+from app.core.notifications import change_hub
+from app.db import session as db_session
+from app.models.user import User
+
+# Session.info key: {user_id: new vault revision} waiting for the transaction to commit
+PENDING_VAULT_REVISIONS = "pending_vault_revisions"
+
+def bump_vault_revision(db: Session, user_id: str) -> int:
+    """
+    Increments the user's vault revision inside the caller's transaction.
+    Call on every change to vault contents or keys, before the first write: the
+    UPDATE locks the user row, which serializes that user's vault writers.
+    Subscribers are notified of the new revision once the transaction commits.
+    """
+    revision = db.execute(
+        update(User).where(User.id == user_id).values(vault_revision=User.vault_revision + 1)
+        .returning(User.vault_revision)
+        .execution_options(synchronize_session=False)
+    ).scalar()
+    db.info.setdefault(PENDING_VAULT_REVISIONS, {})[user_id] = revision
+    return revision
+
+@contextmanager
+def vault_write(db: Session, user_id: str) -> Iterator[int]:
+    """
+    Bumps the revision up front, so the block runs holding the user's write lock,
+    and yields the new revision. An error inside rolls back right away: the lock
+    must not outlive the request's failure (on SQLite it blocks every writer).
+    """
+    revision = bump_vault_revision(db, user_id)
+    try:
+        yield revision
+    except BaseException:
+        db.rollback()
+        raise
+
+@event.listens_for(Session, "after_commit")
+def _publish_revisions(db: Session):
+    revisions = db.info.pop(PENDING_VAULT_REVISIONS, {})
+    for user_id, revision in revisions.items():
+        change_hub.publish(user_id, revision)
+
+@event.listens_for(Session, "after_rollback")
+def _drop_revisions(db: Session):
+    db.info.pop(PENDING_VAULT_REVISIONS, None)
+
+def bump_audit_revision(db: Session, user_ids: Iterable[str]):
+    user_ids = list(set(user_ids))
+    if not user_ids:
+        return
+    db.execute(
+        update(User).where(User.id.in_(user_ids)).values(audit_revision=User.audit_revision + 1)
+        .execution_options(synchronize_session=False)
+    )
+
+def vault_revision_statement(user_id: str):
+    # Primary-key lookup of a single integer; never touches the vault blobs
+    return select(User.vault_revision).where(User.id == user_id)
+
+def audit_revision_statement(user_id: str):
+    return select(User.audit_revision).where(User.id == user_id)
+
+def _revisions_statement(criterion):
+    return select(User.vault_revision, User.audit_revision).where(criterion)
+
+def replica_is_current(replica: Session, criterion) -> bool:
+    """
+    True if the replica holds the user matching 'criterion' at the primary's vault
+    and audit revisions. Every vault, key and audit write bumps one of them in its
+    own transaction, so a caught-up replica has all of that user's commits, made by
+    any worker. Costs one primary-key lookup on each side.
+    """
+    with db_session.SessionLocal() as primary:
+        expected = primary.execute(_revisions_statement(criterion)).first()
+    return replica.execute(_revisions_statement(criterion)).first() == expected
+
+async def replica_is_current_async(replica: AsyncSession, criterion) -> bool:
+    async with db_session.AsyncSessionLocal() as primary:
+        expected = (await primary.execute(_revisions_statement(criterion))).first()
+    return (await replica.execute(_revisions_statement(criterion))).first() == expected
+
+def make_etag(kind: str, revision: Optional[int]) -> str:
+    return f'W/"{kind}-{revision or 0}"'
+
+def etag_matches(request: Request, etag: str) -> bool:
+    """
+    True if the request's If-None-Match already names this ETag (weak comparison).
+    """
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    opaque = etag[2:] if etag.startswith("W/") else etag
+    for candidate in header.split(","):
+        candidate = candidate.strip()
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == opaque:
+            return True
+    return False
+
+def not_modified(etag: str) -> Response:
+    return Response(status_code=304, headers={"ETag": etag})
@@ -1,18 +1,238 @@
+import datetime
+import json
+import logging
+import queue
+import threading
+import time
+from typing import Callable, List, Optional
 from fastapi import Request
+from sqlalchemy import insert
 from sqlalchemy.orm import Session
-from app.models.audit import AuditLog
+from app.core import metrics
+from app.core.client_ip import client_ip
+from app.core.config import settings
+from app.db.sharding import shard_router
+from app.models.audit import AuditLog, generate_uuid
+from app.utils.audit_rollup import add_to_rollups
+from app.utils.revision import bump_audit_revision
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+class AuditLogWriter:
+    """
+    Buffers audit events in-process and bulk-inserts them from a background thread,
+    so request handlers don't pay for a second transaction per event.
+
+    Back-pressure: the queue is bounded. When it is full, log_event waits briefly for
+    room and then falls back to writing the event inline on the request's own session.
+    Security events are never dropped to relieve pressure.
+
+    Failures: a batch that fails to insert is retried with backoff, then written
+    row by row so one bad row can't take the rest down with it. A row that still
+    fails is logged in full at ERROR and counted in valutx_audit_events_dropped_total.
+
+    'session_factory' maps a user id to the sessionmaker of the database holding
+    that user's rows, so a batch is written as one transaction per shard.
+    """
+
+    def __init__(
+        self,
+        session_factory: Callable[[str], Callable[[], Session]],
+        batch_size: int,
+        flush_interval: float,
+        max_queue: int,
+        enqueue_timeout: float,
+        retries: int = 3,
+        retry_backoff: float = 0.5
+    ):
+        self.session_factory = session_factory
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.enqueue_timeout = enqueue_timeout
+        self.retries = retries
+        self.retry_backoff = retry_backoff
+        self._queue: "queue.Queue" = queue.Queue(maxsize=max_queue)
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def queue_depth(self) -> int:
+        return self._queue.qsize()
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        if self.running:
+            return
+        self._thread = threading.Thread(target=self._run, name="audit-log-writer", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """
+        Flushes everything still queued and stops the worker (called on shutdown).
+        """
+        if not self.running:
+            return
+        self._queue.put(_STOP)
+        self._thread.join()
+        self._thread = None
+
+    def submit(self, row: dict) -> bool:
+        """
+        Queues one audit row. Returns False if the writer is not running or stayed full.
+        """
+        if not self.running:
+            return False
+        try:
+            self._queue.put(row, timeout=self.enqueue_timeout)
+            return True
+        except queue.Full:
+            return False
+
+    def flush(self, timeout: float = None):
+        """
+        Blocks until every event queued before this call has been written.
+        """
+        if not self.running:
+            return
+        done = threading.Event()
+        self._queue.put(done)
+        done.wait(timeout)
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            batch: List[dict] = []
+            waiters: List[threading.Event] = []
+            stopping = False
+
+            # Collect until the batch is full or the flush interval since the first event elapses
+            deadline = time.monotonic() + self.flush_interval
+            while True:
+                if item is _STOP:
+                    stopping = True
+                elif isinstance(item, threading.Event):
+                    waiters.append(item)
+                else:
+                    batch.append(item)
+
+                if stopping or waiters or len(batch) >= self.batch_size:
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+
+            if stopping:
+                # Drain whatever is left behind the stop marker
+                while True:
+                    try:
+                        item = self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if isinstance(item, threading.Event):
+                        waiters.append(item)
+                    elif item is not _STOP:
+                        batch.append(item)
+
+            for start in range(0, len(batch), self.batch_size):
+                self._write(batch[start:start + self.batch_size])
+            for waiter in waiters:
+                waiter.set()
+            if stopping:
+                return
+
+    def _write(self, rows: List[dict]):
+        by_factory = {}
+        for row in rows:
+            by_factory.setdefault(self.session_factory(row["user_id"]), []).append(row)
+        for session_factory, shard_rows in by_factory.items():
+            delay = self.retry_backoff
+            for attempt in range(self.retries + 1):
+                try:
+                    self._insert(session_factory, shard_rows)
+                    break
+                except Exception:
+                    logger.warning("Failed to write %d audit events (attempt %d)", len(shard_rows), attempt + 1, exc_info=True)
+                if attempt < self.retries:
+                    metrics.audit_write_retries.inc()
+                    time.sleep(delay)
+                    delay *= 2
+            else:
+                # Isolate the row(s) at fault; the rest still get written
+                for row in shard_rows:
+                    self._write_row(session_factory, row)
+
+    def _insert(self, session_factory: Callable[[], Session], rows: List[dict]):
+        db = session_factory()
+        try:
+            # One multi-row INSERT per database, rollups in the same transaction
+            db.execute(insert(AuditLog), rows)
+            add_to_rollups(db, rows)
+            bump_audit_revision(db, [row["user_id"] for row in rows])
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    def _write_row(self, session_factory: Callable[[], Session], row: dict):
+        try:
+            self._insert(session_factory, [row])
+            return
+        except Exception:
+            logger.debug("Single audit event insert failed", exc_info=True)
+        # A retry may have failed only on its reply, after the batch committed
+        db = session_factory()
+        try:
+            if db.get(AuditLog, row["id"]) is not None:
+                return
+        except Exception:
+            pass
+        finally:
+            db.close()
+        metrics.audit_events_dropped.inc()
+        logger.error("Dropped audit event: %s", json.dumps(row, default=str))
+
+audit_writer = AuditLogWriter(
+    # Rebalancing waits for queued events to flush before copying a user, so a
+    # user mid-move still goes to their old shard here
+    lambda user_id: shard_router.session_factory(user_id, allow_moving=True),
+    batch_size=settings.AUDIT_BATCH_SIZE,
+    flush_interval=settings.AUDIT_FLUSH_INTERVAL,
+    max_queue=settings.AUDIT_QUEUE_SIZE,
+    enqueue_timeout=settings.AUDIT_ENQUEUE_TIMEOUT,
+    retries=settings.AUDIT_WRITE_RETRIES,
+    retry_backoff=settings.AUDIT_RETRY_BACKOFF
+)
 
 def log_event(db: Session, user_id: str, event_type: str, severity: str = "INFO", details: str = None, request: Request = None):
-    ip = request.client.host if request else "Unknown"
+    ip = client_ip(request) if request else "Unknown"
     ua = request.headers.get("user-agent") if request else "Unknown"
     
-    log = AuditLog(
-        user_id=user_id,
-        event_type=event_type,
-        severity=severity,
-        details=details,
-        ip_address=ip,
-        user_agent=ua
-    )
-    db.add(log)
+    row = {
+        "id": generate_uuid(),
+        "user_id": user_id,
+        "event_type": event_type,
+        "severity": severity,
+        "details": details,
+        "ip_address": ip,
+        "user_agent": ua,
+        # Stamp at event time, not when the batch happens to be flushed
+        "timestamp": datetime.datetime.utcnow()
+    }
+    if settings.AUDIT_BUFFERED and audit_writer.submit(row):
+        return
+
+    # Writer not running (scripts, tests) or saturated: write inline as before
+    db.add(AuditLog(**row))
+    add_to_rollups(db, [row])
+    bump_audit_revision(db, [user_id])
     db.commit()
@@ -0,0 +1,86 @@
+import datetime
+from typing import Any, Callable
+from fastapi import Request
+from fastapi.routing import APIRoute
+from starlette.datastructures import Headers
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover - MessagePack is optional, JSON always works
+    msgpack = None
+
+MSGPACK_MEDIA_TYPE = "application/msgpack"
+MSGPACK_MEDIA_TYPES = {"application/msgpack", "application/x-msgpack", "application/vnd.msgpack"}
+
+def _media_type(value: str) -> str:
+    return value.split(";", 1)[0].strip().lower()
+
+def is_msgpack(content_type) -> bool:
+    return msgpack is not None and bool(content_type) and _media_type(content_type) in MSGPACK_MEDIA_TYPES
+
+def accepts_msgpack(request: Request) -> bool:
+    """
+    True when the client explicitly lists a MessagePack media type in Accept.
+    """
+    if msgpack is None:
+        return False
+    for part in request.headers.get("accept", "").split(","):
+        media_type, _, params = part.partition(";")
+        if _media_type(media_type) in MSGPACK_MEDIA_TYPES and params.replace(" ", "") != "q=0":
+            return True
+    return False
+
+def _msgpack_default(value: Any):
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not MessagePack serializable")
+
+def packb(payload: Any) -> bytes:
+    """
+    MessagePack encoding of a response payload. Blobs go out as raw 'bin'
+    values; everything else (ids, ISO timestamps) matches the JSON form.
+    """
+    return msgpack.packb(payload, default=_msgpack_default, use_bin_type=True)
+
+class MsgpackRequest(Request):
+    """
+    Request carrying a MessagePack body. FastAPI only parses JSON-typed bodies,
+    so the content type is presented as JSON and json() decodes MessagePack.
+    """
+
+    @property
+    def headers(self) -> Headers:
+        if not hasattr(self, "_msgpack_headers"):
+            raw = [
+                (key, b"application/json" if key == b"content-type" else value)
+                for key, value in self.scope["headers"]
+            ]
+            self._msgpack_headers = Headers(raw=raw)
+        return self._msgpack_headers
+
+    async def json(self) -> Any:
+        if not hasattr(self, "_json"):
+            self._json = msgpack.unpackb(await self.body(), raw=False)
+        return self._json
+
+class NegotiatedRoute(APIRoute):
+    """
+    Route class accepting JSON or MessagePack request bodies; the same Pydantic
+    schemas validate both.
+    """
+
+    def get_route_handler(self) -> Callable:
+        handler = self.wrap_handler(super().get_route_handler())
+
+        async def negotiated_handler(request: Request):
+            if is_msgpack(request.headers.get("content-type")):
+                request = MsgpackRequest(request.scope, request.receive)
+            return await handler(request)
+
+        return negotiated_handler
+
+    def wrap_handler(self, handler: Callable) -> Callable:
+        """
+        Hook for subclasses: wraps the handler that receives the decoded request.
+        """
+        return handler
@@ -0,0 +1,208 @@
+"""
+In-process load benchmark for the API hot paths.
+
+Drives the FastAPI app from main.py through httpx's ASGI transport against a
+throwaway SQLite database, then reports throughput and p50/p95/p99 latency per
+route. Results can be saved as a JSON baseline and later runs compared against
+it; a route whose p95 got slower than the tolerance fails the run.
+
+Run from backend/:
+    python -m benchmarks.load
+    python -m benchmarks.load --vault-sizes 10,1000,50000 --save-baseline benchmarks/baselines/local.json
+    python -m benchmarks.load --compare benchmarks/baselines/local.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from typing import Dict, List
+
+# Point the app at a throwaway database (and keep the limiter out of the way) before main.py is imported
+if "DATABASE_URL" not in os.environ:
+    os.environ["DATABASE_URL"] = f"sqlite:///{tempfile.mkdtemp(prefix='valutx-bench-')}/bench.db"
+os.environ.setdefault("RATE_LIMIT_ENABLED", "false")
+
+def percentile(samples: List[float], pct: float) -> float:
+    ordered = sorted(samples)
+    if not ordered:
+        return 0.0
+    index = max(0, min(len(ordered) - 1, int(round(pct / 100.0 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+class Recorder:
+    """
+    Collects per-route latencies and wall time.
+    """
+
+    def __init__(self):
+        self.samples: Dict[str, List[float]] = defaultdict(list)
+        self.wall: Dict[str, float] = defaultdict(float)
+        self.errors: Dict[str, int] = defaultdict(int)
+
+    async def call(self, name: str, coro, expect=(200,)):
+        start = time.perf_counter()
+        response = await coro
+        self.samples[name].append(time.perf_counter() - start)
+        if response.status_code not in expect:
+            self.errors[name] += 1
+        return response
+
+    def report(self) -> Dict[str, dict]:
+        results = {}
+        for name, samples in self.samples.items():
+            wall = self.wall.get(name) or sum(samples)
+            results[name] = {
+                "requests": len(samples),
+                "errors": self.errors.get(name, 0),
+                "throughput_rps": round(len(samples) / wall, 2) if wall else 0.0,
+                "p50_ms": round(percentile(samples, 50) * 1000, 3),
+                "p95_ms": round(percentile(samples, 95) * 1000, 3),
+                "p99_ms": round(percentile(samples, 99) * 1000, 3),
+            }
+        return results
+
+def item_payload(blob_bytes: int) -> dict:
+    return {
+        "type": random.choice(["login", "card", "id", "note"]),
+        "enc_data": "A" * (4 * ((blob_bytes + 2) // 3)),
+        "iv": "AAAAAAAAAAAAAAAA",
+    }
+
+async def signup_and_login(client, rec: Recorder, email: str) -> dict:
+    await rec.call("POST /auth/signup", client.post("/api/v1/auth/signup", json={
+        "email": email, "auth_hash_derived": "bench", "kdf_salt": "salt", "encrypted_dek": "dek"
+    }))
+    await rec.call("GET /auth/salt/{email}", client.get(f"/api/v1/auth/salt/{email}"))
+    response = await rec.call("POST /auth/login", client.post("/api/v1/auth/login", json={
+        "email": email, "auth_hash_derived": "bench"
+    }))
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+async def seed_vault(client, headers: dict, size: int, blob_bytes: int):
+    remaining = size
+    while remaining:
+        count = min(remaining, 5000)
+        operations = [{"op": "create", **item_payload(blob_bytes)} for _ in range(count)]
+        response = await client.post("/api/v1/vault/batch", json={"operations": operations}, headers=headers)
+        response.raise_for_status()
+        remaining -= count
+
+async def run(args) -> Dict[str, dict]:
+    from httpx import ASGITransport, AsyncClient
+    from main import app
+
+    rec = Recorder()
+    transport = ASGITransport(app=app)
+    async with app.router.lifespan_context(app):
+        async with AsyncClient(transport=transport, base_url="http://bench") as client:
+            # Auth paths (bcrypt-bound, so fewer iterations)
+            users = []
+            for n in range(args.auth_requests):
+                users.append(await signup_and_login(client, rec, f"bench{n}@example.com"))
+            headers = users[0]
+
+            # Vault CRUD
+            item_ids = []
+            for _ in range(args.requests):
+                response = await rec.call("POST /vault/", client.post("/api/v1/vault/", json=item_payload(args.blob_bytes), headers=headers))
+                item_ids.append(response.json()["id"])
+            for item_id in item_ids:
+                await rec.call("PUT /vault/{id}", client.put(f"/api/v1/vault/{item_id}", json={"enc_data": "QUJD"}, headers=headers))
+            for item_id in item_ids:
+                await rec.call("DELETE /vault/{id}", client.delete(f"/api/v1/vault/{item_id}", headers=headers))
+
+            # Listing at each vault size, each on a fresh account
+            for index, size in enumerate(args.vault_sizes):
+                list_headers = await signup_and_login(client, rec, f"list{index}@example.com")
+                await seed_vault(client, list_headers, size, args.blob_bytes)
+                for _ in range(args.requests):
+                    await rec.call(f"GET /vault/ (n={size})", client.get("/api/v1/vault/", params={"limit": 1000}, headers=list_headers))
+                    await rec.call(f"GET /vault/?fields=meta (n={size})", client.get("/api/v1/vault/", params={"limit": 1000, "fields": "meta"}, headers=list_headers))
+
+            # Audit listing (every call above produced events)
+            for _ in range(args.requests):
+                await rec.call("GET /audit/", client.get("/api/v1/audit/", headers=headers))
+
+            # Concurrent mixed workload
+            await seed_vault(client, headers, 200, args.blob_bytes)
+            ids = [row["id"] for row in (await client.get("/api/v1/vault/", params={"limit": 200}, headers=headers)).json()]
+
+            async def worker(ops: int):
+                for _ in range(ops):
+                    roll = random.random()
+                    if roll < 0.6:
+                        await rec.call("mixed GET /vault/", client.get("/api/v1/vault/", params={"limit": 100}, headers=headers))
+                    elif roll < 0.8:
+                        await rec.call("mixed POST /vault/", client.post("/api/v1/vault/", json=item_payload(args.blob_bytes), headers=headers))
+                    elif roll < 0.9:
+                        await rec.call("mixed PUT /vault/{id}", client.put(f"/api/v1/vault/{random.choice(ids)}", json={"enc_data": "QUJD"}, headers=headers))
+                    else:
+                        await rec.call("mixed GET /audit/", client.get("/api/v1/audit/", headers=headers))
+
+            start = time.perf_counter()
+            per_worker = max(1, args.mixed_requests // args.concurrency)
+            await asyncio.gather(*(worker(per_worker) for _ in range(args.concurrency)))
+            elapsed = time.perf_counter() - start
+            for name in rec.samples:
+                if name.startswith("mixed "):
+                    rec.wall[name] = elapsed
+    return rec.report()
+
+def print_report(results: Dict[str, dict]):
+    print(f"{'route':<42} {'reqs':>6} {'err':>4} {'rps':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for name, stats in results.items():
+        print(f"{name:<42} {stats['requests']:>6} {stats['errors']:>4} {stats['throughput_rps']:>9} "
+              f"{stats['p50_ms']:>9} {stats['p95_ms']:>9} {stats['p99_ms']:>9}")
+
+def compare(results: Dict[str, dict], baseline: Dict[str, dict], tolerance: float) -> List[str]:
+    regressions = []
+    for name, stats in results.items():
+        base = baseline.get(name)
+        if not base or not base.get("p95_ms"):
+            continue
+        if stats["p95_ms"] > base["p95_ms"] * (1 + tolerance):
+            regressions.append(f"{name}: p95 {stats['p95_ms']}ms vs baseline {base['p95_ms']}ms")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--vault-sizes", default="10,1000,10000", help="Comma-separated vault sizes to list (up to 50000)")
+    parser.add_argument("--requests", type=int, default=50, help="Requests per measured route")
+    parser.add_argument("--auth-requests", type=int, default=5, help="Signup/login rounds (bcrypt-bound)")
+    parser.add_argument("--mixed-requests", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--blob-bytes", type=int, default=1024, help="Ciphertext size per item before base64")
+    parser.add_argument("--save-baseline", help="Write results as a JSON baseline to this path")
+    parser.add_argument("--compare", help="Compare against a JSON baseline and fail on p95 regressions")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed p95 slowdown vs baseline (0.25 = 25%%)")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    args.vault_sizes = [int(size) for size in args.vault_sizes.split(",") if size]
+    random.seed(args.seed)
+
+    results = asyncio.run(run(args))
+    print_report(results)
+
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(os.path.abspath(args.save_baseline)), exist_ok=True)
+        with open(args.save_baseline, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+        print(f"Baseline written to {args.save_baseline}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            print("Regressions:")
+            for line in regressions:
+                print(f"  {line}")
+            sys.exit(1)
+        print("No regressions against baseline")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""
+Per-item cost of serializing vault listings: the default FastAPI path
+(VaultItemResponse validation + jsonable_encoder + json.dumps) versus the
+fast path in app.utils.fast_json.
+
+Run from backend/:  python -m benchmarks.serialization [--blob-bytes 2048]
+"""
+import argparse
+import datetime
+import json
+import os
+import statistics
+import time
+import uuid
+
+from fastapi.encoders import jsonable_encoder
+from app.db.base import VaultItem
+from app.schemas import VaultItemResponse
+from app.utils.fast_json import dumps, vault_item_dict
+
+SIZES = (100, 1000, 10000)
+
+def make_items(count: int, blob_bytes: int) -> list:
+    now = datetime.datetime.utcnow()
+    user_id = str(uuid.uuid4())
+    return [
+        VaultItem(
+            id=str(uuid.uuid4()),
+            user_id=user_id,
+            type="login",
+            enc_data=os.urandom(blob_bytes),
+            iv=os.urandom(12),
+            auth_tag=None,
+            version=1,
+            created_at=now,
+            last_modified=now,
+        )
+        for _ in range(count)
+    ]
+
+def default_path(items: list) -> bytes:
+    validated = [VaultItemResponse.model_validate(item) for item in items]
+    return json.dumps(jsonable_encoder(validated)).encode("utf-8")
+
+def fast_path(items: list) -> bytes:
+    return dumps([vault_item_dict(item) for item in items])
+
+def measure(fn, items: list, repeat: int) -> float:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(items)
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--blob-bytes", type=int, default=2048, help="Raw ciphertext size per item before base64")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"{'items':>7} {'default us/item':>16} {'fast us/item':>13} {'speedup':>8}")
+    for size in SIZES:
+        items = make_items(size, args.blob_bytes)
+        assert json.loads(default_path(items)) == json.loads(fast_path(items))
+        before = measure(default_path, items, args.repeat) / size * 1e6
+        after = measure(fast_path, items, args.repeat) / size * 1e6
+        print(f"{size:>7} {before:>16.2f} {after:>13.2f} {before / after:>7.1f}x")
+
+if __name__ == "__main__":
+    main()
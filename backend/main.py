@@ -1,17 +1,48 @@
-from fastapi import FastAPI, APIRouter
+from contextlib import asynccontextmanager
+import hmac
+from fastapi import FastAPI, APIRouter, Request, HTTPException
+from fastapi.responses import JSONResponse, PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
-from app.api.v1.endpoints import auth, vault, audit
-from app.db.session import engine, Base
-from app.models import user, item, audit as audit_model
+from app.api.v1.endpoints import auth, vault, reencrypt, attachments, audit, admin
+from app.db.session import async_engine
+from app.db.sharding import shard_router, ShardMoving
+from app.db.migrations import ensure_schema
 from app.core.config import settings
+from app.core import metrics
+from app.core.hashing import PasswordHashingBusy
+from app.core.security import hash_executor
+from app.utils.security_logging import audit_writer
+from app.utils.audit_archive import retention_worker
+from app.core.notifications import change_hub
+from app.api.deps import principal_cache
 
-# Create Tables
-Base.metadata.create_all(bind=engine)
+# Schema version check (applies pending migrations when DB_AUTO_MIGRATE is on),
+# on the primary and on every shard
+for engine in shard_router.engines():
+    ensure_schema(engine)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if settings.AUDIT_BUFFERED:
+        audit_writer.start()
+    if settings.AUDIT_RETENTION_DAYS > 0:
+        retention_worker.start()
+    await change_hub.start()
+    yield
+    await change_hub.stop()
+    retention_worker.stop()
+    # Flush queued audit events before the worker exits
+    audit_writer.stop()
+    hash_executor.shutdown()
+    if async_engine is not None:
+        await async_engine.dispose()
+    await shard_router.dispose_async()
 
 app = FastAPI(
     title="ValutX API",
     description="Zero-Knowledge Password Manager Backend",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # Robust CORS Origins Processing
@@ -34,15 +65,65 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "Idempotent-Replayed", "Content-Range"],
 )
 
+if settings.METRICS_ENABLED:
+    app.middleware("http")(metrics.metrics_middleware)
+
+    metrics.registry.register(metrics.Gauge(
+        "valutx_password_hash_pending", "bcrypt calls in flight on the hashing pool.",
+        lambda: [({}, hash_executor.stats()["pending"])]))
+    metrics.registry.register(metrics.Gauge(
+        "valutx_push_subscribers", "Open vault change event streams on this worker.",
+        lambda: [({}, change_hub.subscriber_count)]))
+    metrics.registry.register(metrics.Gauge(
+        "valutx_audit_queue_depth", "Audit events waiting for the background writer.",
+        lambda: [({}, audit_writer.queue_depth)]))
+    metrics.registry.register(metrics.Gauge(
+        "valutx_principal_cache_hits_total", "get_current_user cache hits.",
+        lambda: [({"cache": name}, values["hits"]) for name, values in principal_cache.stats().items()], kind="counter"))
+    metrics.registry.register(metrics.Gauge(
+        "valutx_principal_cache_misses_total", "get_current_user cache misses.",
+        lambda: [({"cache": name}, values["misses"]) for name, values in principal_cache.stats().items()], kind="counter"))
+
+@app.exception_handler(PasswordHashingBusy)
+async def password_hashing_busy_handler(request: Request, exc: PasswordHashingBusy):
+    return JSONResponse(
+        status_code=503,
+        content={"detail": "Authentication service is busy, please retry shortly"},
+        headers={"Retry-After": "1"},
+    )
+
+@app.exception_handler(ShardMoving)
+async def shard_moving_handler(request: Request, exc: ShardMoving):
+    # Only the user being rebalanced is paused, for a few seconds
+    return JSONResponse(
+        status_code=503,
+        content={"detail": "Account maintenance in progress, please retry shortly"},
+        headers={"Retry-After": str(int(settings.SHARD_DIRECTORY_TTL) + 1)},
+    )
+
 api_router = APIRouter()
 api_router.include_router(auth.router, prefix="/auth", tags=["Auth"])
+api_router.include_router(reencrypt.router, prefix="/vault/reencrypt", tags=["Vault"])
+api_router.include_router(attachments.router, prefix="/vault/attachments", tags=["Vault"])
 api_router.include_router(vault.router, prefix="/vault", tags=["Vault"])
 api_router.include_router(audit.router, prefix="/audit", tags=["Audit"])
+api_router.include_router(admin.router, prefix="/admin", tags=["Admin"])
 
 app.include_router(api_router, prefix="/api/v1")
 
 @app.get("/")
 async def root():
     return {"message": "ValutX Secure Backend is Running"}
+
+@app.get("/metrics", include_in_schema=False)
+async def prometheus_metrics(request: Request):
+    if not settings.METRICS_ENABLED:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if settings.METRICS_TOKEN:
+        supplied = request.headers.get("authorization", "")
+        if not hmac.compare_digest(supplied.encode("utf-8"), f"Bearer {settings.METRICS_TOKEN}".encode("utf-8")):
+            raise HTTPException(status_code=401, detail="Unauthorized")
+    return PlainTextResponse(metrics.registry.render(), media_type="text/plain; version=0.0.4")
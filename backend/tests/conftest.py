@@ -0,0 +1,38 @@
+import os
+import sys
+import tempfile
+import uuid
+
+# Settings are read at import, so point the app at a throwaway database first
+_tmp = tempfile.mkdtemp(prefix="valutx-tests-")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{_tmp}/test.db")
+os.environ.setdefault("ATTACHMENT_DIR", os.path.join(_tmp, "attachments"))
+os.environ.setdefault("AUDIT_ARCHIVE_DIR", os.path.join(_tmp, "audit_archive"))
+os.environ.setdefault("PASSWORD_HASH_WORKERS", "0")
+os.environ.setdefault("RATE_LIMIT_ENABLED", "false")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+from fastapi.testclient import TestClient
+
+@pytest.fixture(scope="session")
+def client():
+    import main
+    with TestClient(main.app) as test_client:
+        yield test_client
+
+@pytest.fixture
+def auth_headers(client):
+    """
+    Signs up a fresh account and returns its bearer header.
+    """
+    email = f"{uuid.uuid4().hex}@example.com"
+    credentials = {"email": email, "auth_hash_derived": "h"}
+    response = client.post("/api/v1/auth/signup", json=dict(credentials, kdf_salt="s", encrypted_dek="d"))
+    assert response.status_code == 200, response.text
+    response = client.post("/api/v1/auth/login", json=credentials)
+    assert response.status_code == 200, response.text
+    return {"Authorization": "Bearer " + response.json()["access_token"]}
+
+def vault_item(n: int = 0) -> dict:
+    return {"type": "login", "enc_data": "ZW5j%04d" % n, "iv": "aXY=", "auth_tag": None}
@@ -0,0 +1,55 @@
+import asyncio
+import os
+import signal
+import time
+import pytest
+from app.core.hashing import PasswordHashExecutor, PasswordHashingBusy
+
+# Module-level so the spawned pool workers can import them
+def sleep_for(seconds):
+    time.sleep(seconds)
+    return seconds
+
+def kill_worker():
+    os.kill(os.getpid(), signal.SIGKILL)
+
+def test_broken_pool_is_busy_and_rebuilt():
+    async def scenario():
+        executor = PasswordHashExecutor(workers=1, max_pending=2, timeout=10)
+        try:
+            assert await executor.run(sleep_for, 0.01) == 0.01
+            # A dead worker is a 503, never a wrong password, and frees its slot
+            with pytest.raises(PasswordHashingBusy):
+                await executor.run(kill_worker)
+            assert executor.stats()["pending"] == 0
+            assert await executor.run(sleep_for, 0.02) == 0.02
+        finally:
+            executor.shutdown()
+    asyncio.run(scenario())
+
+def test_timed_out_hash_keeps_its_slot_until_done():
+    async def scenario():
+        executor = PasswordHashExecutor(workers=1, max_pending=2, timeout=10)
+        try:
+            # Warm the pool so the timeout below covers only the hash
+            await executor.run(sleep_for, 0)
+            executor.timeout = 0.1
+            with pytest.raises(PasswordHashingBusy):
+                await executor.run(sleep_for, 0.6)
+            assert executor.stats()["pending"] == 1
+            await asyncio.sleep(0.8)
+            assert executor.stats()["pending"] == 0
+        finally:
+            executor.shutdown()
+    asyncio.run(scenario())
+
+def test_thread_path_honours_max_pending():
+    async def scenario():
+        executor = PasswordHashExecutor(workers=0, max_pending=1, timeout=10)
+        running = asyncio.ensure_future(executor.run(sleep_for, 0.3))
+        await asyncio.sleep(0.05)
+        with pytest.raises(PasswordHashingBusy):
+            await executor.run(sleep_for, 0)
+        await running
+        assert executor.stats()["pending"] == 0
+    asyncio.run(scenario())
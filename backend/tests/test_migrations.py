@@ -0,0 +1,38 @@
+import datetime
+import logging
+from sqlalchemy import create_engine, func, select
+from app.db.base import Base
+from app.db.migrations import baseline_metadata, head_version, upgrade, vault_items_quarantine
+
+USER_ID = "6f1c2a9e-2b1d-4c55-9d1f-0a6a7f0e1a11"
+GOOD_ID = "0b7a6b1e-5f43-4a0e-8f5a-1c2d3e4f5a6b"
+LEGACY_ID = "2b7a6b1e-5f43-4a0e-8f5a-1c2d3e4f5a6b"
+
+def test_upgrade_quarantines_legacy_items_that_are_not_base64(tmp_path, caplog):
+    engine = create_engine(f"sqlite:///{tmp_path}/legacy.db")
+    now = datetime.datetime.utcnow()
+    tables = baseline_metadata.tables
+    with engine.begin() as conn:
+        baseline_metadata.create_all(conn)
+        conn.execute(tables["users"].insert().values(
+            id=USER_ID, email="legacy@example.com", auth_hash="x", kdf_salt="s", encrypted_dek="d", created_at=now
+        ))
+        conn.execute(tables["vault_items"].insert(), [
+            dict(id=GOOD_ID, user_id=USER_ID, type="login", enc_data="ZW5j", iv="aXY=", created_at=now, last_modified=now),
+            # Stored as-is by versions that did not validate blobs
+            dict(id=LEGACY_ID, user_id=USER_ID, type="login", enc_data="plain text!", iv="aXY=", created_at=now, last_modified=now),
+        ])
+
+    with caplog.at_level(logging.WARNING, logger="app.db.migrations"):
+        assert upgrade(engine) == head_version()
+    assert LEGACY_ID in caplog.text
+
+    items = Base.metadata.tables["vault_items"]
+    with engine.connect() as conn:
+        assert conn.execute(select(items.c.enc_data).where(items.c.id == GOOD_ID)).scalar() == b"enc"
+        assert conn.execute(select(func.count()).select_from(items)).scalar() == 1
+        quarantined = conn.execute(select(
+            vault_items_quarantine.c.id, vault_items_quarantine.c.enc_data, vault_items_quarantine.c.reason
+        )).all()
+    assert [(row.id, row.enc_data) for row in quarantined] == [(LEGACY_ID, "plain text!")]
+    assert "enc_data" in quarantined[0].reason
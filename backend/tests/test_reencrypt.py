@@ -0,0 +1,52 @@
+import base64
+import hashlib
+import threading
+import time
+from app.api.v1.endpoints import reencrypt
+from conftest import vault_item
+
+def _rewrapped(item_id: str) -> dict:
+    return {"id": item_id, "version": 1, "enc_data": base64.b64encode(b"new").decode(), "iv": "bmV3aXY="}
+
+def test_commit_is_not_raced_by_a_concurrent_create(client, auth_headers, monkeypatch):
+    ids = [client.post("/api/v1/vault/", json=vault_item(n), headers=auth_headers).json()["id"] for n in range(5)]
+    session_id = client.post("/api/v1/vault/reencrypt/", headers=auth_headers).json()["id"]
+    response = client.put(
+        f"/api/v1/vault/reencrypt/{session_id}/items",
+        json={"items": [_rewrapped(item_id) for item_id in ids]}, headers=auth_headers
+    )
+    assert response.status_code == 200, response.text
+
+    # Start a create while the commit is under way and give it time to land
+    created = {}
+    def create():
+        result = client.post("/api/v1/vault/", json=vault_item(99), headers=auth_headers)
+        created["at"], created["status"] = time.monotonic(), result.status_code
+    racer = threading.Thread(target=create)
+    progress = reencrypt._progress
+    def racing_progress(*args, **kwargs):
+        result = progress(*args, **kwargs)
+        if racer.ident is None:
+            racer.start()
+            time.sleep(0.5)
+        return result
+    monkeypatch.setattr(reencrypt, "_progress", racing_progress)
+
+    response = client.post(f"/api/v1/vault/reencrypt/{session_id}/commit", json={"encrypted_dek": "dek2"}, headers=auth_headers)
+    committed_at = time.monotonic()
+    racer.join(10)
+
+    assert created["status"] == 200
+    if response.status_code == 200:
+        # The create waited for the swap instead of slipping in under the old key
+        assert created["at"] >= committed_at - 0.05
+    else:
+        assert response.status_code == 409
+
+def test_rotation_is_refused_while_attachments_exist(client, auth_headers):
+    data = b"x" * 10
+    response = client.put(f"/api/v1/vault/attachments/{hashlib.sha256(data).hexdigest()}", content=data, headers=auth_headers)
+    assert response.status_code == 201, response.text
+    response = client.post("/api/v1/vault/reencrypt/", headers=auth_headers)
+    assert response.status_code == 409
+    assert "attachments" in response.json()["detail"]
@@ -0,0 +1,18 @@
+import uuid
+from app.db.base import Base
+from app.db.session import SessionLocal
+from app.db.sharding import ShardRouter
+from app.models.shard import UserShard
+
+def test_email_routing_follows_the_directory(client, tmp_path):
+    router = ShardRouter([f"sqlite:///{tmp_path}/s0.db", f"sqlite:///{tmp_path}/s1.db"])
+    for shard in router.shards:
+        Base.metadata.create_all(shard.engine)
+    email = f"{uuid.uuid4().hex}@example.com"
+    with SessionLocal() as db:
+        db.add(UserShard(user_id=str(uuid.uuid4()), email=email, shard=1))
+        db.commit()
+
+    assert router.email_session_factory(email) is router.shards[1].SessionLocal
+    # Not in the directory: no shard is asked, not even shard 0
+    assert router.email_session_factory(f"{uuid.uuid4().hex}@example.com") is None
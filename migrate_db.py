@@ -1,42 +1,23 @@
-import sqlite3
+import os
+import sys
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend")
 
 def upgrade():
-    conn = sqlite3.connect('backend/valutx.db')
-    cursor = conn.cursor()
-    
-    # Check if version column exists in vault_items
-    cursor.execute("PRAGMA table_info(vault_items)")
-    columns = [col[1] for col in cursor.fetchall()]
-    
-    if 'version' not in columns:
-        print("Adding 'version' column to 'vault_items'...")
-        cursor.execute("ALTER TABLE vault_items ADD COLUMN version INTEGER DEFAULT 1 NOT NULL")
-        conn.commit()
-    else:
-        print("'version' column already exists in 'vault_items'.")
+    # Schema changes are versioned in backend/app/db/migrations.py; this wrapper
+    # runs them from the repo root against the configured DATABASE_URL
+    # (relative SQLite paths resolve inside backend/, as before).
+    os.chdir(BACKEND_DIR)
+    sys.path.insert(0, BACKEND_DIR)
 
-    # Check if audit_logs table exists
-    cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='audit_logs'")
-    if not cursor.fetchone():
-        print("Creating 'audit_logs' table...")
-        cursor.execute("""
-            CREATE TABLE audit_logs (
-                id VARCHAR PRIMARY KEY,
-                user_id VARCHAR NOT NULL,
-                event_type VARCHAR NOT NULL,
-                severity VARCHAR DEFAULT 'INFO',
-                details TEXT,
-                ip_address VARCHAR,
-                user_agent VARCHAR,
-                timestamp DATETIME,
-                FOREIGN KEY (user_id) REFERENCES users (id)
-            )
-        """)
-        conn.commit()
-    else:
-        print("'audit_logs' table already exists.")
+    import logging
+    from app.db.migrations import upgrade as run_migrations
+    from app.db.sharding import shard_router
 
-    conn.close()
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    # The primary, then each shard database (if DATABASE_SHARD_URLS is set)
+    for engine in shard_router.engines():
+        print(f"{engine.url!r}: schema at version {run_migrations(engine)}")
 
 if __name__ == "__main__":
     upgrade()